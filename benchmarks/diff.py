@@ -0,0 +1,61 @@
+"""
+Measure the word tokenizer behind anonymization diffs.
+
+Compares :func:`yakbak.diff.diff_wordsToChars` to the original
+implementation on generated talk-like text of several sizes::
+
+    $ python -m benchmarks.diff --sizes 10000 100000 1000000
+
+"""
+from functools import partial
+from typing import Callable, List
+import argparse
+import random
+
+from benchmarks.util import measure
+from yakbak.diff import diff_wordsToChars
+from yakbak.tests.diff_reference import reference_diff_wordsToChars
+
+
+def make_text(size: int, seed: int) -> str:
+    """Generate about ``size`` characters of words, lines and paragraphs."""
+    rng = random.Random(seed)
+    vocabulary = [
+        "".join(
+            rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(1, 10))
+        )
+        for _ in range(5000)
+    ]
+    separators = [" "] * 20 + ["\n", "\n\n", "  ", "\t"]
+    parts: List[str] = []
+    length = 0
+    while length < size:
+        part = rng.choice(vocabulary) + rng.choice(separators)
+        parts.append(part)
+        length += len(part)
+    return "".join(parts)[:size]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10 ** 4, 10 ** 5, 10 ** 6]
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    implementations: List[Callable] = [reference_diff_wordsToChars, diff_wordsToChars]
+    for size in args.sizes:
+        original, edited = make_text(size, seed=1), make_text(size, seed=2)
+        timings = [
+            measure(partial(func, original, edited), args.repeat)
+            for func in implementations
+        ]
+        print(
+            f"{size:>9} chars  original {timings[0] * 1000:9.1f} ms"
+            f"  new {timings[1] * 1000:9.1f} ms  ({timings[0] / timings[1]:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
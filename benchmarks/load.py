@@ -0,0 +1,212 @@
+"""
+Replay busy periods against a running Yak-Bak and report latency per endpoint.
+
+Two scenarios are available:
+
+- ``voting``, a reviewer voting sprint: each reviewer opens the voting
+  page, picks a category, and votes on the talk it is given, repeatedly.
+- ``submissions``, the rush before the CFP deadline: each speaker opens
+  the new talk form, submits a proposal, and checks their talk list.
+
+Seed the database and open the voting or proposal window first, then run
+the driver with the same settings as the server (it signs magic links to
+log its users in, and picks them from the database)::
+
+    $ flask seed-data --users 2000 --reviewers 40 --talks 600 --votes 0
+    $ python -m benchmarks.load voting --base-url http://localhost:5000 \\
+        --clients 20 --iterations 25
+
+"""
+from collections import defaultdict
+from threading import Lock, Thread
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional
+import argparse
+import random
+import re
+
+import requests
+
+from benchmarks.util import make_app
+from yakbak.auth import get_magic_link_token_and_expiry
+from yakbak.models import User
+from yakbak.types import Application
+
+CSRF_RE = re.compile(r'<input[^>]*name="csrf_token"[^>]*value="([^"]*)"')
+CATEGORY_RE = re.compile(r'href="(/vote/category/\d+)"')
+LENGTH_RE = re.compile(r'<option[^>]*value="(\d+)"')
+
+
+class Stats:
+    """Thread-safe request latencies, by endpoint."""
+
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self._lock = Lock()
+
+    def record(self, endpoint: str, seconds: float, ok: bool) -> None:
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def report(self) -> None:
+        header = ("endpoint", "count", "errors", "p50 ms", "p95 ms", "p99 ms", "max ms")
+        rows = []
+        for endpoint, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            rows.append(
+                (endpoint, str(len(latencies)), str(self.errors[endpoint]))
+                + tuple(
+                    f"{percentile(latencies, p) * 1000:.1f}" for p in (50, 95, 99, 100)
+                )
+            )
+        width = max(len(row[0]) for row in rows + [header])
+        for row in [header] + rows:
+            print(f"{row[0]:<{width}}" + "".join(f"{cell:>10}" for cell in row[1:]))
+
+
+def percentile(ordered: List[float], p: float) -> float:
+    """Return the ``p``th percentile of ``ordered`` by the nearest-rank method."""
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+class VirtualUser:
+    """One user's browser session."""
+
+    def __init__(self, base_url: str, stats: Stats, rng: random.Random) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.stats = stats
+        self.rng = rng
+        self.session = requests.Session()
+
+    def request(
+        self, endpoint: str, method: str, path: str, **kwargs: Any
+    ) -> requests.Response:
+        """Make a request, without following redirects, and time it."""
+        start = perf_counter()
+        resp = self.session.request(
+            method, self.base_url + path, allow_redirects=False, **kwargs
+        )
+        self.stats.record(endpoint, perf_counter() - start, resp.status_code < 400)
+        return resp
+
+    def location(self, resp: requests.Response) -> str:
+        return resp.headers["Location"].replace(self.base_url, "", 1)
+
+    def csrf_token(self, resp: requests.Response) -> str:
+        match = CSRF_RE.search(resp.text)
+        return match.group(1) if match else ""
+
+    def log_in(self, token: str) -> None:
+        self.request("GET /login/token/<token>", "GET", f"/login/token/{token}")
+
+    def vote(self) -> None:
+        resp = self.request("GET /vote", "GET", "/vote")
+        categories = CATEGORY_RE.findall(resp.text)
+        if not categories:
+            return
+
+        path = self.rng.choice(categories)
+        resp = self.request("GET /vote/category/<id>", "GET", path)
+        path = self.location(resp)
+        if not path.startswith("/vote/cast/"):
+            return  # no talks left in the category
+
+        resp = self.request("GET /vote/cast/<id>", "GET", path)
+        data = {
+            "csrf_token": self.csrf_token(resp),
+            "action": "vote",
+            "value": self.rng.choice((-1, 0, 1)),
+            "comment": "Load test vote",
+        }
+        self.request("POST /vote/cast/<id>", "POST", path, data=data)
+
+    def submit_talk(self) -> None:
+        resp = self.request("GET /talks/new", "GET", "/talks/new")
+        lengths = LENGTH_RE.findall(resp.text) or ["25"]
+        data = {
+            "csrf_token": self.csrf_token(resp),
+            "title": f"Load test talk {self.rng.randrange(10 ** 6)}",
+            "length": self.rng.choice(lengths),
+            "description": "A talk submitted by the load test driver.",
+            "outline": "1. Load\n2. Test",
+            "take_aways": "Things about load testing",
+            "accepted_recording_release": "y",
+        }
+        resp = self.request("POST /talks/new", "POST", "/talks/new", data=data)
+        if resp.status_code == 302:
+            self.request("GET /talks/<id>/preview", "GET", self.location(resp))
+        self.request("GET /talks", "GET", "/talks")
+
+
+SCENARIOS: Dict[str, Callable[[VirtualUser], None]] = {
+    "voting": VirtualUser.vote,
+    "submissions": VirtualUser.submit_talk,
+}
+
+
+def magic_link_tokens(app: Application, reviewers: bool, count: int) -> List[str]:
+    """Sign a magic link token for each of ``count`` users."""
+    with app.app_context():
+        users = User.query.filter_by(reviewer=reviewers).limit(count).all()
+        if len(users) < count:
+            kind = "reviewers" if reviewers else "non-reviewers"
+            raise SystemExit(f"Only {len(users)} {kind} in the database")
+        return [get_magic_link_token_and_expiry(u.email)[0] for u in users]
+
+
+def run(
+    scenario: str,
+    base_url: str,
+    tokens: List[str],
+    iterations: int,
+    seed: Optional[int] = None,
+) -> Stats:
+    """Run ``scenario`` with one thread per token, and return the latencies."""
+    stats = Stats()
+    step = SCENARIOS[scenario]
+
+    def client(token: str, rng: random.Random) -> None:
+        user = VirtualUser(base_url, stats, rng)
+        user.log_in(token)
+        for _ in range(iterations):
+            step(user)
+
+    seeds = random.Random(seed)
+    threads = [
+        Thread(target=client, args=(token, random.Random(seeds.random())))
+        for token in tokens
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--base-url", default="http://localhost:5000")
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    app = make_app()
+    tokens = magic_link_tokens(app, args.scenario == "voting", args.clients)
+
+    start = perf_counter()
+    stats = run(args.scenario, args.base_url, tokens, args.iterations, args.seed)
+    elapsed = perf_counter() - start
+
+    stats.report()
+    total = sum(len(latencies) for latencies in stats.latencies.values())
+    print(f"{total} requests in {elapsed:.1f}s ({total / elapsed:.1f} requests/s)")
+
+
+if __name__ == "__main__":
+    main()
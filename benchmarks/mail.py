@@ -0,0 +1,67 @@
+"""
+Measure mail delivery throughput against a local SMTP server.
+
+Compares sending each message with :func:`yakbak.mail.send_mail`, which
+opens a connection per message, to :func:`yakbak.mail.send_mail_batch`.
+No database is needed; configure the app as for the tests, then run::
+
+    $ python -m benchmarks.mail --messages 500
+
+"""
+from typing import List
+import argparse
+
+from flask import g
+
+from benchmarks.util import make_app, measure, report
+from yakbak import mail
+from yakbak.models import Conference
+from yakbak.tests.smtp_sink import SMTPSink
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    app = make_app()
+    jobs: List[mail.MailJob] = [
+        mail.MailJob(
+            to=[f"speaker{i}@example.com"],
+            template="email/magic-link",
+            context={
+                "magic_link": f"https://example.com/login/{i}",
+                "magic_link_expiration": "2 hours",
+            },
+        )
+        for i in range(args.messages)
+    ]
+
+    def one_by_one() -> None:
+        for job in jobs:
+            mail.send_mail(job.to, job.template, **job.context)
+
+    def batched() -> None:
+        results = mail.send_mail_batch(jobs)
+        assert all(r.ok for r in results)
+
+    with SMTPSink() as sink, app.test_request_context():
+        state = app.extensions["mail"]
+        state.server, state.port, state.use_tls = sink.host, sink.port, False
+        state.suppress = False
+        g.conference = Conference(full_name="BenchConf 2019", informal_name="Bench")
+
+        report(
+            {
+                "send_mail": measure(one_by_one, args.repeat),
+                "send_mail_batch": measure(batched, args.repeat),
+            },
+            args.messages,
+            "messages",
+        )
+        print(f"({sink.connections} connections to the SMTP sink)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Measure how long it takes to render one email.
+
+Compares :func:`yakbak.mail.render_template`, which renders templates
+compiled once per process, to rendering the whole template with Flask
+and parsing the frontmatter of the result, as it used to. No database
+is needed; configure the app as for the tests, then run::
+
+    $ python -m benchmarks.mail_render --emails 2000
+
+"""
+from typing import Any, Dict
+import argparse
+
+from flask import g, render_template
+import frontmatter
+
+from benchmarks.util import make_app, measure
+from yakbak import mail
+from yakbak.models import Conference
+
+
+def render_and_parse(template: str, context: Dict[str, Any]) -> None:
+    parsed = frontmatter.loads(render_template(template, **context))
+    mail.MailMeta(parsed["subject"], parsed.get("sender"))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--emails", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    app = make_app()
+    template = "email/magic-link"
+    context = {
+        "magic_link": "https://example.com/login/abcdef",
+        "magic_link_expiration": "2 hours",
+    }
+
+    def compiled() -> None:
+        for _ in range(args.emails):
+            mail.render_template(template, **context)
+
+    def uncompiled() -> None:
+        for _ in range(args.emails):
+            render_and_parse(template, context)
+
+    with app.test_request_context():
+        g.conference = Conference(full_name="BenchConf 2019", informal_name="Bench")
+        for name, func in [
+            ("compiled", compiled),
+            ("render + frontmatter", uncompiled),
+        ]:
+            seconds = measure(func, args.repeat)
+            print(f"{name:<20}  {seconds / args.emails * 1e6:8.1f} us/email")
+
+
+if __name__ == "__main__":
+    main()
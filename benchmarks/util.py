@@ -0,0 +1,29 @@
+from typing import Any, Callable, Dict
+import time
+
+from yakbak.core import create_app
+from yakbak.settings import load_settings_from_env
+from yakbak.types import Application
+
+
+def make_app(**flask_config: Any) -> Application:
+    """Create an app configured from the environment, like ``wsgi.py``."""
+    return create_app(load_settings_from_env(), flask_config)
+
+
+def measure(func: Callable[[], Any], repeat: int = 3) -> float:
+    """Return the best wall-clock time, in seconds, of ``repeat`` calls."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def report(results: Dict[str, float], count: int, unit: str) -> None:
+    """Print ``count / seconds`` for each result, fastest first."""
+    width = max(len(name) for name in results)
+    for name, seconds in sorted(results.items(), key=lambda item: item[1]):
+        rate = count / seconds
+        print(f"{name:<{width}}  {seconds * 1000:10.1f} ms  {rate:12.1f} {unit}/s")
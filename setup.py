@@ -27,6 +27,7 @@ setup(
         "flask-wtf",
         "itsdangerous",
         "markdown",
+        "prometheus-client",
         "python-frontmatter",
         "python-social-auth",
         "sentry-sdk[flask]",
@@ -1,2 +1,4 @@
 #!/bin/sh
+# metrics from previous runs would otherwise be added to the new ones
+rm -rf /tmp/yakbak-metrics && mkdir /tmp/yakbak-metrics && chown uwsgi:uwsgi /tmp/yakbak-metrics
 flask sync_db && uwsgi --ini /code/uwsgi.ini
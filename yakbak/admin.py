@@ -4,6 +4,7 @@ from bunch import Bunch
 from flask import (
     abort,
     Blueprint,
+    current_app,
     flash,
     g,
     redirect,
@@ -20,20 +21,22 @@ from wtforms import Field, Form
 from wtforms.validators import ValidationError
 
 from yakbak import mail
+from yakbak.cache import markdown_cache
+from yakbak.demographics import survey_demographics
 from yakbak.forms import CategorizeForm, TalkForm
+from yakbak.instrumentation import sql_stats
 from yakbak.models import (
     Category,
     ConductReport,
     Conference,
     db,
     DemographicSurvey,
-    Ethnicity,
-    Gender,
     InvitationStatus,
     Talk,
     User,
     Vote,
 )
+from yakbak.view_helpers import PageValidators
 
 app = Blueprint("manage", __name__)
 
@@ -54,25 +57,26 @@ def index() -> Response:
         Talk.query.active().filter_by(is_anonymized=False).count()
     )
 
-    # TODO: figure out how to do this with "not in JSON list" queires
-    num_surveys = 0
-    num_non_man = 0
-    num_non_white = 0
-    for survey in DemographicSurvey.query.all():
-        num_surveys += 1
-        if survey.doesnt_have_gender(Gender.MAN):
-            num_non_man += 1
-        if survey.doesnt_have_ethnicity(Ethnicity.WHITE_CAUCASIAN):
-            num_non_white += 1
-
     return render_template(
         "manage/index.html",
         num_talks=num_talks,
         num_without_category=num_without_category,
         num_without_anonymization=num_without_anonymization,
-        num_surveys=num_surveys,
-        num_non_man=num_non_man,
-        num_non_white=num_non_white,
+        demographics=survey_demographics(),
+    )
+
+
+@app.route("/sql-stats", methods=["GET", "POST"])
+def sql_stats_view() -> Response:
+    if request.method == "POST":
+        sql_stats.clear()
+        flash("SQL stats cleared")
+        return redirect(url_for("manage.sql_stats_view"))
+
+    return render_template(
+        "manage/sql_stats.html",
+        sample_rate=current_app.settings.logging.sql_sample_rate,
+        endpoints=sql_stats.by_db_time(),
     )
 
 
@@ -144,6 +148,11 @@ def anonymize_talk(talk_id: int) -> Response:
         )
         db.session.add(talk)
         db.session.commit()
+        markdown_cache.prerender(
+            talk.anonymized_description,
+            talk.anonymized_outline,
+            talk.anonymized_take_aways,
+        )
 
         db.session.refresh(talk)
         speakers = [
@@ -159,6 +168,7 @@ def anonymize_talk(talk_id: int) -> Response:
                 talk_id=talk.talk_id,
                 title=talk.title,
             )
+            db.session.commit()
 
         if request.form.get("save-and-next"):
             return redirect(url_for("manage.anonymize_talks"))
@@ -172,8 +182,17 @@ def anonymize_talk(talk_id: int) -> Response:
 
 @app.route("/anonymize/<int:talk_id>/preview")
 def preview_anonymized_talk(talk_id: int) -> Response:
+    updated = db.session.query(Talk.updated).filter_by(talk_id=talk_id).scalar()
+    if updated is None:
+        abort(404)
+    validators = PageValidators(updated)
+    if validators.fresh():
+        return validators.make_response(status=304)
+
     talk = Talk.query.get_or_404(talk_id)
-    return render_template("anonymized_talk_preview.html", talk=talk, mode="admin")
+    return validators.make_response(
+        render_template("anonymized_talk_preview.html", talk=talk, mode="admin")
+    )
 
 
 class AuthMixin:
@@ -218,6 +237,11 @@ class ConferenceView(ModelView):
     form_args = dict(twitter_username=dict(validators=[_must_not_start_with("@")]))
 
 
+class TalkView(ModelView):
+    # maintained from the vote table, see Talk.reconcile_vote_counters
+    form_excluded_columns = ("vote_count", "vote_score")
+
+
 flask_admin = Admin(
     index_view=AdminDashboard(url="/manage/db"),
     template_mode="bootstrap3",
@@ -225,7 +249,7 @@ flask_admin = Admin(
 )
 flask_admin.add_view(ConferenceView(Conference, db.session))
 flask_admin.add_view(
-    ModelView(
+    TalkView(
         Talk,
         db.session,
         include=(
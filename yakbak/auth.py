@@ -1,33 +1,116 @@
+from datetime import datetime, timedelta
 from hashlib import sha256
-from typing import Optional, Tuple
+from typing import Any, Optional, Sequence, Tuple
 
 from flask import current_app
 from flask_login import LoginManager
-from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+from itsdangerous import (
+    BadSignature,
+    SignatureExpired,
+    TimestampSigner,
+    URLSafeTimedSerializer,
+)
+from sqlalchemy.dialects.postgresql import insert
 
-from yakbak.models import User
+from yakbak.cache import BloomFilter, get_user
+from yakbak.models import db, UsedMagicLink, User
+from yakbak.types import Application
 
 login_manager = LoginManager()
 login_manager.login_view = "views.login"
 
+# fingerprints of the magic link tokens this process has claimed
+used_magic_links = BloomFilter(capacity=100000, error_rate=0.001)
+
 
 @login_manager.user_loader
 def load_user(user_id: str) -> Optional[User]:
     try:
-        return User.query.get(int(user_id))
+        return get_user(int(user_id))
     except (TypeError, ValueError):
         return None
 
 
-def get_magic_link_serializer() -> URLSafeTimedSerializer:
+class _TimestampSigner(TimestampSigner):
+    # itsdangerous derives the HMAC key from the secret on every use
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._derived_key = super().derive_key()
+
+    def derive_key(self) -> bytes:
+        return self._derived_key
+
+
+class _Serializer(URLSafeTimedSerializer):
+    # and makes a new signer for every token it signs or loads
+    default_signer = _TimestampSigner
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._signer = super().make_signer()
+
+    def make_signer(self, salt: Optional[str] = None) -> TimestampSigner:
+        if salt is None or salt == self.salt:
+            return self._signer
+        return super().make_signer(salt)
+
+
+class MagicLinkSigner:
+    """
+    Signs magic link tokens with the first of ``keys``, and accepts tokens
+    signed with any of them.
+
+    To rotate the signing key, make the new key the first and keep the
+    old ones until the links they signed have expired. One signer is
+    made per app, by :func:`set_up_magic_links`.
+
+    """
+
     # NB: changing this will probably invalidate any magic links in the wild
-    return URLSafeTimedSerializer(
-        secret_key=current_app.settings.auth.signing_key,
-        salt="email-magic-link",
-        signer_kwargs=dict(digest_method=sha256),
+    salt = "email-magic-link"
+
+    def __init__(self, keys: Sequence[str], max_age: Optional[int]) -> None:
+        self.max_age = max_age
+        self.serializers = [
+            _Serializer(
+                secret_key=key, salt=self.salt, signer_kwargs=dict(digest_method=sha256)
+            )
+            for key in keys
+        ]
+
+    def dumps(self, email: str) -> str:
+        if not self.serializers:
+            raise RuntimeError("magic links need the auth.signing_key setting")
+        token = self.serializers[0].dumps(email)
+        if isinstance(token, bytes):
+            token = token.decode("us-ascii")
+        return token
+
+    def loads(self, token: str) -> Optional[str]:
+        for serializer in self.serializers:
+            try:
+                return serializer.loads(token, max_age=self.max_age)
+            except SignatureExpired:
+                # signed with this key, but too long ago
+                return None
+            except BadSignature:
+                continue
+        return None
+
+
+def set_up_magic_links(app: Application) -> None:
+    settings = app.settings.auth
+    keys = [settings.signing_key] if settings.signing_key else []
+    keys.extend(settings.previous_signing_keys)
+    app.extensions["magic_link_signer"] = MagicLinkSigner(
+        keys, settings.email_magic_link_expiry
     )
 
 
+def get_magic_link_signer() -> MagicLinkSigner:
+    return current_app.extensions["magic_link_signer"]
+
+
 def get_magic_link_token_and_expiry(email: str) -> Tuple[str, str]:
     authsettings = current_app.settings.auth
     exp = authsettings.email_magic_link_expiry
@@ -51,11 +134,7 @@ def get_magic_link_token_and_expiry(email: str) -> Tuple[str, str]:
         plural = "s" if rem > 1 else ""
         expiry = f"{rem} second{plural}"
 
-    serializer = get_magic_link_serializer()
-    token = serializer.dumps(email)
-    if isinstance(token, bytes):
-        token = token.decode("us-ascii")
-
+    token = get_magic_link_signer().dumps(email)
     return token, expiry
 
 
@@ -69,10 +148,44 @@ def parse_magic_link_token(token: str) -> Optional[str]:
     hasn't expired. Returns ``None`` in all other cases.
 
     """
-    serializer = get_magic_link_serializer()
+    return get_magic_link_signer().loads(token)
+
+
+def magic_link_fingerprint(token: str) -> bytes:
+    return sha256(token.encode("utf8")).digest()[:16]
+
+
+def claim_magic_link_token(token: str) -> bool:
+    """
+    Record that the magic link ``token`` has been used to log in.
+
+    Returns ``False`` if it had already been used, by this or any other
+    process. The record is added to the current transaction, which the
+    caller must commit; a concurrent claim of the same token waits for
+    that commit, and then fails. Tokens this process has claimed are
+    remembered in a Bloom filter, so that a replay of one of them costs
+    a read rather than a conflicting write.
+
+    """
+    fingerprint = magic_link_fingerprint(token)
+    if fingerprint in used_magic_links:
+        # probably a replay, but the database knows for sure
+        claimed = db.session.query(
+            UsedMagicLink.query.filter_by(fingerprint=fingerprint).exists()
+        ).scalar()
+        if claimed:
+            return False
+
+    # keep the record until the token would have expired anyway; it was
+    # signed before now, so it can't outlive now plus the expiry
     expiry = current_app.settings.auth.email_magic_link_expiry
-    try:
-        email = serializer.loads(token, max_age=expiry)
-        return email
-    except (BadSignature, SignatureExpired):
-        return None
+    expires_on = None
+    if expiry is not None:
+        expires_on = datetime.utcnow() + timedelta(seconds=expiry)
+
+    statement = insert(UsedMagicLink.__table__).values(
+        fingerprint=fingerprint, expires_on=expires_on
+    )
+    result = db.session.execute(statement.on_conflict_do_nothing())
+    used_magic_links.add(fingerprint)
+    return result.rowcount == 1
@@ -0,0 +1,411 @@
+"""
+Per-process caches for data that is read on (nearly) every request.
+
+Caches here are shared by all threads of a worker process; they are not
+shared between processes, so each one must tolerate serving a value for
+up to its TTL after another process changed the underlying rows.
+
+"""
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from threading import Lock
+from time import monotonic
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    Hashable,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+import hashlib
+import math
+
+from markdown import __version__ as markdown_version, markdown
+from sqlalchemy import event, inspect
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import (
+    load_only,
+    make_transient_to_detached,
+    object_session,
+    Session,
+)
+
+from yakbak.metrics import CACHE_LOOKUPS
+from yakbak.models import Conference, db, RenderedMarkdown, User
+from yakbak.types import Application
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    """
+    A thread-safe cache whose entries expire ``ttl`` seconds after loading.
+
+    ``hits`` and ``misses`` count lookups so that the effectiveness of
+    the cache can be checked. Lookups in caches with a ``name`` are also
+    counted in the ``yakbak_cache_lookups_total`` metric.
+
+    """
+
+    def __init__(self, ttl: float, name: Optional[str] = None) -> None:
+        self.ttl = ttl
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[K, Tuple[float, V]] = {}
+        self._generation = 0
+        self._lock = Lock()
+
+    def get_or_load(self, key: K, loader: Callable[[], V]) -> V:
+        """
+        Return the cached value for ``key``, calling ``loader`` on a miss.
+
+        The loader runs outside the lock, so concurrent misses may each
+        call it; the last one to finish wins.
+
+        """
+        now = monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                self._count("hit")
+                return entry[1]
+            self.misses += 1
+            self._count("miss")
+            generation = self._generation
+
+        value = loader()
+
+        with self._lock:
+            # don't store a value loaded before an invalidation finished
+            if generation == self._generation:
+                self._entries[key] = (now + self.ttl, value)
+        return value
+
+    def _count(self, result: str) -> None:
+        if self.name is not None:
+            CACHE_LOOKUPS.labels(self.name, result).inc()
+
+    def invalidate(self, key: Optional[K] = None) -> None:
+        """
+        Drop the entry for ``key``, or every entry if ``key`` is ``None``.
+
+        """
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+class LRUCache(Generic[K, V]):
+    """
+    A thread-safe cache of the ``maxsize`` most recently used entries.
+
+    Suited to values that never go stale, such as those keyed by a hash
+    of their inputs. Like :class:`TTLCache`, lookups are counted in
+    ``hits`` and ``misses``, and in metrics if the cache has a ``name``.
+
+    """
+
+    def __init__(self, maxsize: int, name: Optional[str] = None) -> None:
+        self.maxsize = maxsize
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[K, V]" = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: K) -> Optional[V]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                self._count("miss")
+            else:
+                self.hits += 1
+                self._count("hit")
+                self._entries.move_to_end(key)
+            return value
+
+    def _count(self, result: str) -> None:
+        if self.name is not None:
+            CACHE_LOOKUPS.labels(self.name, result).inc()
+
+    def set(self, key: K, value: V) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class BloomFilter:
+    """
+    A thread-safe, fixed-size set of ``bytes`` that may have false positives.
+
+    ``item in bloom_filter`` is ``False`` for items that were never added,
+    and ``True`` for those that were, but also for about ``error_rate``
+    of those that weren't. Once ``capacity`` items have been added the
+    filter empties itself and starts over, so that the error rate stays
+    bounded; it only ever remembers recently added items.
+
+    """
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        self.capacity = capacity
+        self.num_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self._count = 0
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, item: bytes) -> bool:
+        positions = self._positions(item)
+        with self._lock:
+            return all(self._bits[p // 8] & (1 << p % 8) for p in positions)
+
+    def add(self, item: bytes) -> None:
+        positions = self._positions(item)
+        with self._lock:
+            if self._count >= self.capacity:
+                self._bits = bytearray(len(self._bits))
+                self._count = 0
+            for p in positions:
+                self._bits[p // 8] |= 1 << p % 8
+            self._count += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._bits = bytearray(len(self._bits))
+            self._count = 0
+
+    def _positions(self, item: bytes) -> List[int]:
+        # double hashing: k positions from two independent 64-bit hashes
+        digest = hashlib.blake2b(item, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+
+class MarkdownCache:
+    """
+    HTML rendered from Markdown, keyed by a hash of the Markdown text.
+
+    Each process keeps recently used HTML in an LRU. If ``persist`` is
+    set (the ``db.persist_rendered_markdown`` setting), HTML is also
+    stored in the ``rendered_markdown`` table, so that it is rendered
+    once rather than once per process. Talks' Markdown is rendered with
+    :meth:`prerender` when they are saved, so that the first page view
+    after an edit doesn't have to.
+
+    Stored rows read more than ``touch_after`` since they were last
+    touched have their ``updated`` time set again, so that rows still in
+    use are kept by ``flask prune rendered-markdown``.
+
+    """
+
+    touch_after = timedelta(days=1)
+
+    def __init__(self, maxsize: int, name: Optional[str] = None) -> None:
+        self.lru: LRUCache[str, str] = LRUCache(maxsize, name=name)
+        self.persist = False
+
+    @staticmethod
+    def key(text: str) -> str:
+        # rendering changes between releases of Markdown
+        content = f"{markdown_version}\0{text}".encode("utf8")
+        return hashlib.sha256(content).hexdigest()
+
+    def render(self, text: str) -> str:
+        key = self.key(text)
+        html = self.lru.get(key)
+        if html is None and self.persist:
+            row = (
+                db.session.query(RenderedMarkdown.html, RenderedMarkdown.updated)
+                .filter(RenderedMarkdown.content_hash == key)
+                .first()
+            )
+            if row is not None:
+                html, updated = row
+                self._touch_stale({key: updated})
+        if html is None:
+            html = self._render_and_store({key: text})[key]
+        self.lru.set(key, html)
+        return html
+
+    def prerender(self, *texts: Optional[str]) -> None:
+        """Render ``texts`` that aren't cached yet; ``None`` is ignored."""
+        missing = {self.key(t): t for t in texts if t is not None}
+        missing = {k: t for k, t in missing.items() if self.lru.get(k) is None}
+        if missing and self.persist:
+            rows = db.session.query(
+                RenderedMarkdown.content_hash,
+                RenderedMarkdown.html,
+                RenderedMarkdown.updated,
+            ).filter(RenderedMarkdown.content_hash.in_(missing))
+            stored: Dict[str, datetime] = {}
+            for key, html, updated in rows:
+                self.lru.set(key, html)
+                stored[key] = updated
+                del missing[key]
+            self._touch_stale(stored)
+        if missing:
+            for key, html in self._render_and_store(missing).items():
+                self.lru.set(key, html)
+
+    def _render_and_store(self, texts: Dict[str, str]) -> Dict[str, str]:
+        rendered = {
+            key: markdown(text, output_format="html5") for key, text in texts.items()
+        }
+        if self.persist:
+            # on a connection of its own, so that rendering during a GET
+            # request is stored even though the request doesn't commit
+            rows: List[Dict[str, Any]] = [
+                {"content_hash": key, "html": html} for key, html in rendered.items()
+            ]
+            statement = insert(RenderedMarkdown.__table__).values(rows)
+            with db.engine.begin() as connection:
+                connection.execute(statement.on_conflict_do_nothing())
+        return rendered
+
+    def _touch_stale(self, updated: Dict[str, datetime]) -> None:
+        now = datetime.utcnow()
+        stale = [key for key, when in updated.items() if when <= now - self.touch_after]
+        if stale:
+            table = RenderedMarkdown.__table__
+            statement = (
+                table.update()
+                .where(table.c.content_hash.in_(stale))
+                .values(updated=now)
+            )
+            # on a connection of its own, as in _render_and_store
+            with db.engine.begin() as connection:
+                connection.execute(statement)
+
+
+conference_cache: TTLCache[str, Optional[Conference]] = TTLCache(
+    ttl=60, name="conference"
+)
+markdown_cache = MarkdownCache(maxsize=1024, name="markdown")
+user_cache: TTLCache[int, Optional[User]] = TTLCache(ttl=30, name="user")
+
+# the User columns read on (nearly) every request, by Flask-Login, the
+# navigation bar, and the reviewer and admin checks
+USER_CACHE_COLUMNS = ("user_id", "fullname", "email", "site_admin", "reviewer")
+
+
+def init_app(app: Application) -> None:
+    conference_cache.ttl = app.settings.db.conference_cache_ttl
+    user_cache.ttl = app.settings.db.user_cache_ttl
+    markdown_cache.persist = app.settings.db.persist_rendered_markdown
+
+
+def _load_conference() -> Optional[Conference]:
+    # TODO: load by URL or something
+    conference = Conference.query.order_by(Conference.created).first()
+    if conference is None:
+        return None
+
+    # Cache a detached copy rather than the instance itself, which
+    # belongs to (and is expired by) the loading request's session
+    snapshot = Conference(
+        **{
+            attr.key: getattr(conference, attr.key)
+            for attr in inspect(Conference).column_attrs
+        }
+    )
+    make_transient_to_detached(snapshot)
+    return snapshot
+
+
+def get_conference() -> Optional[Conference]:
+    """
+    Return the current conference, attached to the current session.
+
+    Each call returns an instance owned by the caller's session, so it
+    can be used in queries and relationships as usual, while the
+    database is only consulted when the cached copy has expired.
+
+    """
+    conference = conference_cache.get_or_load("current", _load_conference)
+    if conference is None:
+        return None
+    return db.session.merge(conference, load=False)
+
+
+def _load_user(user_id: int) -> Optional[User]:
+    user = User.query.options(load_only(*USER_CACHE_COLUMNS)).get(user_id)
+    if user is None:
+        return None
+
+    snapshot = User(**{key: getattr(user, key) for key in USER_CACHE_COLUMNS})
+    make_transient_to_detached(snapshot)
+    return snapshot
+
+
+def get_user(user_id: int) -> Optional[User]:
+    """
+    Return the user with ``user_id``, attached to the current session.
+
+    Like :func:`get_conference`, but only the ``USER_CACHE_COLUMNS``
+    are cached; the rest of the user's columns, and its relationships,
+    are loaded from the database if and when they are used.
+
+    """
+    user = user_cache.get_or_load(user_id, lambda: _load_user(user_id))
+    if user is None:
+        return None
+    return db.session.merge(user, load=False)
+
+
+@event.listens_for(Conference, "after_insert")
+@event.listens_for(Conference, "after_update")
+@event.listens_for(Conference, "after_delete")
+def _mark_conference_changed(mapper: Any, connection: Any, target: Conference) -> None:
+    session = object_session(target)
+    if session is not None:
+        session.info["conference_changed"] = True
+
+
+@event.listens_for(User, "after_insert")
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _mark_user_changed(mapper: Any, connection: Any, target: User) -> None:
+    # inserts too: a user ID may have been cached as missing
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("users_changed", set()).add(target.user_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_conference_cache(session: Session) -> None:
+    # Invalidate only once the change is visible to other sessions,
+    # otherwise a concurrent request could re-cache the old row
+    if session.info.pop("conference_changed", False):
+        conference_cache.invalidate()
+    for user_id in session.info.pop("users_changed", ()):
+        user_cache.invalidate(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_conference_changes(session: Session) -> None:
+    session.info.pop("conference_changed", None)
+    session.info.pop("users_changed", None)
@@ -9,13 +9,15 @@ from flask_wtf.csrf import CSRFProtect
 from sentry_sdk.integrations.flask import FlaskIntegration
 from social_flask.routes import social_auth
 from social_flask_sqlalchemy.models import init_social
+from werkzeug.middleware.proxy_fix import ProxyFix
 import sentry_sdk
 
-from yakbak import admin, view_helpers, views
-from yakbak.auth import login_manager
-from yakbak.mail import mail
-from yakbak.models import Conference, db
+from yakbak import admin, cache, instrumentation, metrics, view_helpers, views
+from yakbak.auth import login_manager, set_up_magic_links
+from yakbak.mail import mail, mail_templates
+from yakbak.models import db
 from yakbak.settings import Settings
+from yakbak.throttle import magic_link_throttle
 from yakbak.types import Application
 
 logger = logging.getLogger("core")
@@ -50,13 +52,16 @@ def create_app(settings: Settings, flask_config: Dict[str, Any] = None) -> Appli
     set_up_flask(app, flask_config)
     set_up_database(app)
     set_up_auth(app)
-    set_up_mail(app)
     set_up_admin(app)
     CSRFProtect(app)
 
     app.register_blueprint(views.app)
     app.register_blueprint(view_helpers.app)  # filters etc
     app.register_blueprint(social_auth, url_prefix="/login/external")
+    metrics.init_app(app)
+
+    # email templates are compiled here, so the filters must be registered
+    set_up_mail(app)
 
     set_up_handlers(app)
 
@@ -97,6 +102,12 @@ def set_up_flask(app: Application, flask_config: Dict[str, Any]) -> None:
 
     app.config.update(flask_config)
 
+    if app.settings.flask.proxies:
+        # trust only the X-Forwarded-For entries our own proxies added
+        app.wsgi_app = ProxyFix(  # type: ignore
+            app.wsgi_app, x_for=app.settings.flask.proxies
+        )
+
 
 def set_up_database(app: Application) -> None:
     app.config["SQLALCHEMY_DATABASE_URI"] = app.settings.db.url
@@ -106,10 +117,13 @@ def set_up_database(app: Application) -> None:
 
     db.app = app
     db.init_app(app)
+    instrumentation.init_app(app)
 
 
 def set_up_auth(app: Application) -> None:
     login_manager.init_app(app)
+    set_up_magic_links(app)
+    magic_link_throttle.init_app(app)
 
     if app.settings.auth.no_social_auth:
         # Should only be true in testing! But it avoids some issues
@@ -165,9 +179,12 @@ def set_up_mail(app: Application) -> None:
     app.config["MAIL_PASSWORD"] = app.settings.smtp.password
     app.config["MAIL_DEFAULT_SENDER"] = app.settings.smtp.sender
     app.config["MAIL_USE_TLS"] = app.settings.smtp.use_tls
-    app.config["MAIL_MAX_EMAILS"] = 10  # guess
+    # yakbak.mail.deliver() reconnects after smtp.max_emails messages
+    # itself, so Flask-Mail doesn't need to
+    app.config["MAIL_MAX_EMAILS"] = None
 
     mail.init_app(app)
+    mail_templates.init_app(app)
 
 
 def set_up_admin(app: Application) -> None:
@@ -176,7 +193,8 @@ def set_up_admin(app: Application) -> None:
 
 
 def set_up_handlers(app: Application) -> None:
+    cache.init_app(app)
+
     @app.before_request
     def load_conference() -> None:
-        # TODO: load by URL or something
-        g.conference = Conference.query.order_by(Conference.created).first()
+        g.conference = cache.get_conference()
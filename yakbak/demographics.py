@@ -0,0 +1,141 @@
+"""
+Aggregate demographic survey answers for the organizers' dashboard.
+
+Everything is counted in a single pass over the survey table, using
+``count(*) FILTER (...)`` for each bucket and JSONB containment for the
+multi-select answers, so the cost doesn't grow with the number of rows
+loaded into Python.
+
+"""
+from typing import Any, Dict, List, Type
+import enum
+import json
+
+from attr import attrib, attrs
+from sqlalchemy import and_, cast, func, literal, not_
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.sql.elements import ColumnElement
+
+from yakbak.forms import PastSpeaking
+from yakbak.models import (
+    AgeGroup,
+    db,
+    DemographicSurvey,
+    Ethnicity,
+    Gender,
+    ProgrammingExperience,
+)
+
+
+@attrs(frozen=True)
+class Breakdown:
+    """How many surveys gave each answer to one question."""
+
+    # by choice; multi-select questions may count a survey more than once
+    counts: Dict[enum.Enum, int] = attrib()
+    # answers other than the choices, from the "Other" free text field
+    other: int = attrib()
+    unanswered: int = attrib()
+
+
+@attrs(frozen=True)
+class Demographics:
+    total: int = attrib()
+    non_man: int = attrib()
+    non_white: int = attrib()
+
+    gender: Breakdown = attrib()
+    ethnicity: Breakdown = attrib()
+    past_speaking: Breakdown = attrib()
+    age_group: Breakdown = attrib()
+    programming_experience: Breakdown = attrib()
+
+
+MULTI_SELECT: Dict[str, Type[enum.Enum]] = {
+    "gender": Gender,
+    "ethnicity": Ethnicity,
+    "past_speaking": PastSpeaking,
+}
+SINGLE_SELECT: Dict[str, Type[enum.Enum]] = {
+    "age_group": AgeGroup,
+    "programming_experience": ProgrammingExperience,
+}
+
+
+def _jsonb(value: Any) -> ColumnElement:
+    return cast(literal(json.dumps(value)), JSONB)
+
+
+def _answered(column: ColumnElement) -> ColumnElement:
+    # unanswered questions are SQL NULL, but clearing a survey stores
+    # JSON null; jsonb_typeof() is 'null' for the latter, NULL for the former
+    is_array = func.coalesce(func.jsonb_typeof(column), "null") == "array"
+    return and_(is_array, column != _jsonb([]))
+
+
+def _multi_select_counts(name: str, choices: Type[enum.Enum]) -> List[ColumnElement]:
+    column = cast(getattr(DemographicSurvey, name), JSONB)
+    names = [choice.name for choice in choices]
+    counts = [
+        func.count().filter(column.contains(_jsonb([choice]))).label(f"{name}.{choice}")
+        for choice in names
+    ]
+    unlisted = column.contained_by(_jsonb(names))  # type: ignore  # JSONB comparator
+    other = and_(_answered(column), not_(unlisted))
+    counts.append(func.count().filter(other).label(f"{name}.other"))
+    counts.append(func.count().filter(not_(_answered(column))).label(f"{name}.none"))
+    return counts
+
+
+def _single_select_counts(name: str, choices: Type[enum.Enum]) -> List[ColumnElement]:
+    column = getattr(DemographicSurvey, name)
+    counts = [
+        func.count().filter(column == choice).label(f"{name}.{choice.name}")
+        for choice in choices
+    ]
+    counts.append(func.count().filter(column.is_(None)).label(f"{name}.none"))
+    return counts
+
+
+def survey_demographics() -> Demographics:
+    """Count the answers to every survey question, in one query."""
+    gender = cast(DemographicSurvey.gender, JSONB)
+    ethnicity = cast(DemographicSurvey.ethnicity, JSONB)
+    columns = [
+        func.count().label("total"),
+        func.count()
+        .filter(and_(_answered(gender), not_(gender.contains(_jsonb(["MAN"])))))
+        .label("non_man"),
+        func.count()
+        .filter(
+            and_(
+                _answered(ethnicity),
+                not_(ethnicity.contains(_jsonb(["WHITE_CAUCASIAN"]))),
+            )
+        )
+        .label("non_white"),
+    ]
+    for name, choices in MULTI_SELECT.items():
+        columns.extend(_multi_select_counts(name, choices))
+    for name, choices in SINGLE_SELECT.items():
+        columns.extend(_single_select_counts(name, choices))
+
+    row = dict(zip((c.name for c in columns), db.session.query(*columns).one()))
+
+    def breakdown(name: str, choices: Type[enum.Enum]) -> Breakdown:
+        return Breakdown(
+            counts={choice: row[f"{name}.{choice.name}"] for choice in choices},
+            other=row.get(f"{name}.other", 0),
+            unanswered=row[f"{name}.none"],
+        )
+
+    breakdowns = {
+        name: breakdown(name, choices)
+        for name, choices in {**MULTI_SELECT, **SINGLE_SELECT}.items()
+    }
+    return Demographics(
+        total=row["total"],
+        non_man=row["non_man"],
+        non_white=row["non_white"],
+        **breakdowns,
+    )
@@ -1,5 +1,7 @@
-# Per Google's recommendation [1], this is copied from [2], with
-# the line ending match adjusted to find spans of whitespace.
+# Per Google's recommendation [1], this started as a copy of [2], with
+# the line ending match adjusted to find spans of whitespace. It has since
+# been rewritten to split the texts in a single regex scan; its output is
+# unchanged (see yakbak/tests/diff_reference.py for the original).
 #
 # The original [2] is used under the Apache License, Version 2.0:
 #
@@ -21,80 +23,115 @@
 #
 # [1] https://github.com/google/diff-match-patch/wiki/Line-or-Word-Diffs#word-mode
 # [2] https://github.com/google/diff-match-patch/blob/858b3812cc02e7d48da4beebb21d4d80dc1d3062/python3/diff_match_patch.py
-from typing import Dict, Tuple
+from typing import Dict, Iterator, List, Sequence, Tuple
 import re
 
+import diff_match_patch
 
-def diff_wordsToChars(text1: str, text2: str) -> Tuple[str, str, object]:
-  """Split two texts into an array of strings.  Reduce the texts to a string
-  of hashes where each Unicode character represents one line.
+# a word, and the whitespace character that ends it
+WORD_RE = re.compile(r"[^ \t\n]+[ \t\n]")
 
-  Args:
-    text1: First string.
-    text2: Second string.
 
-  Returns:
-    Three element tuple, containing the encoded text1, the encoded text2 and
-    the array of unique strings.  The zeroth element of the array of unique
-    strings is intentionally blank.
-  """
-  lineArray = []  # e.g. lineArray[4] == "Hello\n"
-  lineHash: Dict[str, int] = {}   # e.g. lineHash["Hello\n"] == 4
+def word_spans(text: str) -> Iterator[Tuple[int, int]]:
+    """
+    Yield the ``(start, end)`` of each "word" that ``text`` is split into.
 
-  # "\x00" is a valid character, but various debuggers don't like it.
-  # So we'll insert a junk entry to avoid generating a null character.
-  lineArray.append('')
+    Normally a word is a run of non-whitespace plus the whitespace character
+    after it. The original encoder searched for the next word from the end
+    of the previous one and took as many characters as that word had, so
+    where whitespace is repeated it yields spans starting with the extra
+    whitespace and ending mid-word instead. This reproduces those spans
+    exactly.
 
-  def next_word_end(text: str, start: int) -> int:
-    """Find the next word end (any whitespace) after `start`.
     """
-    pattern = re.compile(r"([^ \t\n]+)[ \t\n]")
-    match = pattern.search(text, start)
-    if not match:
-      return -1
-    return start + len(match.group(1))
-
-  def diff_linesToCharsMunge(text: str) -> str:
-    """Split a text into an array of strings.  Reduce the texts to a string
+    pos = 0
+    for match in WORD_RE.finditer(text):
+        start, end = match.span()
+        length = end - start
+        while pos < start:
+            yield pos, pos + length
+            pos += length
+        # pos is now at the start of this word, in the middle of it, or (after
+        # repeated whitespace) on its trailing whitespace
+        if pos < end - 1:
+            yield pos, end
+            pos = end
+    if pos < len(text):
+        yield pos, len(text)
+
+
+def diff_wordsToChars(
+    text1: str, text2: str, maxLines1: int = 666666, maxLines2: int = 1114111
+) -> Tuple[str, str, object]:
+    """Split two texts into an array of strings.  Reduce the texts to a string
     of hashes where each Unicode character represents one line.
-    Modifies linearray and linehash through being a closure.
 
     Args:
-      text: String to encode.
+      text1: First string.
+      text2: Second string.
+      maxLines1: Size the array may grow to while encoding text1.
+      maxLines2: Size the array may grow to while encoding text2.
 
     Returns:
-      Encoded string.
+      Three element tuple, containing the encoded text1, the encoded text2 and
+      the array of unique strings.  The zeroth element of the array of unique
+      strings is intentionally blank.
     """
-    chars = []
-    # Walk the text, pulling out a substring for each line.
-    # text.split('\n') would would temporarily double our memory footprint.
-    # Modifying text would create many large strings to garbage collect.
-    lineStart = 0
-    lineEnd = -1
-    while lineEnd < len(text) - 1:
-      lineEnd = next_word_end(text, lineStart)
-      if lineEnd == -1:
-        lineEnd = len(text) - 1
-      line = text[lineStart:lineEnd + 1]
-
-      if line in lineHash:
-        chars.append(chr(lineHash[line]))
-      else:
-        if len(lineArray) == maxLines:
-          # Bail out at 1114111 because chr(1114112) throws.
-          line = text[lineStart:]
-          lineEnd = len(text)
-        lineArray.append(line)
-        lineHash[line] = len(lineArray) - 1
-        chars.append(chr(len(lineArray) - 1))
-      lineStart = lineEnd + 1
-    return "".join(chars)
-
-  # Allocate 2/3rds of the space for text1, the rest for text2.
-  maxLines = 666666
-  chars1 = diff_linesToCharsMunge(text1)
-  maxLines = 1114111
-  chars2 = diff_linesToCharsMunge(text2)
-  return (chars1, chars2, lineArray)
+    # "\x00" is a valid character, but various debuggers don't like it.
+    # So we'll insert a junk entry to avoid generating a null character.
+    lineArray = [""]
+    lineChars: Dict[str, str] = {}  # e.g. lineChars["Hello "] == chr(4)
+
+    def diff_linesToCharsMunge(text: str, maxLines: int) -> str:
+        chars = []
+        for start, end in word_spans(text):
+            line = text[start:end]
+            char = lineChars.get(line)
+            if char is None:
+                if len(lineArray) == maxLines:
+                    # Bail out at 1114111 because chr(1114112) throws.
+                    line = text[start:]
+                    lineArray.append(line)
+                    char = lineChars[line] = chr(len(lineArray) - 1)
+                    chars.append(char)
+                    break
+                lineArray.append(line)
+                char = lineChars[line] = chr(len(lineArray) - 1)
+            chars.append(char)
+        return "".join(chars)
+
+    # Allocate 2/3rds of the space for text1, the rest for text2.
+    chars1 = diff_linesToCharsMunge(text1, maxLines1)
+    chars2 = diff_linesToCharsMunge(text2, maxLines2)
+    return (chars1, chars2, lineArray)
+
+
+# The rest of this module is Yak-Bak's own.
+
+DiffOps = List[Tuple[int, str]]
+
+
+def word_diff(text1: str, text2: str) -> DiffOps:
+    """
+    Diff two texts word by word.
+
+    Returns a list of ``(op, text)`` pairs, as ``diff_main`` does: ``-1``
+    for text only in ``text1``, ``1`` for text only in ``text2``, and
+    ``0`` for text in both.
+
+    """
+    dmp = diff_match_patch.diff_match_patch()
+    chars1, chars2, word_array = diff_wordsToChars(text1, text2)
+    diff = dmp.diff_main(chars1, chars2)
+    dmp.diff_charsToLines(diff, word_array)
+    return [(op, text) for op, text in diff]
+
+
+def diff_applies_to(ops: Sequence[Sequence], text1: str, text2: str) -> bool:
+    """Check whether ``ops``, from :func:`word_diff`, is the diff of the texts."""
+    left = "".join(text for op, text in ops if op <= 0)
+    right = "".join(text for op, text in ops if op >= 0)
+    return left == text1 and right == text2
+
 
 # flake8: noqa
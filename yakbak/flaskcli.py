@@ -1,15 +1,19 @@
 from datetime import datetime, timedelta
-from typing import Optional, TYPE_CHECKING
+from typing import Callable, Optional, Tuple, TYPE_CHECKING
 from urllib.parse import urlparse
 import csv
 import os.path
+import random
 import sys
+import time
 
 from flask import url_for
+from sqlalchemy.orm import selectinload
 import click
 
+from yakbak import mail, prune, seed
 from yakbak.core import create_app
-from yakbak.models import Category, Conference, db, UsedMagicLink, TalkSpeaker, Talk
+from yakbak.models import Category, Conference, db, TalkSpeaker, Talk
 from yakbak.settings import find_settings_file, load_settings_from_env
 
 # TODO: remove once https://github.com/python/typeshed/pull/2958 is merged
@@ -25,6 +29,11 @@ else:
 
 app = create_app(load_settings_from_env())
 
+# talks fetched per round trip by export_review_spreadsheet
+EXPORT_BATCH_SIZE = 500
+
+DEFAULT_SEED_COUNTS = seed.SeedCounts()
+
 
 @app.cli.command()
 def sync_db() -> None:
@@ -100,12 +109,170 @@ def add_conference(
 
 
 @app.cli.command()
-@click.argument("older_than_days")
-def clean_magic_links(older_than_days: str) -> None:
-    now = datetime.utcnow()
-    threshold = now - timedelta(days=int(older_than_days))
-    UsedMagicLink.query.filter(UsedMagicLink.used_on <= threshold).delete()
+@click.option("--batch-size", type=int, default=50, help="messages per connection")
+@click.option("--interval", type=float, default=5, help="seconds between polls")
+@click.option("--once", is_flag=True, help="exit once the outbox is drained")
+def send_queued_mail(batch_size: int, interval: float, once: bool) -> None:
+    """
+    Deliver mail queued in the outbox (see the smtp.outbox setting).
+
+    Failed messages are retried with exponential backoff. Several workers
+    can run at once; each claims a different batch.
+
+    """
+    while True:
+        with app.app_context():
+            sent = mail.send_queued_mail(batch_size)
+        if sent:
+            continue
+        if once:
+            break
+        time.sleep(interval)
+
+
+def run_prune_job(
+    job: prune.PruneJob,
+    older_than_days: Optional[int],
+    batch_size: int,
+    pause: float,
+    dry_run: bool,
+) -> None:
+    if older_than_days is None:
+        older_than_days = job.older_than_days
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+
+    if dry_run:
+        print(f"{job.name}: would delete {job.count(cutoff)} row(s)")
+        return
+
+    def progress(total: int) -> None:
+        print(f"{job.name}: deleted {total} row(s) so far")
+
+    deleted = prune.prune(job, cutoff, batch_size, pause, progress)
+    print(f"{job.name}: deleted {deleted} row(s)")
+
+
+prune_options = (
+    click.option(
+        "--batch-size",
+        type=int,
+        default=prune.BATCH_SIZE,
+        help="rows deleted per transaction",
+    ),
+    click.option(
+        "--pause", type=float, default=prune.PAUSE, help="seconds between batches"
+    ),
+    click.option("--dry-run", is_flag=True, help="count the rows, don't delete them"),
+)
+
+
+def with_prune_options(func: Callable) -> Callable:
+    for option in reversed(prune_options):
+        func = option(func)
+    return func
+
+
+@app.cli.command(
+    "prune",
+    epilog="Jobs: "
+    + "; ".join(
+        f"{job.name}, {job.description} (default {job.older_than_days} days)"
+        for job in sorted(prune.JOBS.values(), key=lambda job: job.name)
+    ),
+)
+@click.argument("jobs", nargs=-1, type=click.Choice(sorted(prune.JOBS)))
+@click.option("--older-than-days", type=int, help="instead of each job's default")
+@with_prune_options
+def prune_old_rows(
+    jobs: Tuple[str, ...],
+    older_than_days: Optional[int],
+    batch_size: int,
+    pause: float,
+    dry_run: bool,
+) -> None:
+    """
+    Delete rows that are no longer needed, a batch at a time.
+
+    Runs the named JOBS, or all of them.
+
+    """
+    for name in jobs or sorted(prune.JOBS):
+        run_prune_job(prune.JOBS[name], older_than_days, batch_size, pause, dry_run)
+
+
+@app.cli.command()
+@click.argument("older_than_days", type=int)
+@with_prune_options
+def clean_magic_links(
+    older_than_days: int, batch_size: int, pause: float, dry_run: bool
+) -> None:
+    """
+    Forget used magic links that expired more than OLDER_THAN_DAYS ago.
+
+    The same as `flask prune magic-links --older-than-days OLDER_THAN_DAYS`.
+
+    """
+    job = prune.JOBS["magic-links"]
+    run_prune_job(job, older_than_days, batch_size, pause, dry_run)
+
+
+@app.cli.command()
+@click.option("--users", type=int, default=DEFAULT_SEED_COUNTS.users)
+@click.option("--reviewers", type=int, default=DEFAULT_SEED_COUNTS.reviewers)
+@click.option("--talks", type=int, default=DEFAULT_SEED_COUNTS.talks)
+@click.option(
+    "--co-speakers",
+    type=int,
+    default=DEFAULT_SEED_COUNTS.co_speakers,
+    help="talks with a second speaker",
+)
+@click.option("--categories", type=int, default=DEFAULT_SEED_COUNTS.categories)
+@click.option("--votes", type=int, default=DEFAULT_SEED_COUNTS.votes)
+@click.option("--surveys", type=int, default=DEFAULT_SEED_COUNTS.surveys)
+@click.option(
+    "--conduct-reports", type=int, default=DEFAULT_SEED_COUNTS.conduct_reports
+)
+@click.option("--random-seed", type=int, help="for repeatable data")
+def seed_data(random_seed: Optional[int], **counts: int) -> None:
+    """
+    Add synthetic users, talks, votes, etc, for development or load tests.
+
+    Everything is added to the existing conference. Don't run this
+    against a production database!
+
+    """
+    conference = Conference.query.order_by(Conference.created).first()
+    if conference is None:
+        print("Add a conference first, with `flask add-conference`")
+        sys.exit(1)
+
+    seed_counts = seed.SeedCounts(**counts)
+    try:
+        seed_counts.check()
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
+    start = time.perf_counter()
+    added = seed.seed(conference, seed_counts, random.Random(random_seed))
+    elapsed = time.perf_counter() - start
+    for table, count in added.items():
+        print(f"{count:8} {table}")
+    print(f"in {elapsed:.1f}s")
+
+
+@app.cli.command()
+def reconcile_vote_counters() -> None:
+    """
+    Recompute each talk's vote count and score from its votes.
+
+    The counters are maintained as votes are cast, skipped and deleted;
+    this repairs any drift, eg from votes changed directly in the database.
+
+    """
+    fixed = Talk.reconcile_vote_counters()
     db.session.commit()
+    print(f"Reconciled vote counters for {fixed} talk(s)")
 
 
 @app.cli.command()
@@ -140,14 +307,21 @@ def export_review_spreadsheet(base_url: Optional[str]) -> None:
             "Vote Score",
         ]
     )
-    with app.test_request_context():
-        for talk in Talk.query.all():
-            talk_speakers = (
-                TalkSpeaker.query
-                .filter(TalkSpeaker.talk_id==str(talk.talk_id))
-                .all()
-            )
+    # Speakers (with their users) and categories are loaded with one
+    # query each per batch of talks, and talks are read from a
+    # server-side cursor, so rows are written as they are fetched and
+    # memory use doesn't grow with the number of proposals
+    talks = (
+        Talk.query.options(
+            selectinload(Talk.speakers).joinedload(TalkSpeaker.user),
+            selectinload(Talk.categories),
+        )
+        .order_by(Talk.talk_id)
+        .yield_per(EXPORT_BATCH_SIZE)
+    )
 
+    with app.test_request_context():
+        for talk in talks:
             url = url_for(
                 "views.review_talk",
                 talk_id=talk.talk_id,
@@ -160,9 +334,9 @@ def export_review_spreadsheet(base_url: Optional[str]) -> None:
                     talk.title,
                     talk.description,
                     str(talk.length),
-                    ' // '.join(ts.user.fullname for ts in talk_speakers),
-                    ' // '.join(ts.user.email for ts in talk_speakers),
-                    ' // '.join(c.name for c in talk.categories),
+                    " // ".join(ts.user.fullname for ts in talk.speakers),
+                    " // ".join(ts.user.email for ts in talk.speakers),
+                    " // ".join(c.name for c in talk.categories),
                     f"https://cfp.pycon.ca{url}",
                     f"{talk.vote_count:.2f}" if talk.vote_count else None,
                     f"{talk.vote_score:.2f}" if talk.vote_score else None,
@@ -0,0 +1,165 @@
+"""
+Count and time the SQL statements run by each request.
+
+When the ``logging.sql_sample_rate`` setting is above zero, that fraction
+of requests is sampled: every statement they run is timed, and when the
+request finishes its query count, total database time, and slowest
+statement are
+
+- logged to the ``sql`` logger, as fields of the log record,
+- sent in a ``Server-Timing`` header, if ``logging.server_timing`` is on,
+- and added to the per-endpoint totals shown at ``/manage/sql-stats``.
+
+The totals are kept in memory, so each worker process has its own.
+
+"""
+from threading import Lock
+from time import perf_counter
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+import random
+
+from attr import attrib, attrs, evolve
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from werkzeug.wrappers import Response
+
+from yakbak.models import db
+from yakbak.types import Application
+
+logger = logging.getLogger("sql")
+
+# longer statements are truncated, to bound the memory used by totals
+MAX_STATEMENT_LENGTH = 2000
+
+
+@attrs
+class RequestStats:
+    queries: int = attrib(default=0)
+    db_time: float = attrib(default=0.0)
+    slowest_time: float = attrib(default=0.0)
+    slowest_statement: Optional[str] = attrib(default=None)
+
+    def record(self, statement: str, elapsed: float) -> None:
+        self.queries += 1
+        self.db_time += elapsed
+        if elapsed > self.slowest_time:
+            self.slowest_time = elapsed
+            self.slowest_statement = statement[:MAX_STATEMENT_LENGTH]
+
+
+@attrs
+class EndpointStats:
+    requests: int = attrib(default=0)
+    queries: int = attrib(default=0)
+    max_queries: int = attrib(default=0)
+    db_time: float = attrib(default=0.0)
+    max_db_time: float = attrib(default=0.0)
+    slowest_time: float = attrib(default=0.0)
+    slowest_statement: Optional[str] = attrib(default=None)
+
+    @property
+    def mean_queries(self) -> float:
+        return self.queries / self.requests if self.requests else 0.0
+
+    @property
+    def mean_db_time(self) -> float:
+        return self.db_time / self.requests if self.requests else 0.0
+
+    def add(self, stats: RequestStats) -> None:
+        self.requests += 1
+        self.queries += stats.queries
+        self.max_queries = max(self.max_queries, stats.queries)
+        self.db_time += stats.db_time
+        self.max_db_time = max(self.max_db_time, stats.db_time)
+        if stats.slowest_time > self.slowest_time:
+            self.slowest_time = stats.slowest_time
+            self.slowest_statement = stats.slowest_statement
+
+
+class SQLStats:
+    """Thread-safe totals of sampled requests, per endpoint."""
+
+    def __init__(self) -> None:
+        self._endpoints: Dict[str, EndpointStats] = {}
+        self._lock = Lock()
+
+    def add(self, endpoint: str, stats: RequestStats) -> None:
+        with self._lock:
+            self._endpoints.setdefault(endpoint, EndpointStats()).add(stats)
+
+    def by_db_time(self) -> List[Tuple[str, EndpointStats]]:
+        """Return a copy of the totals, the most time spent in the DB first."""
+        with self._lock:
+            items = [(name, evolve(s)) for name, s in self._endpoints.items()]
+        return sorted(items, key=lambda item: item[1].db_time, reverse=True)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._endpoints.clear()
+
+
+sql_stats = SQLStats()
+
+
+def init_app(app: Application) -> None:
+    if app.settings.logging.sql_sample_rate <= 0:
+        return
+
+    engine = db.get_engine(app)
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    app.before_request(_start_sampling)
+    app.after_request(_finish_sampling)
+
+
+def _current_stats() -> Optional[RequestStats]:
+    if not has_request_context():
+        return None
+    return g.get("sql_stats")
+
+
+def _before_cursor_execute(conn: Any, *args: Any) -> None:
+    if _current_stats() is not None:
+        conn.info.setdefault("sql_stats_started", []).append(perf_counter())
+
+
+def _after_cursor_execute(conn: Any, cursor: Any, statement: str, *args: Any) -> None:
+    stats = _current_stats()
+    started = conn.info.get("sql_stats_started")
+    if stats is not None and started:
+        stats.record(statement, perf_counter() - started.pop())
+
+
+def _start_sampling() -> None:
+    if random.random() < current_app.settings.logging.sql_sample_rate:
+        g.sql_stats = RequestStats()
+
+
+def _finish_sampling(response: Response) -> Response:
+    stats: Optional[RequestStats] = g.pop("sql_stats", None)
+    if stats is None:
+        return response
+
+    endpoint = request.endpoint or "<no endpoint>"
+    db_ms = stats.db_time * 1000
+    logger.info(
+        "endpoint=%s queries=%d db_ms=%.1f slowest_ms=%.1f",
+        endpoint,
+        stats.queries,
+        db_ms,
+        stats.slowest_time * 1000,
+        extra={
+            "endpoint": endpoint,
+            "queries": stats.queries,
+            "db_ms": db_ms,
+            "slowest_ms": stats.slowest_time * 1000,
+            "slowest_statement": stats.slowest_statement,
+        },
+    )
+    if current_app.settings.logging.server_timing:
+        response.headers.add(
+            "Server-Timing", f'db;dur={db_ms:.1f};desc="{stats.queries} queries"'
+        )
+    sql_stats.add(endpoint, stats)
+    return response
@@ -1,12 +1,30 @@
-from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import logging
+import smtplib
 
 from attr import attrib, attrs
 from flask import current_app
-from flask import render_template as flask_render_template
-from flask_mail import Mail
+from flask_mail import BadHeaderError, Mail
+from jinja2 import Environment, Template
 import frontmatter
 
+from yakbak.metrics import MAIL_SEND_DURATION
+from yakbak.models import db, OutboxMessage, OutboxMessageStatus
+from yakbak.types import Application
+
 mail = Mail()
+logger = logging.getLogger("mail")
+
+# Queued messages are retried after RETRY_BACKOFF seconds, doubling
+# after each failure up to MAX_RETRY_BACKOFF, and marked as failed
+# after MAX_ATTEMPTS attempts
+RETRY_BACKOFF = 60
+MAX_RETRY_BACKOFF = 60 * 60
+MAX_ATTEMPTS = 8
+
+# errors from sending a message that are reported rather than raised
+SEND_ERRORS = (smtplib.SMTPException, OSError, BadHeaderError)
 
 
 @attrs
@@ -15,11 +33,109 @@ class MailMeta:
     sender: Optional[str] = attrib(default=None)
 
 
-def render_template(template: str, **kwargs: Dict[str, Any]) -> Tuple[MailMeta, str]:
-    rendered = flask_render_template(template, **kwargs)
-    parsed = frontmatter.loads(rendered)
-    meta = MailMeta(parsed["subject"], parsed.get("sender"))
-    return meta, parsed.content
+@attrs
+class Envelope:
+    """A rendered email, ready to send."""
+
+    recipients: List[str] = attrib()
+    sender: str = attrib()
+    subject: str = attrib()
+    body: str = attrib()
+
+
+@attrs
+class MailJob:
+    """An email to render from ``template`` and send to ``to``."""
+
+    to: List[str] = attrib()
+    template: str = attrib()
+    context: Dict[str, Any] = attrib(factory=dict)
+
+
+@attrs
+class MailResult:
+    job: MailJob = attrib()
+    # None if the email was sent (or queued in the outbox)
+    error: Optional[Exception] = attrib(default=None)
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@attrs
+class MailTemplate:
+    """An email template with its frontmatter parsed and compiled."""
+
+    subject: Template = attrib()
+    sender: Optional[Template] = attrib()
+    body: Template = attrib()
+    uptodate: Optional[Callable[[], bool]] = attrib(default=None)
+
+
+def compile_template(env: Environment, name: str) -> MailTemplate:
+    source, _, uptodate = env.loader.get_source(env, name)
+    parsed = frontmatter.loads(source)
+    sender = parsed.get("sender")
+    # Flask autoescapes templates from strings, but emails are plain text,
+    # like the email templates are when rendered by name
+    env = env.overlay(autoescape=False)
+    return MailTemplate(
+        subject=env.from_string(parsed["subject"]),
+        sender=env.from_string(sender) if sender else None,
+        body=env.from_string(parsed.content),
+        uptodate=uptodate,
+    )
+
+
+class MailTemplates:
+    """
+    Per-app cache of compiled email templates.
+
+    The templates in ``templates/email/`` are compiled by ``init_app``;
+    any others are compiled when first used. With
+    ``templates_auto_reload``, changed templates are recompiled.
+
+    """
+
+    def init_app(self, app: Application) -> None:
+        templates: Dict[str, MailTemplate] = {}
+        app.extensions["mail_templates"] = templates
+        for name in app.jinja_env.list_templates(
+            filter_func=lambda name: name.startswith("email/")
+        ):
+            templates[name] = compile_template(app.jinja_env, name)
+
+    def get(self, name: str) -> MailTemplate:
+        templates = current_app.extensions["mail_templates"]
+        compiled = templates.get(name)
+        if compiled is None or (
+            current_app.jinja_env.auto_reload
+            and compiled.uptodate is not None
+            and not compiled.uptodate()
+        ):
+            compiled = templates[name] = compile_template(current_app.jinja_env, name)
+        return compiled
+
+
+mail_templates = MailTemplates()
+
+
+def render_template(template: str, **kwargs: Any) -> Tuple[MailMeta, str]:
+    compiled = mail_templates.get(template)
+    context: Dict[str, Any] = dict(kwargs)
+    current_app.update_template_context(context)
+    meta = MailMeta(
+        compiled.subject.render(context),
+        compiled.sender.render(context) if compiled.sender else None,
+    )
+    return meta, compiled.body.render(context).strip()
+
+
+def render_envelope(job: MailJob) -> Envelope:
+    meta, body = render_template(job.template, **job.context)
+    sender = meta.sender or current_app.settings.smtp.sender
+    return Envelope(recipients=job.to, sender=sender, subject=meta.subject, body=body)
 
 
 def send_mail(to: List[str], template: str, **kwargs: Any) -> None:
@@ -32,8 +148,160 @@ def send_mail(to: List[str], template: str, **kwargs: Any) -> None:
     - ``subject`` (str): (required) used as the email subject
     - ``sender`` (str): override default sender address
 
+    If the ``smtp.outbox`` setting is enabled, the rendered email is
+    added to the database session, to be stored in the outbox when the
+    caller commits and delivered by ``flask send-queued-mail``; otherwise
+    it is sent immediately.
+
     """
-    meta, body = render_template(template, **kwargs)
-    sender = meta.sender or current_app.settings.smtp.sender
-    with mail.connect() as conn:
-        conn.send_message(subject=meta.subject, sender=sender, recipients=to, body=body)
+    result, = send_mail_batch([MailJob(to, template, kwargs)])
+    if result.error is not None:
+        raise result.error
+
+
+def send_mail_batch(jobs: Iterable[MailJob]) -> List[MailResult]:
+    """
+    Render and send many emails at once.
+
+    Every job is rendered before anything is sent, then the emails are
+    added to the outbox, or sent over as few SMTP connections as possible
+    (see :func:`deliver`). Returns one result per job, in order; delivery
+    errors are reported there rather than raised.
+
+    Queued emails are only added to the database session; the caller must
+    commit it, so that they are queued in the same transaction as the
+    change that caused them, or not at all.
+
+    """
+    jobs = list(jobs)
+    envelopes = [render_envelope(job) for job in jobs]
+    if current_app.settings.smtp.outbox:
+        db.session.add_all(
+            OutboxMessage(
+                recipients=e.recipients, sender=e.sender, subject=e.subject, body=e.body
+            )
+            for e in envelopes
+        )
+        return [MailResult(job) for job in jobs]
+
+    errors = deliver(envelopes)
+    return [MailResult(job, error) for job, error in zip(jobs, errors)]
+
+
+def _is_connection_error(error: Exception) -> bool:
+    # SMTP error replies and refused addresses leave the connection
+    # usable; disconnects and socket errors don't
+    if isinstance(error, smtplib.SMTPException):
+        return isinstance(error, smtplib.SMTPServerDisconnected)
+    return isinstance(error, OSError)
+
+
+def deliver(envelopes: Sequence[Envelope]) -> List[Optional[Exception]]:
+    """
+    Send ``envelopes`` over as few SMTP connections as possible.
+
+    Each connection sends at most ``smtp.max_emails`` messages. If a
+    connection breaks, delivery continues on a new one; if connecting
+    fails, the remaining messages fail with that error. Returns, for
+    each envelope in order, ``None`` if it was sent or the exception
+    that prevented it.
+
+    """
+    per_connection = current_app.settings.smtp.max_emails
+    errors: List[Optional[Exception]] = []
+    while len(errors) < len(envelopes):
+        start = len(errors)
+        end = start + per_connection
+        try:
+            with mail.connect() as conn:
+                for envelope in envelopes[start:end]:
+                    try:
+                        with MAIL_SEND_DURATION.time():
+                            conn.send_message(
+                                subject=envelope.subject,
+                                sender=envelope.sender,
+                                recipients=list(envelope.recipients),
+                                body=envelope.body,
+                            )
+                    except SEND_ERRORS as e:
+                        errors.append(e)
+                        if _is_connection_error(e):
+                            break
+                    else:
+                        errors.append(None)
+        except SEND_ERRORS as e:
+            if len(errors) == start:
+                errors.extend(e for _ in envelopes[start:])
+            # otherwise the connection broke (or failed to close) after
+            # some messages were handled; carry on with a new one
+
+    return errors
+
+
+def retry_delay(attempts: int) -> timedelta:
+    """How long to wait before retrying a message that failed ``attempts`` times."""
+    seconds = RETRY_BACKOFF * 2 ** (attempts - 1)
+    return timedelta(seconds=min(seconds, MAX_RETRY_BACKOFF))
+
+
+def _record_failure(message: OutboxMessage, error: Exception, now: datetime) -> None:
+    message.attempts += 1
+    message.last_error = repr(error)
+    if message.attempts >= MAX_ATTEMPTS:
+        message.status = OutboxMessageStatus.FAILED
+        logger.error(
+            "giving up on outbox message %s: %r", message.outbox_message_id, error
+        )
+    else:
+        message.send_after = now + retry_delay(message.attempts)
+        logger.warning(
+            "outbox message %s failed (attempt %s): %r",
+            message.outbox_message_id,
+            message.attempts,
+            error,
+        )
+
+
+def send_queued_mail(batch_size: int = 50) -> int:
+    """
+    Deliver up to ``batch_size`` queued messages that are due.
+
+    Rows are locked with ``SKIP LOCKED``, so several workers can drain
+    the outbox concurrently. Returns the number of messages attempted.
+
+    """
+    now = datetime.utcnow()
+    messages = (
+        OutboxMessage.query.filter(
+            OutboxMessage.status == OutboxMessageStatus.QUEUED,
+            OutboxMessage.send_after <= now,
+        )
+        .order_by(OutboxMessage.send_after)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    if not messages:
+        db.session.commit()
+        return 0
+
+    errors = deliver(
+        [
+            Envelope(
+                recipients=list(m.recipients),
+                sender=m.sender,
+                subject=m.subject,
+                body=m.body,
+            )
+            for m in messages
+        ]
+    )
+    for message, error in zip(messages, errors):
+        if error is None:
+            message.status = OutboxMessageStatus.SENT
+            message.sent_on = datetime.utcnow()
+        else:
+            _record_failure(message, error, now)
+
+    db.session.commit()
+    return len(messages)
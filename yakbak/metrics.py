@@ -0,0 +1,114 @@
+"""
+Prometheus metrics, served at ``/metrics`` when ``logging.metrics`` is on.
+
+Only site admins, and scrapers that send ``logging.metrics_token`` as a
+bearer token, can see them.
+
+The metrics are module-level, as :mod:`prometheus_client` expects, so
+that any module can update them. The web server runs several worker
+processes; if the ``prometheus_multiproc_dir`` environment variable
+names a directory, each process writes its samples there and
+``/metrics`` reports the totals over all of them. The directory must be
+emptied before the workers start (see ``start-web.sh``).
+
+"""
+from time import perf_counter
+from typing import Any, Optional
+import hmac
+import os
+
+from flask import abort, Blueprint, current_app, g, has_request_context, request
+from prometheus_client import (
+    CollectorRegistry,
+    CONTENT_TYPE_LATEST,
+    Counter,
+    generate_latest,
+    Histogram,
+    REGISTRY,
+)
+from prometheus_client.multiprocess import MultiProcessCollector
+from sqlalchemy import event
+from werkzeug.wrappers import Response
+
+from yakbak.models import db
+from yakbak.types import Application
+
+app = Blueprint("metrics", __name__)
+
+# the request latency of other blueprints (flask-admin, static files,
+# /metrics itself) isn't interesting enough to export
+TIMED_BLUEPRINTS = {"views", "manage", "social"}
+
+REQUEST_DURATION = Histogram(
+    "yakbak_request_duration_seconds",
+    "Time spent handling requests",
+    ["endpoint", "method", "status"],
+)
+DB_QUERIES = Counter("yakbak_db_queries_total", "SQL statements executed", ["endpoint"])
+MAIL_SEND_DURATION = Histogram(
+    "yakbak_mail_send_duration_seconds", "Time spent sending each email over SMTP"
+)
+CACHE_LOOKUPS = Counter(
+    "yakbak_cache_lookups_total", "Lookups in per-process caches", ["cache", "result"]
+)
+VOTES = Counter("yakbak_votes_total", "Votes cast or skipped", ["action"])
+
+
+def init_app(application: Application) -> None:
+    if not application.settings.logging.metrics:
+        return
+
+    event.listen(db.get_engine(application), "after_cursor_execute", _count_query)
+    application.before_request(_start_timer)
+    application.after_request(_record_status)
+    application.teardown_request(_observe_request)
+    application.register_blueprint(app)
+
+
+def _count_query(*args: Any) -> None:
+    endpoint = request.endpoint if has_request_context() else None
+    DB_QUERIES.labels(endpoint or "").inc()
+
+
+def _start_timer() -> None:
+    if request.blueprint in TIMED_BLUEPRINTS:
+        g.request_started = perf_counter()
+
+
+def _record_status(response: Response) -> Response:
+    g.response_status = response.status_code
+    return response
+
+
+def _observe_request(exc: Optional[BaseException]) -> None:
+    # observed at teardown so that requests which raise are counted too;
+    # after_request handlers don't run for those
+    started = g.pop("request_started", None)
+    status = g.pop("response_status", 500)
+    if started is not None:
+        if exc is not None:
+            status = 500
+        REQUEST_DURATION.labels(request.endpoint, request.method, status).observe(
+            perf_counter() - started
+        )
+
+
+@app.before_request
+def require_admin_or_token() -> None:
+    token = current_app.settings.logging.metrics_token
+    authorization = request.headers.get("Authorization", "")
+    if token and hmac.compare_digest(authorization, f"Bearer {token}"):
+        return
+    if not g.user or g.user.is_anonymous or not g.user.site_admin:
+        abort(404)
+
+
+@app.route("/metrics")
+def metrics() -> Response:
+    multiprocess_dir = os.environ.get("prometheus_multiproc_dir")
+    if multiprocess_dir:
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry, path=multiprocess_dir)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
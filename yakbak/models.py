@@ -15,19 +15,32 @@ Some style notes:
 
 """
 from datetime import datetime
-from typing import Optional
+from typing import Any, Optional, Tuple
 import enum
 import logging
 import uuid
 
 from attr import attrib, attrs
 from flask_sqlalchemy import BaseQuery, SQLAlchemy
-from sqlalchemy import and_, CheckConstraint, func, select, UniqueConstraint
+from sqlalchemy import (
+    and_,
+    CheckConstraint,
+    event,
+    func,
+    inspect,
+    or_,
+    select,
+    text,
+    UniqueConstraint,
+)
 from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.orm import column_property, Query, synonym
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import column_property, Mapper, Query, synonym
 from sqlalchemy.types import Enum, JSON
 from sqlalchemy_postgresql_json import JSONMutableList
 
+from yakbak.diff import word_diff
+
 db = SQLAlchemy()
 logger = logging.getLogger("models")
 
@@ -54,6 +67,12 @@ class ConductReportStatus(enum.Enum):
     RESOLVED = "resolved"
 
 
+class OutboxMessageStatus(enum.Enum):
+    QUEUED = "queued"
+    SENT = "sent"
+    FAILED = "failed"
+
+
 @attrs
 class TimeWindow:
     start: datetime = attrib()
@@ -219,6 +238,11 @@ class TalkCategory(db.Model):  # type: ignore
         db.Integer, db.ForeignKey("category.category_id"), primary_key=True
     )
 
+    # the primary key serves lookups by talk; this serves them by category
+    __table_args__ = (
+        db.Index("ix_talk_category_category_id_talk_id", "category_id", "talk_id"),
+    )
+
 
 class Category(db.Model):  # type: ignore
     category_id = db.Column(db.Integer, primary_key=True)
@@ -253,10 +277,13 @@ class Vote(db.Model):  # type: ignore
     # leaking information about the talk. This helps prevent brigading
     # and ballot stuffing.
     public_id = db.Column(UUID(as_uuid=True), default=uuid.uuid4, unique=True)
-    value = db.Column(db.Integer)
+    # value and skipped load their old values before being changed, so
+    # the flush events that maintain Talk.vote_count and Talk.vote_score
+    # can always compute the difference
+    value = column_property(db.Column(db.Integer), active_history=True)
     # A talk can be skipped without a vote value.
     # This allows a voter to come back to talks at a later time.
-    skipped = db.Column(db.Boolean)
+    skipped = column_property(db.Column(db.Boolean), active_history=True)
     comment = db.Column(db.Text)
 
     talk = db.relationship("Talk", backref=db.backref("votes", lazy="dynamic"))
@@ -266,11 +293,16 @@ class Vote(db.Model):  # type: ignore
         # TODO: Is this the correct approach here? Should conferences be
         # able to set their own voting scales?
         CheckConstraint("value is NULL OR value IN (-1, 0, 1)", name="ck_vote_values"),
+        # a reviewer's votes, by whether they were cast or skipped; the
+        # talk ID makes it covering for "talks this user has voted on"
+        db.Index(
+            "ix_vote_user_id_skipped_value", "user_id", "skipped", "value", "talk_id"
+        ),
     )
 
     @classmethod
     def clear_skipped(
-        cls, *, user: User, category: Category = None, commit: bool = False
+        cls, *, user: User, category: Optional[Category] = None, commit: bool = False
     ) -> None:
         """Remove any skipped votes for the given user and category.
 
@@ -295,8 +327,21 @@ class Vote(db.Model):  # type: ignore
                 Vote.talk_id == TalkCategory.talk_id,
                 TalkCategory.category_id == category.category_id,
             )
+
+        # Bulk deletes bypass the flush events that maintain the talk
+        # vote counters. Skipped votes aren't counted, but any value
+        # they still carry is part of the score.
+        scores = (
+            query.filter(cls.value != None)  # noqa: E711
+            .with_entities(cls.talk_id, func.sum(cls.value))
+            .group_by(cls.talk_id)
+            .all()
+        )
+        connection = db.session.connection()
+        for talk_id, score in scores:
+            _adjust_vote_counters(connection, talk_id, 0, -score)
+
         query.delete(synchronize_session="fetch")
-        db.session.execute(query)
         if commit:
             db.session.commit()
 
@@ -353,6 +398,8 @@ class TalkQuery(BaseQuery):
 class Talk(db.Model):  # type: ignore
     query_class = TalkQuery
 
+    ANONYMIZED_FIELDS = ("title", "description", "outline", "take_aways")
+
     talk_id = db.Column(db.Integer, primary_key=True)
     state = db.Column(Enum(TalkStatus), server_default=TalkStatus.PROPOSED.name)
 
@@ -374,6 +421,11 @@ class Talk(db.Model):  # type: ignore
     anonymized_description = db.Column(db.Text)
     anonymized_outline = db.Column(db.Text)
     anonymized_take_aways = db.Column(db.Text)
+    # word diffs between each field in ANONYMIZED_FIELDS and its
+    # anonymized version, as {field: [[op, text], ...]}; kept up to date
+    # by _update_anonymization_diff and rendered by the
+    # anonymization_diff template filter
+    anonymization_diff = db.Column(JSON)
 
     accepted_recording_release = db.Column(db.Boolean)
 
@@ -384,20 +436,22 @@ class Talk(db.Model):  # type: ignore
         db.TIMESTAMP, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow
     )
 
-    vote_count = column_property(
-        select([func.count(Vote.talk_id)]).where(
-            and_(Vote.talk_id == talk_id, Vote.skipped == False)
-        )  # noqa: E712
-        # TODO: sqlalchemy-stubs doesn't seem to like a bare `Vote`
-        # here. This should be fixed upstream.
-        .correlate_except(Vote.__table__)
-    )
+    # Denormalized from the vote table, and kept up to date by the Vote
+    # flush events below (and by Vote.clear_skipped for bulk deletes).
+    # ``vote_count`` counts non-skipped votes, ``vote_score`` sums the
+    # values of all votes; `flask reconcile-vote-counters` repairs drift.
+    vote_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    vote_score = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
-    vote_score = column_property(
-        select([func.sum(Vote.value)]).where(Vote.talk_id == talk_id)
-        # TODO: sqlalchemy-stubs doesn't seem to like a bare `Vote`
-        # here. This should be fixed upstream.
-        .correlate_except(Vote.__table__)
+    __table_args__ = (
+        db.Index("ix_talk_vote_count", "vote_count"),
+        # the talks open for voting, least voted first
+        db.Index(
+            "ix_talk_votable_vote_count",
+            "vote_count",
+            "talk_id",
+            postgresql_where=text("state = 'PROPOSED' AND is_anonymized"),
+        ),
     )
 
     def __str__(self) -> str:
@@ -409,6 +463,34 @@ class Talk(db.Model):  # type: ignore
         ts.user = speaker
         self.speakers.append(ts)
 
+    @classmethod
+    def reconcile_vote_counters(cls) -> int:
+        """
+        Recompute ``vote_count`` and ``vote_score`` from the vote table.
+
+        Returns the number of talks whose counters had drifted. Does not
+        commit the session.
+
+        """
+        count = (
+            select([func.count(Vote.talk_id)])
+            .where(
+                and_(Vote.talk_id == cls.talk_id, Vote.skipped == False)  # noqa: E712
+            )
+            .as_scalar()
+        )
+        score = (
+            select([func.coalesce(func.sum(Vote.value), 0)])
+            .where(Vote.talk_id == cls.talk_id)
+            .as_scalar()
+        )
+        result = db.session.execute(
+            cls.__table__.update()
+            .where(or_(cls.vote_count != count, cls.vote_score != score))
+            .values(vote_count=count, vote_score=score)
+        )
+        return result.rowcount
+
     def reset_after_edits(self) -> None:
         # prompt admins to re-categorize
         del self.categories[:]
@@ -422,6 +504,91 @@ class Talk(db.Model):  # type: ignore
         self.has_anonymization_changes = False
 
 
+@event.listens_for(Talk, "before_insert")
+@event.listens_for(Talk, "before_update")
+def _update_anonymization_diff(
+    mapper: Mapper, connection: Connection, talk: Talk
+) -> None:
+    # diff only the fields where either side changed
+    attrs = inspect(talk).attrs
+    changed = [
+        field
+        for field in Talk.ANONYMIZED_FIELDS
+        if attrs[field].history.has_changes()
+        or attrs[f"anonymized_{field}"].history.has_changes()
+    ]
+    if not changed:
+        return
+
+    diffs = dict(talk.anonymization_diff or {})
+    for field in changed:
+        original = getattr(talk, field)
+        anonymized = getattr(talk, f"anonymized_{field}")
+        if anonymized:
+            diffs[field] = word_diff(original or "", anonymized)
+        else:
+            diffs.pop(field, None)
+    talk.anonymization_diff = diffs or None
+
+
+def _adjust_vote_counters(
+    connection: Connection, talk_id: int, count_delta: int, score_delta: int
+) -> None:
+    if not count_delta and not score_delta:
+        return
+    talk = Talk.__table__
+    connection.execute(
+        talk.update()
+        .where(talk.c.talk_id == talk_id)
+        .values(
+            vote_count=talk.c.vote_count + count_delta,
+            vote_score=talk.c.vote_score + score_delta,
+            # votes aren't edits to the talk, and shouldn't change the
+            # ETag of pages that don't show them; see PageValidators
+            updated=talk.c.updated,
+        )
+    )
+
+
+def _vote_contribution(
+    skipped: Optional[bool], value: Optional[int]
+) -> Tuple[int, int]:
+    """Return what a vote adds to its talk's ``(vote_count, vote_score)``."""
+    return (1 if skipped is False else 0, value or 0)
+
+
+def _history_values(vote: Vote, key: str) -> Tuple[Any, Any]:
+    """Return the ``(old, new)`` values of ``key`` being flushed for ``vote``."""
+    added, unchanged, deleted = inspect(vote).attrs[key].history
+    current = unchanged[0] if unchanged else None
+    old = deleted[0] if deleted else current
+    new = added[0] if added else current
+    return old, new
+
+
+@event.listens_for(Vote, "after_insert")
+def _count_inserted_vote(mapper: Mapper, connection: Connection, vote: Vote) -> None:
+    count, score = _vote_contribution(vote.skipped, vote.value)  # type: ignore
+    _adjust_vote_counters(connection, vote.talk_id, count, score)
+
+
+@event.listens_for(Vote, "after_update")
+def _count_updated_vote(mapper: Mapper, connection: Connection, vote: Vote) -> None:
+    old_skipped, new_skipped = _history_values(vote, "skipped")
+    old_value, new_value = _history_values(vote, "value")
+    old_count, old_score = _vote_contribution(old_skipped, old_value)
+    new_count, new_score = _vote_contribution(new_skipped, new_value)
+    _adjust_vote_counters(
+        connection, vote.talk_id, new_count - old_count, new_score - old_score
+    )
+
+
+@event.listens_for(Vote, "after_delete")
+def _count_deleted_vote(mapper: Mapper, connection: Connection, vote: Vote) -> None:
+    count, score = _vote_contribution(vote.skipped, vote.value)  # type: ignore
+    _adjust_vote_counters(connection, vote.talk_id, -count, -score)
+
+
 class TalkSpeaker(db.Model):  # type: ignore
     talk_id = db.Column(db.Integer, db.ForeignKey("talk.talk_id"), primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.user_id"), primary_key=True)
@@ -435,6 +602,11 @@ class TalkSpeaker(db.Model):  # type: ignore
         db.TIMESTAMP, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow
     )
 
+    # the primary key serves lookups by talk; this serves them by user
+    __table_args__ = (
+        db.Index("ix_talk_speaker_user_id_talk_id", "user_id", "talk_id"),
+    )
+
 
 class Gender(enum.Enum):
     WOMAN = "Woman"
@@ -529,8 +701,96 @@ class DemographicSurvey(db.Model):  # type: ignore
 
 
 class UsedMagicLink(db.Model):  # type: ignore
-    token = db.Column(db.String(512), primary_key=True)
+    """A magic link token that has been used to log in, and can't be again.
+
+    See :func:`yakbak.auth.claim_magic_link_token`. Tokens are stored as
+    a fingerprint, and only until they would have expired anyway.
+
+    """
+
+    fingerprint = db.Column(db.LargeBinary(16), primary_key=True)
+    # NULL if magic links don't expire
+    expires_on = db.Column(db.TIMESTAMP)
+
+    # for `flask clean-magic-links`
+    __table_args__ = (db.Index("ix_used_magic_link_expires_on", "expires_on"),)
+
+
+class ThrottleBucket(db.Model):  # type: ignore
+    """A rate limit's token bucket, shared by all processes.
+
+    See :class:`yakbak.throttle.DatabaseBuckets`. ``tokens`` is how many
+    tokens were left as of ``updated``; the bucket refills from then on.
+
+    """
 
-    used_on = db.Column(
+    key = db.Column(db.String(512), primary_key=True)
+    tokens = db.Column(db.Float, nullable=False)
+    updated = db.Column(db.TIMESTAMP, nullable=False)
+
+    # for `flask prune throttle-buckets`
+    __table_args__ = (db.Index("ix_throttle_bucket_updated", "updated"),)
+
+
+class OutboxMessage(db.Model):  # type: ignore
+    """An email waiting to be (or already) delivered by the mail worker.
+
+    Messages are rendered when they are queued, so the worker only needs
+    to talk to the SMTP server. Failed deliveries are retried with
+    backoff until ``attempts`` reaches the limit in :mod:`yakbak.mail`.
+
+    """
+
+    outbox_message_id = db.Column(db.BigInteger, primary_key=True)
+
+    recipients = db.Column(JSONMutableList.as_mutable(JSON), nullable=False)
+    sender = db.Column(db.String(512), nullable=False)
+    subject = db.Column(db.Text, nullable=False)
+    body = db.Column(db.Text, nullable=False)
+
+    status = db.Column(
+        Enum(OutboxMessageStatus),
+        nullable=False,
+        default=OutboxMessageStatus.QUEUED,
+        server_default=OutboxMessageStatus.QUEUED.name,
+    )
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    send_after = db.Column(db.TIMESTAMP, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+    sent_on = db.Column(db.TIMESTAMP)
+
+    created = db.Column(db.TIMESTAMP, nullable=False, default=datetime.utcnow)
+    updated = db.Column(
+        db.TIMESTAMP, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+
+    __table_args__ = (
+        db.Index(
+            "ix_outbox_message_queued",
+            "send_after",
+            postgresql_where=text("status = 'QUEUED'"),
+        ),
+    )
+
+
+class RenderedMarkdown(db.Model):  # type: ignore
+    """HTML rendered from Markdown text, keyed by a hash of the text.
+
+    See :class:`yakbak.cache.MarkdownCache`. The HTML is never updated: a
+    change to the text (or to the renderer) produces a new hash. Instead
+    ``updated`` records (to within a day) when the row was last read, so
+    that ``flask prune rendered-markdown`` can delete HTML no longer used.
+
+    """
+
+    rendered_markdown_id = db.Column(db.BigInteger, primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False, unique=True)
+    html = db.Column(db.Text, nullable=False)
+
+    created = db.Column(db.TIMESTAMP, nullable=False, default=datetime.utcnow)
+    updated = db.Column(
         db.TIMESTAMP, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow
     )
+
+    # for `flask prune rendered-markdown`
+    __table_args__ = (db.Index("ix_rendered_markdown_updated", "updated"),)
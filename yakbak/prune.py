@@ -0,0 +1,178 @@
+"""
+Delete rows that are no longer needed, a batch at a time.
+
+Used by ``flask prune``. Each :class:`PruneJob` names a table and which of
+its rows are old enough to go. Rows are deleted in batches, each in a
+transaction of its own, so that no lock is held for long and autovacuum
+can reclaim the space as it goes; a pause between batches leaves room for
+the app's own queries. Rows locked by a running request are skipped, and
+picked up by the next run.
+
+Other retention jobs can be added with :func:`register`.
+
+"""
+from collections import Counter
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence
+import time
+
+from attr import attrib, attrs
+from sqlalchemy import and_, Column, func, select, Table, tuple_
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql.elements import ColumnElement
+
+from yakbak.models import (
+    _adjust_vote_counters,
+    db,
+    OutboxMessage,
+    OutboxMessageStatus,
+    RenderedMarkdown,
+    ThrottleBucket,
+    UsedMagicLink,
+    Vote,
+)
+
+# rows deleted per transaction
+BATCH_SIZE = 1000
+
+# seconds to wait between batches
+PAUSE = 0.1
+
+
+@attrs(frozen=True)
+class PruneJob:
+    name: str = attrib()
+    description: str = attrib()
+    table: Table = attrib()
+    # the rows to delete, given the cutoff time
+    where: Callable[[datetime], ColumnElement] = attrib()
+    # how old (by the job's own measure) rows must be to be deleted
+    older_than_days: int = attrib()
+    # columns of the deleted rows to pass to ``on_delete``
+    returning: Sequence[Column] = attrib(default=())
+    # called with each batch's deleted rows, before the batch commits
+    on_delete: Optional[Callable[[Connection, List[Any]], None]] = attrib(default=None)
+
+    def count(self, cutoff: datetime) -> int:
+        """Return the number of rows a run would delete."""
+        statement = select([func.count()]).select_from(self.table)
+        return db.session.execute(statement.where(self.where(cutoff))).scalar()
+
+    def delete_batch(self, cutoff: datetime, batch_size: int) -> int:
+        """Delete and commit up to ``batch_size`` rows; return how many."""
+        key = list(self.table.primary_key.columns)
+        batch = (
+            select(key)
+            .where(self.where(cutoff))
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        if len(key) == 1:
+            statement = self.table.delete().where(key[0].in_(batch))
+        else:
+            statement = self.table.delete().where(tuple_(*key).in_(batch))
+        if self.returning:
+            statement = statement.returning(*self.returning)
+
+        result = db.session.execute(statement)
+        deleted = result.rowcount
+        if self.on_delete is not None:
+            self.on_delete(db.session.connection(), result.fetchall())
+        db.session.commit()
+        return deleted
+
+
+JOBS: Dict[str, PruneJob] = {}
+
+
+def register(job: PruneJob) -> PruneJob:
+    JOBS[job.name] = job
+    return job
+
+
+def prune(
+    job: PruneJob,
+    cutoff: datetime,
+    batch_size: int = BATCH_SIZE,
+    pause: float = PAUSE,
+    progress: Optional[Callable[[int], None]] = None,
+) -> int:
+    """
+    Delete ``job``'s rows older than ``cutoff``, and return how many.
+
+    ``progress`` is called with the running total after each batch.
+
+    """
+    total = 0
+    while True:
+        deleted = job.delete_batch(cutoff, batch_size)
+        total += deleted
+        if deleted and progress is not None:
+            progress(total)
+        if deleted < batch_size:
+            return total
+        time.sleep(pause)
+
+
+def _unscore_votes(connection: Connection, rows: List[Any]) -> None:
+    # bulk deletes bypass the flush events that maintain the talk vote
+    # counters; see Vote.clear_skipped
+    scores: Dict[int, int] = Counter()
+    for talk_id, value in rows:
+        scores[talk_id] += value or 0
+    for talk_id, score in scores.items():
+        _adjust_vote_counters(connection, talk_id, 0, -score)
+
+
+register(
+    PruneJob(
+        name="magic-links",
+        description="used magic links, aged from when they expired",
+        table=UsedMagicLink.__table__,
+        where=lambda cutoff: UsedMagicLink.expires_on <= cutoff,
+        older_than_days=0,
+    )
+)
+register(
+    PruneJob(
+        name="outbox",
+        description="sent and failed mail, aged from its last delivery attempt",
+        table=OutboxMessage.__table__,
+        where=lambda cutoff: and_(
+            OutboxMessage.status != OutboxMessageStatus.QUEUED,
+            OutboxMessage.updated <= cutoff,
+        ),
+        older_than_days=30,
+    )
+)
+register(
+    PruneJob(
+        name="rendered-markdown",
+        description="stored HTML rendered from Markdown, aged from its last use",
+        table=RenderedMarkdown.__table__,
+        where=lambda cutoff: RenderedMarkdown.updated <= cutoff,
+        older_than_days=30,
+    )
+)
+register(
+    PruneJob(
+        name="skipped-votes",
+        description="skipped votes, aged from when they were skipped",
+        table=Vote.__table__,
+        where=lambda cutoff: and_(
+            Vote.skipped == True, Vote.updated <= cutoff  # noqa: E712
+        ),
+        older_than_days=30,
+        returning=(Vote.__table__.c.talk_id, Vote.__table__.c.value),
+        on_delete=_unscore_votes,
+    )
+)
+register(
+    PruneJob(
+        name="throttle-buckets",
+        description="rate limit counts, aged from the last request they counted",
+        table=ThrottleBucket.__table__,
+        where=lambda cutoff: ThrottleBucket.updated <= cutoff,
+        older_than_days=1,
+    )
+)
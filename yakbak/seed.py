@@ -0,0 +1,325 @@
+"""
+Generate a synthetic conference's worth of users, talks and votes.
+
+Used by ``flask seed-data`` to fill a development or load-test database.
+Rows are written with multi-row ``INSERT`` statements, bypassing the
+ORM, so that tens of thousands of them take seconds rather than minutes.
+The ORM flush events that maintain talks' vote counters don't run, so
+the counters are reconciled once everything is inserted.
+
+"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence
+import random
+import uuid
+
+from attr import attrib, attrs
+from sqlalchemy import Table
+
+from yakbak.forms import PastSpeaking
+from yakbak.models import (
+    AgeGroup,
+    Category,
+    ConductReport,
+    Conference,
+    db,
+    DemographicSurvey,
+    Ethnicity,
+    Gender,
+    InvitationStatus,
+    ProgrammingExperience,
+    Talk,
+    TalkCategory,
+    TalkSpeaker,
+    TalkStatus,
+    User,
+    Vote,
+)
+
+# rows per INSERT statement
+INSERT_BATCH_SIZE = 1000
+
+# data is spread over this many days before now, like a CFP's submissions
+TIME_SPAN = timedelta(days=30)
+
+FIRST_NAMES = (
+    "Ada Alan Barbara Brian Carol Dennis Edsger Frances Grace Guido Hedy Ivan "
+    "Jean John Katherine Ken Linus Margaret Mary Niklaus Radia Sophie Tim Yukihiro"
+).split()
+LAST_NAMES = (
+    "Allen Backus Bartik Cerf Dijkstra Goldberg Hamilton Hopper Johnson Kay "
+    "Kernighan Knuth Lamarr Liskov Lovelace Perlman Ritchie Rossum Thompson Wirth"
+).split()
+TOPICS = (
+    "Web Data Science Testing Packaging Async Security Education Community "
+    "Performance Tooling Hardware Machine Learning Databases Typing"
+).split()
+WORDS = (
+    "python code data test library package module function class async web "
+    "server database query cache performance profile deploy team community "
+    "learn build design refactor type error debug fast simple scale api user"
+).split()
+
+
+@attrs(frozen=True)
+class SeedCounts:
+    """How many rows of each kind to create."""
+
+    users: int = attrib(default=1000)
+    # of the users, how many are reviewers; only reviewers vote
+    reviewers: int = attrib(default=50)
+    talks: int = attrib(default=300)
+    # talks with a second speaker
+    co_speakers: int = attrib(default=60)
+    categories: int = attrib(default=8)
+    votes: int = attrib(default=5000)
+    surveys: int = attrib(default=400)
+    conduct_reports: int = attrib(default=10)
+
+    def check(self) -> None:
+        """Raise ``ValueError`` if the counts can't all be satisfied."""
+        if self.co_speakers and self.users < 2:
+            raise ValueError("co-speakers need at least 2 users")
+        if self.reviewers > self.users:
+            raise ValueError("there can't be more reviewers than users")
+        if self.co_speakers > self.talks:
+            raise ValueError("there can't be more co-speakers than talks")
+        if self.surveys > self.users:
+            raise ValueError("there can't be more surveys than users")
+        if self.votes > self.reviewers * self.talks:
+            raise ValueError("each reviewer can vote on each talk only once")
+        if self.talks and not (self.users and self.categories):
+            raise ValueError("talks need users and categories")
+        if self.conduct_reports and not self.talks:
+            raise ValueError("conduct reports need talks")
+
+
+def _insert(
+    table: Table, rows: Sequence[Dict[str, Any]], returning: Optional[str] = None
+) -> List[Any]:
+    """Insert ``rows`` in batches, returning the ``returning`` column of each."""
+    values: List[Any] = []
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        end = start + INSERT_BATCH_SIZE
+        statement = table.insert().values(rows[start:end])
+        if returning is None:
+            db.session.execute(statement)
+        else:
+            result = db.session.execute(statement.returning(table.c[returning]))
+            values.extend(row[0] for row in result)
+    return values
+
+
+class Seeder:
+    def __init__(self, conference: Conference, rng: random.Random) -> None:
+        self.conference = conference
+        self.talk_lengths = list(conference.talk_lengths)
+        self.rng = rng
+        self.now = datetime.utcnow()
+        # so that users from several runs don't collide
+        self.run = uuid.uuid4().hex[:8]
+
+    def timestamp(self) -> datetime:
+        return self.now - TIME_SPAN * self.rng.random()
+
+    def text(self, words: int) -> str:
+        return " ".join(self.rng.choice(WORDS) for _ in range(words)).capitalize()
+
+    def users(self, count: int, reviewers: int) -> List[int]:
+        rows = []
+        for i in range(count):
+            created = self.timestamp()
+            rows.append(
+                {
+                    "fullname": " ".join(
+                        (self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES))
+                    ),
+                    "email": f"seed-{self.run}-{i}@example.com",
+                    "speaker_bio": self.text(30),
+                    "reviewer": i < reviewers,
+                    "created": created,
+                    "updated": created,
+                }
+            )
+        return _insert(User.__table__, rows, returning="user_id")
+
+    def categories(self, count: int) -> List[int]:
+        existing = {c.name for c in self.conference.categories}
+        names = [t for t in TOPICS if t not in existing]
+        names.extend(f"Topic {i}" for i in range(count) if f"Topic {i}" not in existing)
+        rows = [
+            {"conference_id": self.conference.conference_id, "name": name}
+            for name in names[:count]
+        ]
+        return _insert(Category.__table__, rows, returning="category_id")
+
+    def talks(self, count: int) -> List[int]:
+        rows = []
+        for _ in range(count):
+            title = self.text(self.rng.randint(3, 8))
+            description = "\n\n".join(self.text(60) for _ in range(3))
+            outline = "\n".join(f"{n}. {self.text(6)}" for n in range(1, 6))
+            take_aways = self.text(25)
+            anonymized = self.rng.random() < 0.8
+            created = self.timestamp()
+            rows.append(
+                {
+                    "title": title,
+                    "length": self.rng.choice(self.talk_lengths),
+                    "description": description,
+                    "outline": outline,
+                    "requirements": None,
+                    "take_aways": take_aways,
+                    "state": (
+                        TalkStatus.WITHDRAWN
+                        if self.rng.random() < 0.05
+                        else TalkStatus.PROPOSED
+                    ),
+                    "is_anonymized": anonymized,
+                    "anonymized_title": title if anonymized else None,
+                    "anonymized_description": description if anonymized else None,
+                    "anonymized_outline": outline if anonymized else None,
+                    "anonymized_take_aways": take_aways if anonymized else None,
+                    "accepted_recording_release": True,
+                    "created": created,
+                    "updated": created,
+                }
+            )
+        return _insert(Talk.__table__, rows, returning="talk_id")
+
+    def speakers(self, talk_ids: List[int], user_ids: List[int], co: int) -> int:
+        rows = []
+        co_speaker_talks = set(self.rng.sample(talk_ids, co))
+        for talk_id in talk_ids:
+            speakers = self.rng.sample(
+                user_ids, 2 if talk_id in co_speaker_talks else 1
+            )
+            for n, user_id in enumerate(speakers):
+                created = self.timestamp()
+                pending = n > 0 and self.rng.random() < 0.2
+                rows.append(
+                    {
+                        "talk_id": talk_id,
+                        "user_id": user_id,
+                        "state": (
+                            InvitationStatus.PENDING
+                            if pending
+                            else InvitationStatus.CONFIRMED
+                        ),
+                        "created": created,
+                        "updated": created,
+                    }
+                )
+        _insert(TalkSpeaker.__table__, rows)
+        return len(rows)
+
+    def talk_categories(self, talk_ids: List[int], category_ids: List[int]) -> int:
+        rows = [
+            {"talk_id": talk_id, "category_id": category_id}
+            for talk_id in talk_ids
+            for category_id in self.rng.sample(
+                category_ids, min(len(category_ids), self.rng.randint(1, 2))
+            )
+        ]
+        _insert(TalkCategory.__table__, rows)
+        return len(rows)
+
+    def votes(self, count: int, talk_ids: List[int], reviewer_ids: List[int]) -> int:
+        rows = []
+        pairs = self.rng.sample(range(len(talk_ids) * len(reviewer_ids)), count)
+        for pair in pairs:
+            talk, reviewer = divmod(pair, len(reviewer_ids))
+            skipped = self.rng.random() < 0.1
+            created = self.timestamp()
+            rows.append(
+                {
+                    "talk_id": talk_ids[talk],
+                    "user_id": reviewer_ids[reviewer],
+                    "public_id": uuid.uuid4(),
+                    "value": None if skipped else self.rng.choice((-1, 0, 1)),
+                    "skipped": skipped,
+                    "comment": None if skipped else self.text(12),
+                    "created": created,
+                    "updated": created,
+                }
+            )
+        _insert(Vote.__table__, rows)
+        return len(rows)
+
+    def surveys(self, count: int, user_ids: List[int]) -> int:
+        def some(choices: Any) -> List[str]:
+            names = [c.name for c in choices]
+            return self.rng.sample(names, self.rng.choice((1, 1, 1, 2)))
+
+        rows = []
+        for user_id in self.rng.sample(user_ids, count):
+            created = self.timestamp()
+            rows.append(
+                {
+                    "user_id": user_id,
+                    "gender": some(Gender),
+                    "ethnicity": some(Ethnicity),
+                    "past_speaking": some(PastSpeaking),
+                    "age_group": self.rng.choice(list(AgeGroup)),
+                    "programming_experience": self.rng.choice(
+                        list(ProgrammingExperience)
+                    ),
+                    "created": created,
+                    "updated": created,
+                }
+            )
+        _insert(DemographicSurvey.__table__, rows)
+        return len(rows)
+
+    def conduct_reports(
+        self, count: int, talk_ids: List[int], user_ids: List[int]
+    ) -> int:
+        rows = []
+        for _ in range(count):
+            created = self.timestamp()
+            anonymous = self.rng.random() < 0.5
+            rows.append(
+                {
+                    "talk_id": self.rng.choice(talk_ids),
+                    "user_id": None if anonymous else self.rng.choice(user_ids),
+                    "text": self.text(20),
+                    "created": created,
+                    "updated": created,
+                }
+            )
+        _insert(ConductReport.__table__, rows)
+        return len(rows)
+
+
+def seed(
+    conference: Conference, counts: SeedCounts, rng: Optional[random.Random] = None
+) -> Dict[str, int]:
+    """
+    Add ``counts`` of synthetic rows for ``conference``, and commit.
+
+    Pass a seeded ``rng`` for repeatable data (apart from user emails
+    and vote public IDs, which must be unique across runs). Returns the
+    number of rows added to each table.
+
+    """
+    counts.check()
+    seeder = Seeder(conference, rng or random.Random())
+
+    user_ids = seeder.users(counts.users, counts.reviewers)
+    category_ids = seeder.categories(counts.categories)
+    talk_ids = seeder.talks(counts.talks)
+    added = {
+        "user": len(user_ids),
+        "category": len(category_ids),
+        "talk": len(talk_ids),
+        "talk_speaker": seeder.speakers(talk_ids, user_ids, counts.co_speakers),
+        "talk_category": seeder.talk_categories(talk_ids, category_ids),
+        "vote": seeder.votes(counts.votes, talk_ids, user_ids[: counts.reviewers]),
+        "demographic_survey": seeder.surveys(counts.surveys, user_ids),
+        "conduct_report": seeder.conduct_reports(
+            counts.conduct_reports, talk_ids, user_ids
+        ),
+    }
+    Talk.reconcile_vote_counters()
+    db.session.commit()
+    return added
@@ -4,8 +4,8 @@ import os
 import os.path
 
 from dotenv import load_dotenv
-from attr import attrib, attrs, fields
-from attr.validators import instance_of, optional
+from attr import attrib, Attribute, attrs, fields
+from attr.validators import in_, instance_of, optional
 from flask import url_for
 import toml
 
@@ -18,6 +18,19 @@ class InvalidSettings(Exception):
     pass
 
 
+def comma_separated(value: Any) -> Any:
+    """Split a string, eg from the environment, into a list."""
+    if isinstance(value, str):
+        return [item.strip() for item in value.split(",") if item.strip()]
+    return value
+
+
+def positive(instance: Any, attribute: Attribute, value: int) -> None:
+    """Validate that ``value`` is at least 1."""
+    if value < 1:
+        raise ValueError(f"{attribute.name} must be at least 1, not {value}")
+
+
 T = TypeVar("T", bound="Section")
 
 
@@ -66,17 +79,34 @@ class AuthMethod(Section):
 @attrs(frozen=True)
 class DbSettings(Section):
     url: str = attrib(validator=instance_of(str))
+    # seconds each worker process may serve a cached Conference
+    conference_cache_ttl: int = attrib(validator=instance_of(int), default=60)
+    # seconds each worker process may serve a logged in user's cached
+    # name, email and flags
+    user_cache_ttl: int = attrib(validator=instance_of(int), default=30)
+    # store rendered Markdown in the database, not just in each process
+    persist_rendered_markdown: bool = attrib(validator=instance_of(bool), default=False)
 
 
 @attrs(frozen=True)
 class FlaskSettings(Section):
     secret_key: str = attrib(validator=instance_of(str))
     templates_auto_reload: bool = attrib(validator=instance_of(bool), default=False)
+    # reverse proxies in front of the app that append to X-Forwarded-For
+    proxies: int = attrib(validator=instance_of(int), default=0)
 
 
 @attrs(frozen=True)
 class LoggingSettings(Section):
     level: str = attrib(validator=instance_of(str), default="INFO")
+    # fraction of requests whose SQL queries are counted and timed
+    sql_sample_rate: float = attrib(converter=float, default=0.0)
+    server_timing: bool = attrib(validator=instance_of(bool), default=False)
+    metrics: bool = attrib(validator=instance_of(bool), default=False)
+    # lets scrapers read /metrics without logging in
+    metrics_token: Optional[str] = attrib(
+        validator=optional(instance_of(str)), default=None
+    )
 
 
 @attrs(frozen=True)
@@ -102,6 +132,20 @@ class AuthSettings(Section):
     signing_key: Optional[str] = attrib(
         validator=optional(instance_of(str)), default=None
     )
+    # keys that used to be the signing key; magic links they signed are
+    # still accepted, so that keys can be rotated
+    previous_signing_keys: List[str] = attrib(
+        converter=comma_separated, validator=instance_of(list), factory=list
+    )
+
+    # seconds before another magic link is sent to the same address
+    email_magic_link_resend_after: int = attrib(converter=int, default=300)
+    # magic links each client IP address can ask for an hour
+    email_magic_link_requests_per_hour: int = attrib(converter=int, default=20)
+    # where to count requests: "memory" (per process) or "database"
+    email_magic_link_throttle: str = attrib(
+        validator=in_(("memory", "database")), default="memory"
+    )
 
     def auth_methods(self) -> List[AuthMethod]:
         """
@@ -147,6 +191,10 @@ class SMTPSettings(Section):
     use_tls: bool = attrib(default=True)
     password: Optional[str] = attrib(validator=optional(instance_of(str)), default=None)
     sender: Optional[str] = attrib(validator=optional(instance_of(str)), default=None)
+    # queue mail in the database for `flask send-queued-mail` to deliver
+    outbox: bool = attrib(validator=instance_of(bool), default=False)
+    # how many messages to send over one SMTP connection before reconnecting
+    max_emails: int = attrib(validator=[instance_of(int), positive], default=50)
 
 
 @attrs(frozen=True)
@@ -182,21 +230,31 @@ def load_settings_file(settings_path: str) -> Settings:
 def load_settings_from_env() -> Settings:
     settings_data = {
         "db": {
-            "url": os.getenv("DATABASE_URL")
+            "url": os.getenv("DATABASE_URL"),
+            "conference_cache_ttl": int(os.getenv("CONFERENCE_CACHE_TTL", 60)),
+            "user_cache_ttl": int(os.getenv("USER_CACHE_TTL", 30)),
+            "persist_rendered_markdown": bool(os.getenv("PERSIST_RENDERED_MARKDOWN")),
         },
         "logging": {
-            "level": os.getenv("LOGGING_LEVEL", "INFO")
+            "level": os.getenv("LOGGING_LEVEL", "INFO"),
+            "sql_sample_rate": float(os.getenv("LOGGING_SQL_SAMPLE_RATE", 0)),
+            "server_timing": bool(os.getenv("LOGGING_SERVER_TIMING")),
+            "metrics": bool(os.getenv("LOGGING_METRICS")),
+            "metrics_token": os.getenv("LOGGING_METRICS_TOKEN"),
         },
         "smtp": {
             "host": os.getenv("MAILGUN_SMTP_SERVER"),
             "port": int(os.getenv("MAILGUN_SMTP_PORT", 587)),
             "username": os.getenv("MAILGUN_SMTP_LOGIN"),
             "password": os.getenv("MAILGUN_SMTP_PASSWORD"),
-            "sender": os.getenv("SMTP_SENDER", "Yak-Bak <yakbak@example.com>")
+            "sender": os.getenv("SMTP_SENDER", "Yak-Bak <yakbak@example.com>"),
+            "outbox": bool(os.getenv("SMTP_OUTBOX")),
+            "max_emails": int(os.getenv("SMTP_MAX_EMAILS", 50)),
         },
         "flask": {
             "secret_key": os.getenv("FLASK_SECRET_KEY"),
-            "templates_auto_reload": os.getenv("FLASK_TEMPLATES_AUTO_RELOAD", False)
+            "templates_auto_reload": os.getenv("FLASK_TEMPLATES_AUTO_RELOAD", False),
+            "proxies": int(os.getenv("FLASK_PROXIES", 0)),
         },
         "auth": {
             "github_key_id": os.getenv("AUTH_GITHUB_KEY_ID"),
@@ -205,7 +263,17 @@ def load_settings_from_env() -> Settings:
             "google_secret": os.getenv("AUTH_GOOGLE_SECRET"),
             "email_magic_link": os.getenv("AUTH_EMAIL_MAGIC_LINK", True),
             "email_magic_link_expiry": os.getenv("AUTH_EMAIL_MAGIC_LINK_EXPIRY", 28800),
-            "signing_key": os.getenv("AUTH_SIGNING_KEY")
+            "signing_key": os.getenv("AUTH_SIGNING_KEY"),
+            "previous_signing_keys": os.getenv("AUTH_PREVIOUS_SIGNING_KEYS", ""),
+            "email_magic_link_resend_after": int(
+                os.getenv("AUTH_EMAIL_MAGIC_LINK_RESEND_AFTER", 300)
+            ),
+            "email_magic_link_requests_per_hour": int(
+                os.getenv("AUTH_EMAIL_MAGIC_LINK_REQUESTS_PER_HOUR", 20)
+            ),
+            "email_magic_link_throttle": os.getenv(
+                "AUTH_EMAIL_MAGIC_LINK_THROTTLE", "memory"
+            ),
         },
         "sentry": {
             "dsn": os.getenv("SENTRY_DSN")
@@ -17,6 +17,7 @@ from yakbak.auth import load_user
 from yakbak.core import APP_CACHE, create_app
 from yakbak.models import Conference, db, User
 from yakbak.settings import load_settings_from_env
+from yakbak.tests.smtp_sink import SMTPSink
 from yakbak.types import Application
 
 
@@ -96,6 +97,18 @@ def send_mail() -> Generator[Mock, None, None]:
         yield send_mail
 
 
+@pytest.yield_fixture
+def smtp_sink(app: Application) -> Generator[SMTPSink, None, None]:
+    """Deliver the app's mail to a local SMTP server instead of suppressing it."""
+    with SMTPSink() as sink:
+        state = app.extensions["mail"]
+        state.server = sink.host
+        state.port = sink.port
+        state.use_tls = False
+        state.suppress = False
+        yield sink
+
+
 @pytest.fixture
 def user(app: Application) -> User:
     user = User(fullname="Test User", email="test@example.com")
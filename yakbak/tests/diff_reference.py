@@ -0,0 +1,106 @@
+# Per Google's recommendation [1], this is copied from [2], with
+# the line ending match adjusted to find spans of whitespace.
+#
+# The original [2] is used under the Apache License, Version 2.0:
+#
+#   Diff Match and Patch
+#   Copyright 2018 The diff-match-patch Authors.
+#   https://github.com/google/diff-match-patch
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+# [1] https://github.com/google/diff-match-patch/wiki/Line-or-Word-Diffs#word-mode
+# [2] https://github.com/google/diff-match-patch/blob/858b3812cc02e7d48da4beebb21d4d80dc1d3062/python3/diff_match_patch.py
+#
+# This is the original word-mode encoder, kept to check that the faster
+# yakbak.diff.diff_wordsToChars produces identical output. The only change
+# is that the line budgets can be passed in, to test them cheaply.
+from typing import Dict, Tuple
+import re
+
+
+def reference_diff_wordsToChars(
+  text1: str, text2: str, maxLines1: int = 666666, maxLines2: int = 1114111
+) -> Tuple[str, str, object]:
+  """Split two texts into an array of strings.  Reduce the texts to a string
+  of hashes where each Unicode character represents one line.
+
+  Args:
+    text1: First string.
+    text2: Second string.
+
+  Returns:
+    Three element tuple, containing the encoded text1, the encoded text2 and
+    the array of unique strings.  The zeroth element of the array of unique
+    strings is intentionally blank.
+  """
+  lineArray = []  # e.g. lineArray[4] == "Hello\n"
+  lineHash: Dict[str, int] = {}   # e.g. lineHash["Hello\n"] == 4
+
+  # "\x00" is a valid character, but various debuggers don't like it.
+  # So we'll insert a junk entry to avoid generating a null character.
+  lineArray.append('')
+
+  def next_word_end(text: str, start: int) -> int:
+    """Find the next word end (any whitespace) after `start`.
+    """
+    pattern = re.compile(r"([^ \t\n]+)[ \t\n]")
+    match = pattern.search(text, start)
+    if not match:
+      return -1
+    return start + len(match.group(1))
+
+  def diff_linesToCharsMunge(text: str) -> str:
+    """Split a text into an array of strings.  Reduce the texts to a string
+    of hashes where each Unicode character represents one line.
+    Modifies linearray and linehash through being a closure.
+
+    Args:
+      text: String to encode.
+
+    Returns:
+      Encoded string.
+    """
+    chars = []
+    # Walk the text, pulling out a substring for each line.
+    # text.split('\n') would would temporarily double our memory footprint.
+    # Modifying text would create many large strings to garbage collect.
+    lineStart = 0
+    lineEnd = -1
+    while lineEnd < len(text) - 1:
+      lineEnd = next_word_end(text, lineStart)
+      if lineEnd == -1:
+        lineEnd = len(text) - 1
+      line = text[lineStart:lineEnd + 1]
+
+      if line in lineHash:
+        chars.append(chr(lineHash[line]))
+      else:
+        if len(lineArray) == maxLines:
+          # Bail out at 1114111 because chr(1114112) throws.
+          line = text[lineStart:]
+          lineEnd = len(text)
+        lineArray.append(line)
+        lineHash[line] = len(lineArray) - 1
+        chars.append(chr(len(lineArray) - 1))
+      lineStart = lineEnd + 1
+    return "".join(chars)
+
+  # Allocate 2/3rds of the space for text1, the rest for text2.
+  maxLines = maxLines1
+  chars1 = diff_linesToCharsMunge(text1)
+  maxLines = maxLines2
+  chars2 = diff_linesToCharsMunge(text2)
+  return (chars1, chars2, lineArray)
+
+# flake8: noqa
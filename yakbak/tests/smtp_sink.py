@@ -0,0 +1,112 @@
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+from threading import Thread
+from types import TracebackType
+from typing import Any, List, Optional, Type
+
+from attr import attrib, attrs
+
+
+@attrs
+class ReceivedMessage:
+    sender: str = attrib()
+    recipients: List[str] = attrib()
+    data: str = attrib()
+
+
+class SMTPSink:
+    """
+    A minimal local SMTP server that records the messages it receives.
+
+    It speaks just enough SMTP for :mod:`smtplib` (no TLS or AUTH). Set
+    ``failures`` to reject that many of the following messages with a
+    temporary error.
+
+    Use as a context manager; ``host`` and ``port`` are set on entry.
+
+    """
+
+    def __init__(self) -> None:
+        self.messages: List[ReceivedMessage] = []
+        self.connections = 0
+        self.failures = 0
+        self.host = "127.0.0.1"
+        self.port = 0
+        self._server: Optional[_SinkServer] = None
+
+    def __enter__(self) -> "SMTPSink":
+        self._server = _SinkServer(self)
+        self.port = self._server.server_address[1]
+        Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        assert self._server is not None
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _SMTPHandler(StreamRequestHandler):
+    server: "_SinkServer"
+
+    def reply(self, line: str) -> None:
+        self.wfile.write(f"{line}\r\n".encode("utf8"))
+
+    def readline(self) -> str:
+        return self.rfile.readline().decode("utf8").rstrip("\r\n")
+
+    def handle(self) -> None:
+        self.sink = self.server.sink
+        self.sink.connections += 1
+        self.sender = ""
+        self.recipients: List[str] = []
+
+        self.reply("220 localhost SMTP sink")
+        while True:
+            line = self.readline()
+            verb = line[:4].upper()
+            if not line or verb == "QUIT":
+                self.reply("221 bye")
+                return
+            handler = getattr(self, f"smtp_{verb}", None)
+            if handler is None:
+                self.reply("250 OK")  # HELO, EHLO, RSET, NOOP, ...
+            else:
+                handler(line)
+
+    def smtp_MAIL(self, line: str) -> None:  # noqa: N802
+        if self.sink.failures:
+            self.sink.failures -= 1
+            self.reply("451 try again later")
+            return
+        self.sender = line[10:].strip("<>")
+        self.recipients = []
+        self.reply("250 OK")
+
+    def smtp_RCPT(self, line: str) -> None:  # noqa: N802
+        self.recipients.append(line[8:].strip("<>"))
+        self.reply("250 OK")
+
+    def smtp_DATA(self, line: str) -> None:  # noqa: N802
+        self.reply("354 end data with <CR><LF>.<CR><LF>")
+        lines = []
+        while True:
+            data = self.readline()
+            if data == ".":
+                break
+            lines.append(data)
+        message = ReceivedMessage(self.sender, self.recipients, "\n".join(lines))
+        self.sink.messages.append(message)
+        self.reply("250 OK")
+
+
+class _SinkServer(ThreadingTCPServer):
+    daemon_threads = True
+
+    def __init__(self, sink: SMTPSink, **kwargs: Any) -> None:
+        super().__init__((sink.host, 0), _SMTPHandler, **kwargs)
+        self.sink = sink
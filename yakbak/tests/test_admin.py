@@ -1,13 +1,15 @@
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
 from werkzeug.test import Client
 
+from yakbak import models, view_helpers
 from yakbak.models import db, InvitationStatus, Talk, User
 from yakbak.tests.util import (
     assert_html_response,
     assert_html_response_contains,
     extract_csrf_from,
 )
+from yakbak.types import Application
 
 
 def test_anonymous_users_cant_access_admin(client: Client) -> None:
@@ -82,6 +84,54 @@ def test_talk_anonymization(client: Client, user: User, send_mail: Mock) -> None
     )
 
 
+def test_anonymization_diffs_are_stored_on_save(user: User) -> None:
+    talk = Talk(title="Alice's Talk", description="By Alice", length=25)
+    talk.add_speaker(user, InvitationStatus.CONFIRMED)
+    db.session.add(talk)
+    db.session.commit()
+    assert talk.anonymization_diff is None
+
+    talk.anonymized_title = "(Redacted)'s Talk"
+    talk.anonymized_description = "By Alice"
+    db.session.commit()
+
+    assert talk.anonymization_diff == {
+        "title": [[-1, "Alice's "], [1, "(Redacted)'s "], [0, "Talk"]],
+        "description": [[0, "By Alice"]],
+    }
+
+    # only the changed field is re-diffed
+    with patch.object(models, "word_diff", wraps=models.word_diff) as word_diff:
+        talk.anonymized_description = "By (Redacted)"
+        db.session.commit()
+    word_diff.assert_called_once_with("By Alice", "By (Redacted)")
+
+    talk.reset_after_edits()
+    db.session.commit()
+    assert talk.anonymization_diff is None
+
+
+def test_anonymization_diff_filter_uses_stored_diffs(app: Application) -> None:
+    talk = Talk(title="Alice's Talk", anonymized_title="(Redacted)'s Talk", length=25)
+    db.session.add(talk)
+    db.session.commit()
+
+    expected = (
+        '<span class="diff_sub">Alice\'s </span>'
+        '<span class="diff_add">(Redacted)\'s </span>Talk'
+    )
+    with patch.object(view_helpers, "word_diff") as word_diff:
+        assert view_helpers.anonymization_diff(talk, "title") == expected
+    assert not word_diff.called
+
+    # diffs that no longer match the talk are recomputed
+    db.session.execute(
+        Talk.__table__.update().values(title="Bob's Talk")  # type: ignore
+    )
+    db.session.expire(talk)
+    assert "Bob's" in view_helpers.anonymization_diff(talk, "title")
+
+
 def test_talk_anonymization_doesnt_set_is_anonymized_if_no_changes(
     client: Client, user: User, send_mail: Mock
 ) -> None:
@@ -123,3 +173,35 @@ def test_talk_anonymization_doesnt_set_is_anonymized_if_no_changes(
     assert talk.anonymized_take_aways == talk.take_aways
 
     assert not send_mail.called
+
+
+def test_anonymization_preview_answers_conditional_requests(
+    client: Client, user: User
+) -> None:
+    user.site_admin = True
+    db.session.add(user)
+    talk = Talk(
+        title="Alice's Talk",
+        description="This talk is by Alice",
+        outline="Alice!",
+        take_aways="Alice's point.",
+        length=25,
+    )
+    db.session.add(talk)
+    db.session.commit()
+    url = f"/manage/anonymize/{talk.talk_id}/preview"
+
+    client.get("/test-login/{}".format(user.user_id), follow_redirects=True)
+    resp = client.get(url)
+    assert_html_response_contains(resp, "This talk is by Alice")
+    last_modified = resp.headers["Last-Modified"]
+
+    resp = client.get(url, headers={"If-Modified-Since": last_modified})
+    assert resp.status_code == 304
+
+    db.session.add(talk)
+    talk.anonymized_description = "This talk is by someone"
+    db.session.commit()
+
+    resp = client.get(url, headers={"If-None-Match": resp.headers["ETag"]})
+    assert_html_response_contains(resp, "someone")
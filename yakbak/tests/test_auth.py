@@ -5,8 +5,10 @@ from werkzeug.test import Client
 import pytest
 
 from yakbak import auth
-from yakbak.models import Conference, db, InvitationStatus, Talk, User
+from yakbak.flaskcli import clean_magic_links
+from yakbak.models import Conference, db, InvitationStatus, Talk, UsedMagicLink, User
 from yakbak.tests.util import assert_html_response, extract_csrf_from
+from yakbak.types import Application
 
 
 @pytest.mark.parametrize(
@@ -27,7 +29,7 @@ from yakbak.tests.util import assert_html_response, extract_csrf_from
 def test_get_magic_link_token_expiry(length: int, expected: str) -> None:
     with patch.object(auth, "current_app") as app:
         app.settings.auth.email_magic_link_expiry = length
-        app.settings.auth.signing_key = "abcd"
+        app.extensions = {"magic_link_signer": auth.MagicLinkSigner(["abcd"], length)}
 
         _, expiry = auth.get_magic_link_token_and_expiry("test@example.com")
 
@@ -36,8 +38,7 @@ def test_get_magic_link_token_expiry(length: int, expected: str) -> None:
 
 def test_parse_magic_link_token() -> None:
     with patch.object(auth, "current_app") as app:
-        app.settings.auth.signing_key = "abcd"
-        app.settings.auth.email_magic_link_expiry = 10  # seconds
+        app.extensions = {"magic_link_signer": auth.MagicLinkSigner(["abcd"], 10)}
 
         token, _ = auth.get_magic_link_token_and_expiry("test@example.com")
         email = auth.parse_magic_link_token(token)
@@ -47,8 +48,7 @@ def test_parse_magic_link_token() -> None:
 
 def test_parse_magic_link_token_is_none_for_garbled_tokens() -> None:
     with patch.object(auth, "current_app") as app:
-        app.settings.auth.signing_key = "abcd"
-        app.settings.auth.email_magic_link_expiry = 10  # seconds
+        app.extensions = {"magic_link_signer": auth.MagicLinkSigner(["abcd"], 10)}
 
         token, _ = auth.get_magic_link_token_and_expiry("test@example.com")
         token = token[:-2]
@@ -59,8 +59,8 @@ def test_parse_magic_link_token_is_none_for_garbled_tokens() -> None:
 
 def test_parse_magic_link_token_is_none_for_expired_tokens() -> None:
     with patch.object(auth, "current_app") as app:
-        app.settings.auth.signing_key = "abcd"
-        app.settings.auth.email_magic_link_expiry = -1  # surprisingly this works
+        # surprisingly a negative max age works
+        app.extensions = {"magic_link_signer": auth.MagicLinkSigner(["abcd"], -1)}
 
         token, _ = auth.get_magic_link_token_and_expiry("test@example.com")
         email = auth.parse_magic_link_token(token)
@@ -68,6 +68,86 @@ def test_parse_magic_link_token_is_none_for_expired_tokens() -> None:
         assert email is None
 
 
+def test_magic_links_signed_with_previous_keys_are_accepted() -> None:
+    old = auth.MagicLinkSigner(["old"], 10)
+    new = auth.MagicLinkSigner(["new", "old"], 10)
+
+    token = new.dumps("test@example.com")
+
+    assert new.loads(old.dumps("test@example.com")) == "test@example.com"
+    assert new.loads(token) == "test@example.com"
+    assert old.loads(token) is None
+
+
+def test_magic_links_signed_with_unknown_keys_are_rejected() -> None:
+    token = auth.MagicLinkSigner(["other"], 10).dumps("test@example.com")
+
+    assert auth.MagicLinkSigner(["new", "old"], 10).loads(token) is None
+
+
+def test_magic_link_signer_is_made_once_per_app(app: Application) -> None:
+    with app.app_context():
+        signer = auth.get_magic_link_signer()
+        token, _ = auth.get_magic_link_token_and_expiry("test@example.com")
+
+        assert auth.get_magic_link_signer() is signer
+        assert (
+            signer.serializers[0].make_signer() is signer.serializers[0].make_signer()
+        )
+        assert auth.parse_magic_link_token(token) == "test@example.com"
+
+
+def test_magic_link_tokens_can_be_claimed_once(app: Application) -> None:
+    auth.used_magic_links.clear()
+
+    with app.app_context():
+        assert auth.claim_magic_link_token("some-token")
+        assert not auth.claim_magic_link_token("some-token")
+        db.session.commit()
+
+        # as if in another process, which hasn't seen the token
+        auth.used_magic_links.clear()
+        assert not auth.claim_magic_link_token("some-token")
+
+    used = UsedMagicLink.query.one()
+    assert used.fingerprint == auth.magic_link_fingerprint("some-token")
+    expiry = app.settings.auth.email_magic_link_expiry
+    assert expiry is not None
+    assert used.expires_on - datetime.utcnow() <= timedelta(seconds=expiry)
+
+
+def test_claiming_a_magic_link_token_survives_bloom_filter_false_positives(
+    app: Application,
+) -> None:
+    auth.used_magic_links.add(auth.magic_link_fingerprint("some-token"))
+
+    with app.app_context():
+        assert auth.claim_magic_link_token("some-token")
+
+
+def test_clean_magic_links_forgets_expired_tokens(app: Application) -> None:
+    now = datetime.utcnow()
+    for days in (-1, 1, 3):
+        db.session.add(
+            UsedMagicLink(
+                fingerprint=auth.magic_link_fingerprint(str(days)),
+                expires_on=now - timedelta(days=days),
+            )
+        )
+    db.session.add(UsedMagicLink(fingerprint=b"never expires", expires_on=None))
+    db.session.commit()
+
+    result = app.test_cli_runner().invoke(clean_magic_links, ["2"])
+    assert result.exit_code == 0, result.output
+
+    remaining = {u.fingerprint for u in UsedMagicLink.query}
+    assert remaining == {
+        auth.magic_link_fingerprint("-1"),
+        auth.magic_link_fingerprint("1"),
+        b"never expires",
+    }
+
+
 def test_talk_creation_only_allowed_in_window(user: User, client: Client) -> None:
     conf = Conference.query.get(1)
     conf.proposals_begin = datetime.utcnow() - timedelta(days=1)
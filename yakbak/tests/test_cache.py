@@ -0,0 +1,221 @@
+from datetime import datetime, timedelta
+from unittest.mock import Mock, patch
+
+from werkzeug.test import Client
+
+from yakbak import cache, prune
+from yakbak.cache import (
+    BloomFilter,
+    conference_cache,
+    get_user,
+    LRUCache,
+    MarkdownCache,
+    TTLCache,
+    user_cache,
+)
+from yakbak.models import Conference, db, RenderedMarkdown, User
+from yakbak.types import Application
+
+
+def test_ttl_cache_counts_hits_and_misses() -> None:
+    ttl_cache: TTLCache[str, int] = TTLCache(ttl=60)
+    loader = Mock(return_value=42)
+
+    assert ttl_cache.get_or_load("key", loader) == 42
+    assert ttl_cache.get_or_load("key", loader) == 42
+
+    assert loader.call_count == 1
+    assert ttl_cache.hits == 1
+    assert ttl_cache.misses == 1
+
+
+def test_ttl_cache_expires_entries() -> None:
+    ttl_cache: TTLCache[str, int] = TTLCache(ttl=60)
+    loader = Mock(side_effect=[1, 2])
+
+    with patch.object(cache, "monotonic", return_value=1000):
+        assert ttl_cache.get_or_load("key", loader) == 1
+    with patch.object(cache, "monotonic", return_value=1061):
+        assert ttl_cache.get_or_load("key", loader) == 2
+
+
+def test_ttl_cache_invalidate() -> None:
+    ttl_cache: TTLCache[str, int] = TTLCache(ttl=60)
+    loader = Mock(side_effect=[1, 2])
+
+    assert ttl_cache.get_or_load("key", loader) == 1
+    ttl_cache.invalidate()
+    assert ttl_cache.get_or_load("key", loader) == 2
+
+
+def test_bloom_filter_has_no_false_negatives() -> None:
+    bloom_filter = BloomFilter(capacity=1000, error_rate=0.01)
+    items = [str(i).encode() for i in range(1000)]
+    for item in items:
+        bloom_filter.add(item)
+
+    assert all(item in bloom_filter for item in items)
+    false_positives = sum(str(-i).encode() in bloom_filter for i in range(1, 1001))
+    assert false_positives < 30
+    assert len(bloom_filter) == 1000
+
+
+def test_bloom_filter_starts_over_when_full() -> None:
+    bloom_filter = BloomFilter(capacity=2, error_rate=0.01)
+    bloom_filter.add(b"a")
+    bloom_filter.add(b"b")
+    bloom_filter.add(b"c")
+
+    assert b"c" in bloom_filter
+    assert b"a" not in bloom_filter
+    assert len(bloom_filter) == 1
+
+
+def test_conference_is_loaded_once_per_ttl(client: Client) -> None:
+    conference_cache.invalidate()
+    misses = conference_cache.misses
+
+    client.get("/")
+    client.get("/login")
+
+    assert conference_cache.misses == misses + 1
+
+
+def test_conference_changes_invalidate_the_cache(
+    client: Client, conference: Conference
+) -> None:
+    client.get("/")
+
+    conference.proposals_end = datetime.utcnow() - timedelta(days=1)
+    db.session.add(conference)
+    db.session.commit()
+
+    resp = client.get("/")
+    assert "Our Call for Proposals is open through" not in resp.data.decode("utf8")
+
+
+def test_user_is_loaded_once_per_ttl(authenticated_client: Client) -> None:
+    user_cache.invalidate()
+    misses = user_cache.misses
+
+    authenticated_client.get("/")
+    authenticated_client.get("/talks")
+
+    assert user_cache.misses == misses + 1
+
+
+def test_cached_user_loads_other_columns_when_used(app: Application) -> None:
+    user = User(fullname="Test User", email="test@example.com", speaker_bio="Hi")
+    db.session.add(user)
+    db.session.commit()
+    user_id = user.user_id
+    db.session.remove()
+
+    cached = get_user(user_id)
+    assert cached is not None
+    assert cached.fullname == "Test User"
+    assert "speaker_bio" not in cached.__dict__
+    assert cached.speaker_bio == "Hi"
+    assert cached.demographic_survey is None
+
+
+def test_user_changes_invalidate_the_cache(
+    authenticated_client: Client, conference: Conference, user: User
+) -> None:
+    conference.voting_begin = datetime.utcnow() - timedelta(days=1)
+    conference.voting_end = datetime.utcnow() + timedelta(days=1)
+    db.session.commit()
+
+    resp = authenticated_client.get("/")
+    assert "Log Out (Test User)" in resp.data.decode("utf8")
+    assert authenticated_client.get("/vote").status_code == 404
+
+    resp = authenticated_client.post(
+        "/profile", data={"fullname": "Renamed User", "speaker_bio": ""}
+    )
+    assert resp.status_code == 302
+    user = User.query.get(user.user_id)
+    user.reviewer = True
+    db.session.commit()
+
+    resp = authenticated_client.get("/")
+    assert "Log Out (Renamed User)" in resp.data.decode("utf8")
+    assert authenticated_client.get("/vote").status_code == 200
+
+
+def test_lru_cache_evicts_least_recently_used() -> None:
+    lru_cache: LRUCache[str, int] = LRUCache(maxsize=2)
+    lru_cache.set("a", 1)
+    lru_cache.set("b", 2)
+    assert lru_cache.get("a") == 1  # "b" is now least recently used
+    lru_cache.set("c", 3)
+
+    assert lru_cache.get("b") is None
+    assert lru_cache.get("a") == 1
+    assert lru_cache.get("c") == 3
+    assert len(lru_cache) == 2
+    assert (lru_cache.hits, lru_cache.misses) == (3, 1)
+
+
+def test_markdown_cache_renders_each_text_once(app: Application) -> None:
+    markdown_cache = MarkdownCache(maxsize=10)
+    with patch.object(cache, "markdown", wraps=cache.markdown) as markdown:
+        assert markdown_cache.render("*hi*") == "<p><em>hi</em></p>"
+        assert markdown_cache.render("*hi*") == "<p><em>hi</em></p>"
+
+    assert markdown.call_count == 1
+    assert RenderedMarkdown.query.count() == 0
+
+
+def test_markdown_cache_persists_html(app: Application) -> None:
+    markdown_cache = MarkdownCache(maxsize=10)
+    markdown_cache.persist = True
+    markdown_cache.prerender("*hi*", None)
+
+    row = RenderedMarkdown.query.one()
+    assert row.content_hash == MarkdownCache.key("*hi*")
+
+    # another process, with an empty LRU, uses the stored HTML
+    other_cache = MarkdownCache(maxsize=10)
+    other_cache.persist = True
+    with patch.object(cache, "markdown") as markdown:
+        assert other_cache.render("*hi*") == "<p><em>hi</em></p>"
+    assert not markdown.called
+
+
+def test_prune_keeps_rendered_markdown_that_is_still_read(app: Application) -> None:
+    markdown_cache = MarkdownCache(maxsize=10)
+    markdown_cache.persist = True
+    markdown_cache.prerender("*read*", "*unread*")
+    RenderedMarkdown.query.update({"updated": datetime.utcnow() - timedelta(days=31)})
+    db.session.commit()
+
+    # another process renders one of them from the stored HTML
+    other_cache = MarkdownCache(maxsize=10)
+    other_cache.persist = True
+    assert other_cache.render("*read*") == "<p><em>read</em></p>"
+
+    job = prune.JOBS["rendered-markdown"]
+    cutoff = datetime.utcnow() - timedelta(days=job.older_than_days)
+    assert prune.prune(job, cutoff) == 1
+
+    (row,) = RenderedMarkdown.query.all()
+    assert row.content_hash == MarkdownCache.key("*read*")
+
+
+def test_saving_a_talk_renders_its_markdown(
+    authenticated_client: Client, user: User
+) -> None:
+    cache.markdown_cache.lru.clear()
+    postdata = {
+        "title": "My Awesome Talk",
+        "length": "25",
+        "description": "A *great* talk",
+        "outline": "1. Intro\n2. Outro",
+    }
+    resp = authenticated_client.post("/talks/new", data=postdata)
+    assert resp.status_code == 302
+
+    for text in (postdata["description"], postdata["outline"]):
+        key = MarkdownCache.key(text)
+        assert cache.markdown_cache.lru.get(key) is not None
@@ -0,0 +1,126 @@
+from typing import Any
+
+from werkzeug.test import Client
+import pytest
+
+from yakbak.demographics import survey_demographics
+from yakbak.forms import PastSpeaking
+from yakbak.models import (
+    AgeGroup,
+    db,
+    DemographicSurvey,
+    Ethnicity,
+    Gender,
+    ProgrammingExperience,
+    User,
+)
+from yakbak.tests.util import assert_html_response_contains, count_queries
+from yakbak.types import Application
+
+
+def add_survey(email: str, **answers: Any) -> DemographicSurvey:
+    user = User(fullname=email, email=email)
+    survey = DemographicSurvey(user=user, **answers)
+    db.session.add(survey)
+    db.session.commit()
+    return survey
+
+
+@pytest.fixture
+def surveys(app: Application) -> None:
+    add_survey(
+        "a@example.com",
+        gender=["MAN"],
+        ethnicity=["WHITE_CAUCASIAN"],
+        past_speaking=["NEVER"],
+        age_group=AgeGroup.UNDER_25,
+        programming_experience=ProgrammingExperience.UNDER_1YR,
+    )
+    add_survey(
+        "b@example.com",
+        gender=["WOMAN", "NONBINARY"],
+        ethnicity=["ASIAN", "WHITE_CAUCASIAN"],
+        past_speaking=["PYCONCA", "OTHER_PYTHON"],
+        age_group=AgeGroup.UNDER_35,
+    )
+    add_survey(
+        "c@example.com",
+        gender=["a self-described gender"],
+        ethnicity=["HISPANIC_LATINX", "a self-described ethnicity"],
+    )
+    survey = add_survey("d@example.com", gender=["MAN"])
+    survey.clear()  # opted out
+    db.session.commit()
+
+
+def test_survey_demographics(surveys: None) -> None:
+    demographics = survey_demographics()
+
+    assert demographics.total == 4
+    assert demographics.non_man == 2
+    assert demographics.non_white == 1
+
+    assert demographics.gender.counts == {
+        Gender.WOMAN: 1,
+        Gender.MAN: 1,
+        Gender.NONBINARY: 1,
+        Gender.OTHER: 0,
+    }
+    assert demographics.gender.other == 1
+    assert demographics.gender.unanswered == 1
+
+    assert demographics.ethnicity.counts[Ethnicity.WHITE_CAUCASIAN] == 2
+    assert demographics.ethnicity.counts[Ethnicity.ASIAN] == 1
+    assert demographics.ethnicity.counts[Ethnicity.HISPANIC_LATINX] == 1
+    assert demographics.ethnicity.other == 1
+
+    assert demographics.past_speaking.counts[PastSpeaking.NEVER] == 1
+    assert demographics.past_speaking.counts[PastSpeaking.OTHER_PYTHON] == 1
+    assert demographics.past_speaking.other == 0
+    assert demographics.past_speaking.unanswered == 2
+
+    assert demographics.age_group.counts[AgeGroup.UNDER_25] == 1
+    assert demographics.age_group.counts[AgeGroup.UNDER_35] == 1
+    assert demographics.age_group.counts[AgeGroup.OVER_65] == 0
+    assert demographics.age_group.unanswered == 2
+
+    assert (
+        demographics.programming_experience.counts[ProgrammingExperience.UNDER_1YR] == 1
+    )
+    assert demographics.programming_experience.unanswered == 3
+
+
+def test_survey_demographics_matches_survey_methods(surveys: None) -> None:
+    demographics = survey_demographics()
+    all_surveys = DemographicSurvey.query.all()
+
+    assert demographics.non_man == sum(
+        s.doesnt_have_gender(Gender.MAN) for s in all_surveys
+    )
+    assert demographics.non_white == sum(
+        s.doesnt_have_ethnicity(Ethnicity.WHITE_CAUCASIAN) for s in all_surveys
+    )
+
+
+def test_survey_demographics_is_one_query(app: Application) -> None:
+    with count_queries() as queries:
+        demographics = survey_demographics()
+
+    assert demographics.total == 0
+    assert len(queries) == 1
+
+
+def test_manage_index_shows_demographics(
+    client: Client, surveys: None, user: User
+) -> None:
+    user.site_admin = True
+    db.session.commit()
+
+    client.get("/test-login/{}".format(user.user_id), follow_redirects=True)
+    resp = client.get("/manage/")
+
+    assert_html_response_contains(
+        resp,
+        "4 total, 2 non-man, 1 non-white",
+        "<td>Other (self-described)</td><td>1</td>",
+    )
@@ -0,0 +1,37 @@
+from hypothesis import given, strategies as st
+
+from yakbak.diff import diff_wordsToChars, word_diff
+from yakbak.tests.diff_reference import reference_diff_wordsToChars
+
+# mostly words and the whitespace the tokenizer splits on, with some
+# other whitespace and non-ASCII text thrown in
+texts = st.text(alphabet=st.sampled_from("ab \t\n\ré　"), max_size=60) | st.text()
+
+
+@given(texts, texts)
+def test_diff_words_to_chars_matches_reference(text1: str, text2: str) -> None:
+    assert diff_wordsToChars(text1, text2) == reference_diff_wordsToChars(text1, text2)
+
+
+@given(texts, texts, st.integers(1, 8), st.integers(1, 16))
+def test_diff_words_to_chars_matches_reference_when_out_of_space(
+    text1: str, text2: str, max_lines1: int, max_lines2: int
+) -> None:
+    max_lines2 += max_lines1
+    assert diff_wordsToChars(
+        text1, text2, max_lines1, max_lines2
+    ) == reference_diff_wordsToChars(text1, text2, max_lines1, max_lines2)
+
+
+@given(texts, texts)
+def test_word_diff_reproduces_both_texts(text1: str, text2: str) -> None:
+    ops = word_diff(text1, text2)
+    assert "".join(text for op, text in ops if op <= 0) == text1
+    assert "".join(text for op, text in ops if op >= 0) == text2
+
+
+def test_diff_words_to_chars_splits_after_whitespace() -> None:
+    chars1, chars2, words = diff_wordsToChars("a b  c", "b a")
+    assert words == ["", "a ", "b ", " c", "a"]
+    assert chars1 == "\x01\x02\x03"
+    assert chars2 == "\x02\x04"
@@ -0,0 +1,128 @@
+"""
+Check that the planner uses the indexes behind the voting pages and
+`flask clean-magic-links`.
+
+The queries are captured while the real views and command run, then
+EXPLAINed against a seeded database big enough that a sequential scan
+isn't the cheapest plan.
+
+"""
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Set, Tuple
+import random
+
+from werkzeug.test import Client
+import pytest
+
+from yakbak.flaskcli import clean_magic_links
+from yakbak.models import Category, Conference, db, UsedMagicLink, User, Vote
+from yakbak.seed import seed, SeedCounts
+from yakbak.types import Application
+
+Statements = List[Tuple[str, Dict[str, Any]]]
+
+
+@pytest.fixture
+def category_id(app: Application, user: User) -> int:
+    """Seed a conference mid-review, and return a category to vote in."""
+    conference = Conference.query.first()
+    now = datetime.utcnow()
+    conference.voting_begin = now - timedelta(days=1)
+    conference.voting_end = now + timedelta(days=1)
+    user.reviewer = True
+
+    counts = SeedCounts(
+        users=500,
+        reviewers=20,
+        talks=400,
+        co_speakers=0,
+        categories=8,
+        votes=4000,
+        surveys=0,
+        conduct_reports=0,
+    )
+    seed(conference, counts, random.Random(0))
+
+    category = Category.query.filter_by(conference=conference).first()
+    for talk in category.talks[:20]:
+        db.session.add(Vote(talk=talk, user=user, value=1, skipped=False))
+    db.session.add_all(
+        UsedMagicLink(
+            fingerprint=i.to_bytes(16, "big"), expires_on=now - timedelta(hours=i)
+        )
+        for i in range(5000)
+    )
+    db.session.commit()
+    db.session.execute("ANALYZE")
+    return category.category_id
+
+
+@contextmanager
+def captured_statements() -> Iterator[Statements]:
+    statements: Statements = []
+
+    def record(
+        conn: Any, cursor: Any, statement: str, parameters: Any, *_: Any
+    ) -> None:
+        statements.append((statement, parameters))
+
+    db.event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        db.event.remove(db.engine, "before_cursor_execute", record)
+
+
+def indexes_used(statements: Statements) -> Set[str]:
+    """Return the names of the indexes in the plans for ``statements``."""
+
+    def walk(node: Dict[str, Any]) -> Iterator[str]:
+        if "Index Name" in node:
+            yield node["Index Name"]
+        for child in node.get("Plans", ()):
+            yield from walk(child)
+
+    names: Set[str] = set()
+    connection = db.session.connection()
+    for statement, parameters in statements:
+        if not statement.lstrip().upper().startswith(("SELECT", "DELETE", "UPDATE")):
+            continue
+        (plan,), = connection.execute(
+            "EXPLAIN (FORMAT JSON) " + statement, parameters
+        ).fetchone()
+        names.update(walk(plan["Plan"]))
+    return names
+
+
+def test_vote_home_uses_indexes(category_id: int, authenticated_client: Client) -> None:
+    with captured_statements() as statements:
+        resp = authenticated_client.get("/vote")
+    assert resp.status_code == 200
+
+    assert {
+        "ix_vote_user_id_skipped_value",
+        "ix_talk_category_category_id_talk_id",
+    } <= indexes_used(statements)
+
+
+def test_choosing_a_talk_uses_indexes(
+    category_id: int, authenticated_client: Client
+) -> None:
+    with captured_statements() as statements:
+        resp = authenticated_client.get(f"/vote/category/{category_id}")
+    assert resp.status_code == 302
+
+    assert {
+        "ix_vote_user_id_skipped_value",
+        "ix_talk_category_category_id_talk_id",
+        "ix_talk_votable_vote_count",
+    } <= indexes_used(statements)
+
+
+def test_clean_magic_links_uses_index(category_id: int, app: Application) -> None:
+    with captured_statements() as statements:
+        result = app.test_cli_runner().invoke(clean_magic_links, ["200"])
+    assert result.exit_code == 0, result.output
+
+    assert "ix_used_magic_link_expires_on" in indexes_used(statements)
@@ -0,0 +1,100 @@
+from typing import Iterable
+import logging
+
+from _pytest.logging import LogCaptureFixture
+from werkzeug.test import Client
+import attr
+import pytest
+
+from yakbak import instrumentation
+from yakbak.instrumentation import RequestStats, sql_stats
+from yakbak.models import db, User
+from yakbak.tests.util import extract_csrf_from
+from yakbak.types import Application
+
+
+@pytest.fixture
+def instrumented_app(app: Application) -> Iterable[Application]:
+    logging_settings = attr.evolve(
+        app.settings.logging, sql_sample_rate=1.0, server_timing=True
+    )
+    app.settings = attr.evolve(app.settings, logging=logging_settings)
+    instrumentation.init_app(app)
+    sql_stats.clear()
+    yield app
+    sql_stats.clear()
+
+
+def test_request_stats_keeps_slowest_statement() -> None:
+    stats = RequestStats()
+    stats.record("SELECT 1", 0.002)
+    stats.record("SELECT 2", 0.005)
+    stats.record("SELECT 3", 0.001)
+
+    assert stats.queries == 3
+    assert stats.db_time == pytest.approx(0.008)
+    assert stats.slowest_time == 0.005
+    assert stats.slowest_statement == "SELECT 2"
+
+
+def test_instrumentation_is_off_by_default(
+    authenticated_client: Client, user: User
+) -> None:
+    sql_stats.clear()
+
+    resp = authenticated_client.get("/")
+
+    assert "Server-Timing" not in resp.headers
+    assert sql_stats.by_db_time() == []
+
+
+def test_sampled_requests_are_logged_and_timed(
+    instrumented_app: Application,
+    authenticated_client: Client,
+    user: User,
+    caplog: LogCaptureFixture,
+) -> None:
+    sql_stats.clear()  # of logging in
+    with caplog.at_level(logging.INFO, logger="sql"):
+        resp = authenticated_client.get("/talks")
+
+    assert resp.headers["Server-Timing"].startswith("db;dur=")
+
+    record, = [r for r in caplog.records if r.name == "sql"]
+    assert record.endpoint == "views.talks_list"  # type: ignore
+    queries = record.queries  # type: ignore
+    assert queries > 0
+    assert resp.headers["Server-Timing"].endswith(f'desc="{queries} queries"')
+
+    (endpoint, stats), = sql_stats.by_db_time()
+    assert endpoint == "views.talks_list"
+    assert stats.requests == 1
+    assert stats.queries == queries
+    assert stats.slowest_statement is not None
+    assert stats.slowest_statement.startswith("SELECT")
+
+
+def test_sql_stats_view_lists_endpoints(
+    instrumented_app: Application, client: Client, user: User
+) -> None:
+    user.site_admin = True
+    db.session.add(user)
+    db.session.commit()
+
+    client.get(f"/test-login/{user.user_id}")
+    client.get("/")
+    resp = client.get("/manage/sql-stats")
+
+    assert resp.status_code == 200
+    assert "views.index" in resp.get_data(as_text=True)
+
+    resp = client.post(
+        "/manage/sql-stats", data={"csrf_token": extract_csrf_from(resp)}
+    )
+    assert resp.status_code == 302
+    assert [name for name, _ in sql_stats.by_db_time()] == ["manage.sql_stats_view"]
+
+
+def test_sql_stats_view_requires_admin(authenticated_client: Client) -> None:
+    resp = authenticated_client.get("/manage/sql-stats")
+    assert resp.status_code == 404
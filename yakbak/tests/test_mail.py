@@ -1,4 +1,14 @@
+from datetime import datetime, timedelta
+import smtplib
+
+from flask import g, render_template
+import attr
+import frontmatter
+import pytest
+
 from yakbak import mail
+from yakbak.models import Conference, db, OutboxMessage, OutboxMessageStatus
+from yakbak.tests.smtp_sink import SMTPSink
 from yakbak.types import Application
 
 
@@ -18,3 +28,223 @@ def test_send_mail(app: Application) -> None:
     assert msg.sender == "sender@example.com"
     assert msg.recipients == ["test@example.com"]
     assert msg.body == "This is the email. It has replacements!"
+
+
+def test_email_templates_are_compiled_at_startup(app: Application) -> None:
+    compiled = app.extensions["mail_templates"]
+    assert "email/magic-link" in compiled
+    assert "email-template" not in compiled  # not in templates/email/
+
+    with app.test_request_context():
+        mail.render_template("email-template", variables="x")
+        assert mail.mail_templates.get("email-template") is compiled["email-template"]
+
+
+def test_render_template_matches_full_render(app: Application) -> None:
+    with app.test_request_context():
+        g.conference = Conference.query.first()
+        context = {
+            "magic_link": "https://example.com/login/abc",
+            "magic_link_expiration": "2 hours",
+        }
+
+        meta, body = mail.render_template("email/magic-link", **context)
+
+        expected = frontmatter.loads(render_template("email/magic-link", **context))
+        assert meta.subject == expected["subject"]
+        assert meta.sender is None
+        assert body == expected.content
+
+
+def test_render_template_with_sender(app: Application) -> None:
+    with app.test_request_context():
+        meta, body = mail.render_template(
+            "email-template-with-sender", team="Organizers", variables="x"
+        )
+
+    assert meta.subject == "Hello from Organizers"
+    assert meta.sender == "Organizers <organizers@example.com>"
+    assert body == "This is the email. It has x!"
+
+
+def test_render_template_doesnt_escape_plain_text(app: Application) -> None:
+    with app.test_request_context():
+        meta, body = mail.render_template(
+            "email-template-with-sender",
+            team="Py & Co's",
+            variables="https://example.com/?a=1&b=<2>",
+        )
+
+    assert meta.subject == "Hello from Py & Co's"
+    assert meta.sender == "Py & Co's <py & co's@example.com>"
+    assert body == "This is the email. It has https://example.com/?a=1&b=<2>!"
+
+
+def test_changed_templates_are_recompiled_with_auto_reload(app: Application) -> None:
+    app.jinja_env.auto_reload = True
+    with app.test_request_context():
+        compiled = mail.mail_templates.get("email-template")
+        assert mail.mail_templates.get("email-template") is compiled
+
+        compiled.uptodate = lambda: False
+        assert mail.mail_templates.get("email-template") is not compiled
+
+
+@pytest.fixture
+def outbox_app(app: Application) -> Application:
+    smtp = attr.evolve(app.settings.smtp, outbox=True)
+    app.settings = attr.evolve(app.settings, smtp=smtp)
+    return app
+
+
+def test_send_mail_queues_messages_in_outbox(outbox_app: Application) -> None:
+    with outbox_app.test_request_context():
+        with mail.mail.record_messages() as outbox:
+            mail.send_mail(
+                to=["test@example.com"],
+                template="email-template",  # in yakbak/tests/templates
+                variables="replacements",
+            )
+        db.session.commit()
+
+    assert outbox == []
+    message = OutboxMessage.query.one()
+    assert message.status == OutboxMessageStatus.QUEUED
+    assert message.recipients == ["test@example.com"]
+    assert message.subject == "The Email Subject"
+    assert message.sender == "sender@example.com"
+    assert message.body == "This is the email. It has replacements!"
+
+
+def test_send_queued_mail_delivers_messages(
+    outbox_app: Application, smtp_sink: SMTPSink
+) -> None:
+    with outbox_app.test_request_context():
+        for address in ("one@example.com", "two@example.com"):
+            mail.send_mail(
+                to=[address], template="email-template", variables="replacements"
+            )
+        db.session.commit()
+
+        assert mail.send_queued_mail() == 2
+        assert mail.send_queued_mail() == 0
+
+    assert [m.recipients for m in smtp_sink.messages] == [
+        ["one@example.com"],
+        ["two@example.com"],
+    ]
+    assert smtp_sink.connections == 1
+    statuses = [m.status for m in OutboxMessage.query.all()]
+    assert statuses == [OutboxMessageStatus.SENT] * 2
+
+
+def test_send_queued_mail_retries_failures_later(
+    outbox_app: Application, smtp_sink: SMTPSink
+) -> None:
+    smtp_sink.failures = 1
+    with outbox_app.test_request_context():
+        mail.send_mail(
+            to=["test@example.com"], template="email-template", variables="x"
+        )
+        db.session.commit()
+
+        assert mail.send_queued_mail() == 1
+        message = OutboxMessage.query.one()
+        assert message.status == OutboxMessageStatus.QUEUED
+        assert message.attempts == 1
+        assert message.send_after > datetime.utcnow()
+        assert smtp_sink.messages == []
+
+        # not due yet
+        assert mail.send_queued_mail() == 0
+
+        message.send_after = datetime.utcnow()
+        db.session.commit()
+        assert mail.send_queued_mail() == 1
+
+    assert OutboxMessage.query.one().status == OutboxMessageStatus.SENT
+    assert len(smtp_sink.messages) == 1
+
+
+def test_retry_delay_backs_off_exponentially() -> None:
+    assert mail.retry_delay(1) == timedelta(seconds=mail.RETRY_BACKOFF)
+    assert mail.retry_delay(2) == timedelta(seconds=2 * mail.RETRY_BACKOFF)
+    assert mail.retry_delay(20) == timedelta(seconds=mail.MAX_RETRY_BACKOFF)
+
+
+def test_send_mail_batch_reuses_connections(
+    app: Application, smtp_sink: SMTPSink
+) -> None:
+    smtp = attr.evolve(app.settings.smtp, max_emails=2)
+    app.settings = attr.evolve(app.settings, smtp=smtp)
+    jobs = [
+        mail.MailJob([f"{i}@example.com"], "email-template", {"variables": str(i)})
+        for i in range(5)
+    ]
+
+    with app.test_request_context():
+        results = mail.send_mail_batch(jobs)
+
+    assert [r.job for r in results] == jobs
+    assert all(r.ok for r in results)
+    assert smtp_sink.connections == 3
+    assert [m.recipients for m in smtp_sink.messages] == [j.to for j in jobs]
+    assert "It has 4!" in smtp_sink.messages[-1].data
+
+
+def test_send_mail_batch_reports_failed_messages(
+    app: Application, smtp_sink: SMTPSink
+) -> None:
+    smtp_sink.failures = 1
+    jobs = [
+        mail.MailJob([f"{i}@example.com"], "email-template", {"variables": "x"})
+        for i in range(3)
+    ]
+
+    with app.test_request_context():
+        results = mail.send_mail_batch(jobs)
+
+    assert [r.ok for r in results] == [False, True, True]
+    assert isinstance(results[0].error, smtplib.SMTPSenderRefused)
+    assert smtp_sink.connections == 1
+    assert len(smtp_sink.messages) == 2
+
+
+def test_send_mail_batch_reports_connection_failures(
+    app: Application, smtp_sink: SMTPSink
+) -> None:
+    # nothing listens on the sink's port once it's closed
+    smtp_sink.__exit__(None, None, None)
+    jobs = [mail.MailJob(["test@example.com"], "email-template") for _ in range(2)]
+
+    with app.test_request_context():
+        results = mail.send_mail_batch(jobs)
+
+    assert [r.ok for r in results] == [False, False]
+    assert all(isinstance(r.error, OSError) for r in results)
+
+
+def test_send_mail_batch_queues_in_outbox(outbox_app: Application) -> None:
+    jobs = [
+        mail.MailJob([f"{i}@example.com"], "email-template", {"variables": "x"})
+        for i in range(3)
+    ]
+
+    with outbox_app.test_request_context():
+        results = mail.send_mail_batch(jobs)
+        db.session.commit()
+
+    assert all(r.ok for r in results)
+    recipients = [m.recipients for m in OutboxMessage.query.all()]
+    assert sorted(recipients) == [j.to for j in jobs]
+
+
+def test_send_mail_queues_in_the_callers_transaction(outbox_app: Application) -> None:
+    with outbox_app.test_request_context():
+        conference = Conference.query.first()
+        conference.full_name = "Renamed"
+        mail.send_mail(to=["test@example.com"], template="email-template")
+        db.session.rollback()
+
+    assert Conference.query.first().full_name != "Renamed"
+    assert OutboxMessage.query.count() == 0
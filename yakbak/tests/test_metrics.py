@@ -0,0 +1,163 @@
+from pathlib import Path
+from typing import Dict, Iterable, Tuple
+from unittest.mock import patch
+import os
+import subprocess
+import sys
+
+from _pytest.monkeypatch import MonkeyPatch
+from prometheus_client import REGISTRY
+from prometheus_client.parser import text_string_to_metric_families
+from werkzeug.test import Client
+import attr
+import pytest
+import yaml
+
+from yakbak import mail, metrics
+from yakbak.cache import LRUCache, TTLCache
+from yakbak.models import db, User
+from yakbak.types import Application
+
+Samples = Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float]
+
+
+@pytest.fixture
+def metrics_app(app: Application) -> Iterable[Application]:
+    logging_settings = attr.evolve(
+        app.settings.logging, metrics=True, metrics_token="s3cret"
+    )
+    app.settings = attr.evolve(app.settings, logging=logging_settings)
+    metrics.init_app(app)
+    yield app
+
+
+def scrape(client: Client) -> Samples:
+    """Fetch /metrics and parse it the way Prometheus would."""
+    resp = client.get("/metrics", headers={"Authorization": "Bearer s3cret"})
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/plain"
+
+    samples: Samples = {}
+    for family in text_string_to_metric_families(resp.get_data(as_text=True)):
+        for sample in family.samples:
+            labels = tuple(sorted(sample.labels.items()))
+            samples[(sample.name, labels)] = sample.value
+    return samples
+
+
+def test_metrics_are_off_by_default(client: Client) -> None:
+    assert client.get("/metrics").status_code == 404
+
+
+def test_metrics_require_a_site_admin_or_the_token(
+    metrics_app: Application, client: Client, user: User
+) -> None:
+    user_id = user.user_id
+    assert client.get("/metrics").status_code == 404
+    resp = client.get("/metrics", headers={"Authorization": "Bearer guess"})
+    assert resp.status_code == 404
+
+    client.get(f"/test-login/{user_id}")
+    assert client.get("/metrics").status_code == 404
+
+    db.session.add(user)
+    user.site_admin = True
+    db.session.commit()
+    assert client.get("/metrics").status_code == 200
+
+
+def test_shipped_scrape_config_sends_the_token(
+    metrics_app: Application, client: Client
+) -> None:
+    root = Path(__file__).parents[2]
+    prometheus = yaml.safe_load((root / "prometheus.yml").read_text())
+    (job,) = prometheus["scrape_configs"]
+    credentials_file = job["authorization"]["credentials_file"]
+
+    compose = yaml.safe_load((root / "docker-compose-prod.yml").read_text())
+    mounts = [
+        volume.split(":")[1] for volume in compose["services"]["prometheus"]["volumes"]
+    ]
+    assert credentials_file in mounts
+
+    scheme = job["authorization"]["type"]
+    resp = client.get("/metrics", headers={"Authorization": f"{scheme} s3cret"})
+    assert resp.status_code == 200
+
+
+def test_metrics_endpoint_exports_requests_and_queries(
+    metrics_app: Application, authenticated_client: Client, user: User
+) -> None:
+    authenticated_client.get("/talks")
+    samples = scrape(authenticated_client)
+
+    talks = ("endpoint", "views.talks_list"), ("method", "GET"), ("status", "200")
+    assert samples[("yakbak_request_duration_seconds_count", talks)] >= 1
+    queries = (("endpoint", "views.talks_list"),)
+    assert samples[("yakbak_db_queries_total", queries)] >= 1
+
+    # /metrics itself isn't timed
+    assert not any(
+        dict(labels).get("endpoint") == "metrics.metrics"
+        for name, labels in samples
+        if name.startswith("yakbak_request_duration_seconds")
+    )
+
+
+def test_metrics_time_requests_that_raise(
+    metrics_app: Application, authenticated_client: Client
+) -> None:
+    def broken() -> None:
+        raise RuntimeError("oops")
+
+    with patch.dict(metrics_app.view_functions, {"views.talks_list": broken}):
+        with pytest.raises(RuntimeError):
+            authenticated_client.get("/talks")
+    samples = scrape(authenticated_client)
+
+    talks = ("endpoint", "views.talks_list"), ("method", "GET"), ("status", "500")
+    assert samples[("yakbak_request_duration_seconds_count", talks)] == 1
+
+
+def test_metrics_are_summed_across_processes(
+    metrics_app: Application, client: Client, tmp_path: Path, monkeypatch: MonkeyPatch
+) -> None:
+    env = dict(os.environ, prometheus_multiproc_dir=str(tmp_path))
+    script = "from yakbak import metrics; metrics.VOTES.labels('vote').inc()"
+    for _ in range(2):
+        subprocess.run([sys.executable, "-c", script], env=env, check=True)
+
+    monkeypatch.setenv("prometheus_multiproc_dir", str(tmp_path))
+    samples = scrape(client)
+
+    assert samples[("yakbak_votes_total", (("action", "vote"),))] == 2
+
+
+def test_named_caches_count_lookups() -> None:
+    def lookups(result: str) -> float:
+        value = REGISTRY.get_sample_value(
+            "yakbak_cache_lookups_total", {"cache": "test", "result": result}
+        )
+        return value or 0
+
+    hits, misses = lookups("hit"), lookups("miss")
+
+    ttl_cache: TTLCache[str, int] = TTLCache(ttl=60, name="test")
+    ttl_cache.get_or_load("key", lambda: 1)
+    ttl_cache.get_or_load("key", lambda: 1)
+    lru_cache: LRUCache[str, int] = LRUCache(maxsize=2, name="test")
+    lru_cache.get("key")
+
+    assert lookups("hit") == hits + 1
+    assert lookups("miss") == misses + 2
+
+
+def test_mail_send_duration_is_observed(app: Application) -> None:
+    def sends() -> float:
+        return REGISTRY.get_sample_value("yakbak_mail_send_duration_seconds_count") or 0
+
+    before = sends()
+    with app.test_request_context():
+        mail.send_mail(to=["test@example.com"], template="email-template")
+
+    assert sends() == before + 1
@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta
+from typing import List
+
+from yakbak import prune
+from yakbak.flaskcli import prune_old_rows
+from yakbak.models import (
+    db,
+    OutboxMessage,
+    OutboxMessageStatus,
+    Talk,
+    UsedMagicLink,
+    User,
+    Vote,
+)
+from yakbak.types import Application
+
+
+def add_magic_links(expired_days_ago: List[int]) -> None:
+    now = datetime.utcnow()
+    for i, days in enumerate(expired_days_ago):
+        db.session.add(
+            UsedMagicLink(
+                fingerprint=i.to_bytes(16, "big"), expires_on=now - timedelta(days=days)
+            )
+        )
+    db.session.commit()
+
+
+def test_prune_deletes_in_batches(app: Application) -> None:
+    add_magic_links([1] * 5 + [-1] * 2)
+    job = prune.JOBS["magic-links"]
+    totals: List[int] = []
+
+    deleted = prune.prune(
+        job, datetime.utcnow(), batch_size=2, pause=0, progress=totals.append
+    )
+
+    assert deleted == 5
+    assert totals == [2, 4, 5]
+    assert UsedMagicLink.query.count() == 2
+
+
+def test_prune_command_dry_run_counts_rows(app: Application) -> None:
+    add_magic_links([1, 3, 5])
+
+    result = app.test_cli_runner().invoke(
+        prune_old_rows, ["magic-links", "--older-than-days", "2", "--dry-run"]
+    )
+
+    assert result.exit_code == 0, result.output
+    assert result.output == "magic-links: would delete 2 row(s)\n"
+    assert UsedMagicLink.query.count() == 3
+
+
+def test_prune_command_runs_every_job(app: Application) -> None:
+    add_magic_links([1])
+    old = datetime.utcnow() - timedelta(days=31)
+    for status in OutboxMessageStatus:
+        db.session.add(
+            OutboxMessage(
+                recipients=["test@example.com"],
+                sender="sender@example.com",
+                subject="Hi",
+                body="Hello",
+                status=status,
+                updated=old,
+            )
+        )
+    db.session.commit()
+
+    result = app.test_cli_runner().invoke(prune_old_rows, ["--batch-size", "1"])
+
+    assert result.exit_code == 0, result.output
+    assert "magic-links: deleted 1 row(s)\n" in result.output
+    assert "outbox: deleted 2 row(s) so far\n" in result.output
+    assert "outbox: deleted 2 row(s)\n" in result.output
+    assert "skipped-votes: deleted 0 row(s)\n" in result.output
+    assert UsedMagicLink.query.count() == 0
+    (queued,) = OutboxMessage.query.all()
+    assert queued.status == OutboxMessageStatus.QUEUED
+
+
+def test_pruning_skipped_votes_keeps_vote_counters(app: Application) -> None:
+    talk = Talk(title="My Talk", length=25)
+    old = datetime.utcnow() - timedelta(days=31)
+    for i, (value, skipped) in enumerate(((1, False), (1, True), (None, True))):
+        user = User(fullname=f"Reviewer {i}", email=f"{i}@example.com")
+        db.session.add(Vote(talk=talk, user=user, value=value, skipped=skipped))
+    db.session.commit()
+    Vote.query.update({"updated": old})
+    db.session.commit()
+
+    prune.prune(prune.JOBS["skipped-votes"], datetime.utcnow() - timedelta(days=30))
+
+    assert Vote.query.count() == 1
+    assert Talk.reconcile_vote_counters() == 0
+    talk = Talk.query.one()
+    assert (talk.vote_count, talk.vote_score) == (1, 1)
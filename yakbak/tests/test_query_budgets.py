@@ -0,0 +1,142 @@
+"""
+Limit the SQL statements each page runs.
+
+The data below has several rows behind every list on these pages, so a
+change that loads them one query at a time (an N+1) goes over budget.
+When a change legitimately needs more queries, raise the budget in the
+same commit and say why.
+
+"""
+from datetime import datetime, timedelta
+from typing import Callable, Dict
+
+from werkzeug.test import Client
+import pytest
+
+from yakbak.models import (
+    Category,
+    ConductReport,
+    Conference,
+    db,
+    DemographicSurvey,
+    InvitationStatus,
+    Talk,
+    User,
+    Vote,
+)
+from yakbak.tests.util import QueryBudget
+from yakbak.types import Application
+
+NUM_TALKS = 6
+
+# statements per request, by endpoint
+QUERY_BUDGETS = {
+    "views.talks_list": 3,
+    "views.vote_home": 2,
+    "views.vote": 2,
+    "views.review_talk": 2,
+    "manage.index": 4,
+    "manage.categorize_talks": 2,
+    "conference.index_view": 2,
+    "talk.index_view": 2,
+    "category.index_view": 2,
+    "conductreport.index_view": 2,
+    "user.index_view": 2,
+    "demographicsurvey.index_view": 2,
+    "vote.index_view": 2,
+}
+
+
+@pytest.fixture
+def urls(app: Application, user: User) -> Dict[str, str]:
+    """Create a busy conference, and return the URL to test by endpoint."""
+    conference = Conference.query.first()
+    now = datetime.utcnow()
+    conference.voting_begin = conference.review_begin = now - timedelta(days=1)
+    conference.voting_end = conference.review_end = now + timedelta(days=1)
+
+    user.site_admin = True
+    user.reviewer = True
+    user.demographic_survey = DemographicSurvey(gender=["WOMAN"])
+
+    categories = [
+        Category(name=f"Category {i}", conference=conference) for i in range(3)
+    ]
+    others = [User(fullname=f"Speaker {i}", email=f"{i}@example.com") for i in range(3)]
+    talks = []
+    for i in range(NUM_TALKS):
+        talk = Talk(
+            title=f"Talk {i}",
+            length=25,
+            description="A *talk*",
+            outline="1. Intro",
+            take_aways="Things",
+            is_anonymized=True,
+            anonymized_title=f"Talk {i}",
+            anonymized_description="A *talk*",
+            anonymized_outline="1. Intro",
+            anonymized_take_aways="Things",
+        )
+        talk.categories = categories[: i % 3 + 1]
+        # the user is invited to, but hasn't accepted, the first talk
+        state = InvitationStatus.PENDING if i == 0 else InvitationStatus.CONFIRMED
+        talk.add_speaker(user, state)
+        talk.add_speaker(others[i % 3], InvitationStatus.CONFIRMED)
+        talks.append(talk)
+        db.session.add(talk)
+        db.session.add(ConductReport(talk=talk, user=others[i % 3], text="Hmm"))
+        for voter, value in ((user, 1), (others[(i + 1) % 3], -1)):
+            db.session.add(Vote(talk=talk, user=voter, value=value, skipped=False))
+    db.session.commit()
+
+    vote = Vote.query.filter_by(user=user, talk=talks[1]).one()
+    urls = {
+        "views.talks_list": "/talks",
+        "views.vote_home": "/vote",
+        "views.vote": f"/vote/cast/{vote.public_id}",
+        "views.review_talk": f"/review/{talks[1].talk_id}",
+        "manage.index": "/manage/",
+        "manage.categorize_talks": "/manage/categorize",
+    }
+    for endpoint in QUERY_BUDGETS:
+        model, _, view = endpoint.partition(".")
+        if view == "index_view":
+            urls[endpoint] = f"/manage/db/{model}/"
+    return urls
+
+
+@pytest.mark.parametrize("endpoint", sorted(QUERY_BUDGETS))
+def test_query_budget(
+    endpoint: str, urls: Dict[str, str], authenticated_client: Client
+) -> None:
+    with QueryBudget(QUERY_BUDGETS[endpoint]) as budget:
+        resp = authenticated_client.get(urls[endpoint])
+
+    assert resp.status_code == 200
+    (name, statements), = budget.requests
+    assert name == f"GET {urls[endpoint]}"
+
+
+def test_query_budget_reports_statements(authenticated_client: Client) -> None:
+    with pytest.raises(AssertionError) as excinfo:
+        with QueryBudget(0):
+            authenticated_client.get("/talks")
+
+    message = str(excinfo.value)
+    assert message.startswith("GET /talks ran ")
+    assert "(budget 0):\n1: SELECT" in message
+
+
+@QueryBudget(0)
+def test_query_budget_ignores_statements_outside_requests(
+    app: Application, user: User
+) -> None:
+    assert User.query.count() == 1
+
+
+def test_query_budget_decorator(authenticated_client: Client) -> None:
+    budgeted: Callable[[], None] = QueryBudget(0)(
+        lambda: authenticated_client.get("/talks")
+    )
+    with pytest.raises(AssertionError):
+        budgeted()
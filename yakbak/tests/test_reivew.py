@@ -4,8 +4,8 @@ from typing import Optional
 from werkzeug.test import Client
 import pytest
 
-from yakbak.models import Category, Conference, db, Talk, User, Vote
-from yakbak.tests.util import assert_html_response_contains
+from yakbak.models import Category, Conference, db, InvitationStatus, Talk, User, Vote
+from yakbak.tests.util import assert_html_response_contains, QueryBudget
 from yakbak.types import Application
 
 
@@ -61,3 +61,85 @@ def test_vote_review_shows_your_vote_and_conduct_form(
     resp = authenticated_client.get(f"/review/{talk.talk_id}")
     assert_html_response_contains(resp, vote_note)
     assert_html_response_contains(resp, '<form method="POST" action="/conduct-report">')
+
+
+@pytest.fixture
+def talk(user: User) -> Talk:
+    db.session.add(user)
+    user.reviewer = True
+    user.site_admin = True
+    talk = Talk(
+        title="My Talk",
+        length=25,
+        description="",
+        outline="",
+        requirements="",
+        take_aways="",
+        is_anonymized=True,
+        anonymized_title="An Anonymous Talk",
+        anonymized_description="",
+        anonymized_outline="",
+        anonymized_take_aways="",
+    )
+    db.session.add(talk)
+    db.session.commit()
+    return talk
+
+
+def test_vote_review_is_not_modified_until_your_vote_is(
+    authenticated_client: Client, talk: Talk, user: User
+) -> None:
+    url = f"/review/{talk.talk_id}"
+    resp = authenticated_client.get(url)
+    assert_html_response_contains(resp, "You did not vote on this talk.")
+    etag = resp.headers["ETag"]
+
+    with QueryBudget(1):
+        resp = authenticated_client.get(url, headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+
+    # someone else's vote doesn't change the page
+    other = User(fullname="Other User", email="other@example.com")
+    db.session.add(Vote(talk_id=talk.talk_id, user=other, value=1, skipped=False))
+    db.session.commit()
+    resp = authenticated_client.get(url, headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+
+    db.session.add(Vote(talk_id=talk.talk_id, user=user, value=1, skipped=False))
+    db.session.commit()
+    resp = authenticated_client.get(url, headers={"If-None-Match": etag})
+    assert_html_response_contains(resp, "You voted: Definitely yes!")
+
+
+def test_full_review_is_modified_by_votes_and_speakers(
+    authenticated_client: Client, talk: Talk, user: User
+) -> None:
+    url = f"/review-full/{talk.talk_id}"
+    resp = authenticated_client.get(url)
+    assert_html_response_contains(resp, "Count: 0")
+    etag = resp.headers["ETag"]
+
+    resp = authenticated_client.get(url, headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+
+    other = User(fullname="Other User", email="other@example.com")
+    db.session.add(Vote(talk_id=talk.talk_id, user=other, value=1, skipped=False))
+    db.session.commit()
+    resp = authenticated_client.get(url, headers={"If-None-Match": etag})
+    assert_html_response_contains(resp, "Count: 1")
+    etag = resp.headers["ETag"]
+
+    db.session.add(talk)
+    talk.add_speaker(other, InvitationStatus.CONFIRMED)
+    db.session.commit()
+    resp = authenticated_client.get(url, headers={"If-None-Match": etag})
+    assert_html_response_contains(resp, "Full name: Other User")
+    etag = resp.headers["ETag"]
+
+    db.session.add(talk)
+    talk.categories.append(
+        Category(conference=Conference.query.first(), name="Web Frameworks")
+    )
+    db.session.commit()
+    resp = authenticated_client.get(url, headers={"If-None-Match": etag})
+    assert_html_response_contains(resp, "Web Frameworks")
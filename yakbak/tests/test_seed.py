@@ -0,0 +1,87 @@
+import random
+
+import pytest
+
+from yakbak.models import (
+    Category,
+    ConductReport,
+    Conference,
+    DemographicSurvey,
+    Talk,
+    TalkCategory,
+    TalkSpeaker,
+    User,
+    Vote,
+)
+from yakbak.seed import seed, SeedCounts
+from yakbak.types import Application
+
+COUNTS = SeedCounts(
+    users=40,
+    reviewers=5,
+    talks=20,
+    co_speakers=6,
+    categories=3,
+    votes=60,
+    surveys=10,
+    conduct_reports=2,
+)
+
+
+def test_seed_adds_requested_rows(app: Application) -> None:
+    conference = Conference.query.first()
+
+    added = seed(conference, COUNTS, random.Random(0))
+
+    assert added == {
+        "user": 40,
+        "category": 3,
+        "talk": 20,
+        "talk_speaker": 26,
+        "talk_category": TalkCategory.query.count(),
+        "vote": 60,
+        "demographic_survey": 10,
+        "conduct_report": 2,
+    }
+    assert User.query.count() == 40
+    assert User.query.filter_by(reviewer=True).count() == 5
+    assert Category.query.filter_by(conference=conference).count() == 3
+    assert Talk.query.count() == 20
+    assert TalkSpeaker.query.count() == 26
+    assert Vote.query.join(User).filter(User.reviewer == False).count() == 0  # noqa
+    assert DemographicSurvey.query.count() == 10
+    assert ConductReport.query.count() == 2
+
+
+def test_seed_maintains_vote_counters(app: Application) -> None:
+    seed(Conference.query.first(), COUNTS, random.Random(0))
+
+    assert Talk.reconcile_vote_counters() == 0
+    assert (
+        sum(t.vote_count for t in Talk.query)
+        == Vote.query.filter_by(skipped=False).count()
+    )
+
+
+def test_seed_can_run_twice(app: Application) -> None:
+    conference = Conference.query.first()
+
+    seed(conference, COUNTS, random.Random(0))
+    seed(conference, COUNTS, random.Random(0))
+
+    assert User.query.count() == 80
+    assert Category.query.filter_by(conference=conference).count() == 6
+
+
+@pytest.mark.parametrize(
+    "counts",
+    (
+        SeedCounts(users=10, reviewers=11),
+        SeedCounts(talks=10, co_speakers=11),
+        SeedCounts(reviewers=2, talks=3, votes=7),
+        SeedCounts(users=10, surveys=11),
+    ),
+)
+def test_seed_rejects_impossible_counts(app: Application, counts: SeedCounts) -> None:
+    with pytest.raises(ValueError):
+        seed(Conference.query.first(), counts)
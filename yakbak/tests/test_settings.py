@@ -43,6 +43,15 @@ def test_it_fails_with_missing_fields() -> None:
         load_settings(settings_dict)
 
 
+@pytest.mark.parametrize("max_emails", (0, -1))
+def test_it_fails_without_room_for_emails_per_connection(max_emails: int) -> None:
+    settings_dict = valid_settings_dict()
+    settings_dict["smtp"]["max_emails"] = max_emails
+
+    with pytest.raises(ValueError):
+        load_settings(settings_dict)
+
+
 def test_it_sets_auth_summary_fields() -> None:
     settings_dict = valid_settings_dict()
     settings_dict["auth"].update(github_key_id="the-key-id", github_secret="the-secret")
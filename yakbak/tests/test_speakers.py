@@ -256,3 +256,20 @@ def test_accept_button_rejects_the_talk(client: Client, user: User) -> None:
         "Accept",
     )
     assert_html_response_doesnt_contain(resp, "Reject")
+
+
+def test_talk_pages_are_not_found_for_other_users(client: Client, user: User) -> None:
+    other = User(email="other@example.com", fullname="Other User")
+    talk = Talk(title="My Talk", length=25)
+    talk.add_speaker(other, InvitationStatus.CONFIRMED)
+    db.session.add(talk)
+    db.session.commit()
+    talk_id = talk.talk_id
+
+    client.get("/test-login/{}".format(user.user_id))
+    for path in ("", "/anonymized", "/preview", "/speakers", "/withdraw", "/resubmit"):
+        resp = client.get("/talks/{}{}".format(talk_id, path))
+        assert resp.status_code == 404, path
+
+    resp = client.get("/talks/{}".format(talk_id + 1))
+    assert resp.status_code == 404
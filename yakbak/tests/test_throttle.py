@@ -0,0 +1,154 @@
+from datetime import datetime, timedelta
+from unittest.mock import patch
+import logging
+
+from _pytest.logging import LogCaptureFixture
+import attr
+
+from yakbak import prune, throttle
+from yakbak.models import db, ThrottleBucket
+from yakbak.types import Application
+
+
+def test_memory_buckets_allow_bursts_then_refill() -> None:
+    buckets = throttle.MemoryBuckets()
+
+    with patch.object(throttle, "monotonic", return_value=1000):
+        assert [buckets.take("key", 3, 60) for _ in range(4)] == [
+            True,
+            True,
+            True,
+            False,
+        ]
+        assert buckets.take("other", 3, 60)
+
+    # one token every 20 seconds
+    with patch.object(throttle, "monotonic", return_value=1019):
+        assert not buckets.take("key", 3, 60)
+    with patch.object(throttle, "monotonic", return_value=1021):
+        assert buckets.take("key", 3, 60)
+        assert not buckets.take("key", 3, 60)
+
+
+def test_memory_buckets_forget_least_recently_used_keys() -> None:
+    buckets = throttle.MemoryBuckets(maxsize=2)
+
+    with patch.object(throttle, "monotonic", return_value=1000):
+        assert buckets.take("a", 1, 60)
+        assert buckets.take("b", 1, 60)
+        assert not buckets.take("a", 1, 60)
+        assert buckets.take("c", 1, 60)
+
+        assert len(buckets) == 2
+        # "a" was remembered, "b" was forgotten
+        assert not buckets.take("a", 1, 60)
+        assert buckets.take("b", 1, 60)
+
+
+def test_database_buckets_allow_bursts_then_refill(app: Application) -> None:
+    buckets = throttle.DatabaseBuckets()
+
+    assert [buckets.take("key", 3, 60) for _ in range(4)] == [True, True, True, False]
+    assert buckets.take("other", 3, 60)
+
+    ThrottleBucket.query.filter_by(key="key").update(
+        {"updated": ThrottleBucket.updated - timedelta(seconds=21)},
+        synchronize_session=False,
+    )
+    db.session.commit()
+
+    assert buckets.take("key", 3, 60)
+    assert not buckets.take("key", 3, 60)
+
+
+def test_magic_link_throttle_limits_addresses_and_emails(app: Application) -> None:
+    limit = throttle.MagicLinkThrottle()
+    limit.buckets = throttle.MemoryBuckets()
+    limit.resend_after = 300
+    limit.per_hour = 3
+
+    assert limit.check("jane@example.com", "10.0.0.1") == throttle.MagicLinkRequest.SEND
+    assert (
+        limit.check("Jane@Example.com", "10.0.0.2")
+        == throttle.MagicLinkRequest.ALREADY_SENT
+    )
+    assert limit.check("joe@example.com", "10.0.0.1") == throttle.MagicLinkRequest.SEND
+    assert limit.check("ann@example.com", "10.0.0.1") == throttle.MagicLinkRequest.SEND
+    assert (
+        limit.check("bob@example.com", "10.0.0.1")
+        == throttle.MagicLinkRequest.THROTTLED
+    )
+
+
+def test_magic_link_throttle_doesnt_charge_addresses_for_resends(
+    app: Application
+) -> None:
+    limit = throttle.MagicLinkThrottle()
+    limit.buckets = throttle.MemoryBuckets()
+    limit.resend_after = 300
+    limit.per_hour = 2
+
+    assert limit.check("jane@example.com", "10.0.0.1") == throttle.MagicLinkRequest.SEND
+    for _ in range(5):
+        assert (
+            limit.check("jane@example.com", "10.0.0.1")
+            == throttle.MagicLinkRequest.ALREADY_SENT
+        )
+    assert limit.check("joe@example.com", "10.0.0.1") == throttle.MagicLinkRequest.SEND
+
+
+def test_magic_link_throttle_refunds_emails(app: Application) -> None:
+    limit = throttle.MagicLinkThrottle()
+    limit.buckets = throttle.DatabaseBuckets()
+    limit.resend_after = 300
+
+    assert limit.check("jane@example.com", "10.0.0.1") == throttle.MagicLinkRequest.SEND
+    limit.refund("Jane@example.com")
+    assert limit.check("jane@example.com", "10.0.0.1") == throttle.MagicLinkRequest.SEND
+    assert (
+        limit.check("jane@example.com", "10.0.0.1")
+        == throttle.MagicLinkRequest.ALREADY_SENT
+    )
+
+
+def test_magic_link_throttle_warns_when_proxies_arent_configured(
+    app: Application, caplog: LogCaptureFixture
+) -> None:
+    limit = throttle.MagicLinkThrottle()
+    with caplog.at_level(logging.WARNING, logger="throttle"):
+        limit.init_app(app)
+    assert "flask.proxies is 0" in caplog.text
+
+    caplog.clear()
+    flask_settings = attr.evolve(app.settings.flask, proxies=1)
+    app.settings = attr.evolve(app.settings, flask=flask_settings)
+    with caplog.at_level(logging.WARNING, logger="throttle"):
+        limit.init_app(app)
+    assert not caplog.records
+
+
+def test_magic_link_throttle_can_be_turned_off(app: Application) -> None:
+    limit = throttle.MagicLinkThrottle()
+    limit.buckets = throttle.MemoryBuckets()
+
+    for _ in range(100):
+        assert (
+            limit.check("jane@example.com", "10.0.0.1")
+            == throttle.MagicLinkRequest.SEND
+        )
+
+
+def test_prune_forgets_idle_throttle_buckets(app: Application) -> None:
+    throttle.DatabaseBuckets().take("old", 1, 60)
+    throttle.DatabaseBuckets().take("new", 1, 60)
+    ThrottleBucket.query.filter_by(key="old").update(
+        {"updated": datetime.utcnow() - timedelta(days=2)}, synchronize_session=False
+    )
+    db.session.commit()
+
+    job = prune.JOBS["throttle-buckets"]
+    cutoff = datetime.utcnow() - timedelta(days=job.older_than_days)
+    assert prune.prune(job, cutoff) == 1
+
+    (bucket,) = ThrottleBucket.query.all()
+    assert bucket.key == "new"
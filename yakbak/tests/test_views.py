@@ -1,12 +1,17 @@
 from datetime import datetime, timedelta
+from pathlib import Path
 from unittest.mock import ANY, Mock, patch
 from urllib.parse import urlparse
 import re
 
 from werkzeug.test import Client
+import attr
 import bs4
+import pytest
+import yaml
 
 from yakbak import views
+from yakbak.core import set_up_flask
 from yakbak.models import (
     AgeGroup,
     Category,
@@ -17,6 +22,7 @@ from yakbak.models import (
     ProgrammingExperience,
     Talk,
     TalkStatus,
+    UsedMagicLink,
     User,
 )
 from yakbak.tests.util import (
@@ -25,7 +31,9 @@ from yakbak.tests.util import (
     assert_html_response_doesnt_contain,
     assert_redirected,
     extract_csrf_from,
+    QueryBudget,
 )
+from yakbak.types import Application
 
 
 def test_root_shows_cfp_description_when_logged_out(client: Client) -> None:
@@ -93,6 +101,13 @@ def test_invalid_email_magic_link_login(client: Client) -> None:
     assert_html_response(resp, status=404)
 
 
+def test_invalid_email_magic_link_is_not_recorded(client: Client) -> None:
+    resp = client.get("/login/token/any-token-here")
+
+    assert_html_response(resp, status=404)
+    assert UsedMagicLink.query.count() == 0
+
+
 def test_email_magic_link_tokens_only_work_once(
     client: Client, send_mail: Mock
 ) -> None:
@@ -117,6 +132,93 @@ def test_email_magic_link_tokens_only_work_once(
     assert_html_response(resp, status=401)
 
 
+def test_email_magic_links_are_not_resent_right_away(
+    client: Client, send_mail: Mock
+) -> None:
+    resp = client.get("/login/email")
+    csrf_token = extract_csrf_from(resp)
+
+    for email in ("jane@example.com", "Jane@example.com"):
+        postdata = {"email": email, "csrf_token": csrf_token}
+        resp = client.post("/login/email", data=postdata, follow_redirects=True)
+        assert_html_response_contains(resp, "We have sent a link to you")
+
+    assert send_mail.call_count == 1
+
+
+def test_email_magic_link_requests_are_throttled_by_ip(
+    client: Client, send_mail: Mock
+) -> None:
+    views.magic_link_throttle.per_hour = 2
+    resp = client.get("/login/email")
+    csrf_token = extract_csrf_from(resp)
+
+    for i in range(3):
+        postdata = {"email": f"jane{i}@example.com", "csrf_token": csrf_token}
+        resp = client.post("/login/email", data=postdata)
+
+    assert_html_response_contains(resp, "lot of magic links", status=429)
+    assert send_mail.call_count == 2
+
+    # other addresses are unaffected
+    postdata = {"email": "joe@example.com", "csrf_token": csrf_token}
+    resp = client.post(
+        "/login/email", data=postdata, environ_base={"REMOTE_ADDR": "10.0.0.2"}
+    )
+    assert_redirected(resp, "/login/email/sent")
+
+
+def test_email_magic_link_can_be_requested_again_if_sending_fails(
+    client: Client, send_mail: Mock
+) -> None:
+    resp = client.get("/login/email")
+    csrf_token = extract_csrf_from(resp)
+    postdata = {"email": "jane@example.com", "csrf_token": csrf_token}
+
+    send_mail.side_effect = ConnectionRefusedError()
+    with pytest.raises(ConnectionRefusedError):
+        client.post("/login/email", data=postdata)
+
+    send_mail.side_effect = None
+    resp = client.post("/login/email", data=postdata, follow_redirects=True)
+    assert_html_response_contains(resp, "We have sent a link to you")
+    assert send_mail.call_count == 2
+
+
+def test_email_magic_link_throttle_uses_addresses_from_the_prod_proxy(
+    app: Application, client: Client, send_mail: Mock
+) -> None:
+    compose_file = Path(__file__).parents[2] / "docker-compose-prod.yml"
+    compose = yaml.safe_load(compose_file.read_text())
+    proxies = compose["services"]["web"]["environment"]["FLASK_PROXIES"]
+    flask_settings = attr.evolve(app.settings.flask, proxies=proxies)
+    app.settings = attr.evolve(app.settings, flask=flask_settings)
+    set_up_flask(app, {})
+
+    views.magic_link_throttle.per_hour = 1
+    resp = client.get("/login/email")
+    csrf_token = extract_csrf_from(resp)
+
+    # every request comes from nginx-proxy, which appends the client's
+    # address; the first entry of the last request was made up by a client
+    nginx = {"REMOTE_ADDR": "172.18.0.2"}
+    statuses = []
+    for i, forwarded_for in enumerate(
+        ("10.0.0.1", "10.0.0.2", "10.0.0.1", "10.0.0.2, 10.0.0.3")
+    ):
+        postdata = {"email": f"jane{i}@example.com", "csrf_token": csrf_token}
+        resp = client.post(
+            "/login/email",
+            data=postdata,
+            headers={"X-Forwarded-For": forwarded_for},
+            environ_base=nginx,
+        )
+        statuses.append(resp.status_code)
+
+    assert statuses == [302, 302, 429, 302]
+    assert send_mail.call_count == 3
+
+
 def test_profile_updates_name_and_bio_not_email(client: Client, user: User) -> None:
     resp = client.get("/test-login/{}".format(user.user_id), follow_redirects=True)
     resp = client.get("/profile")
@@ -304,6 +406,61 @@ def test_create_talk_goes_to_preview(client: Client, user: User) -> None:
     assert talks[0].title == "My Awesome Talk"
 
 
+@pytest.mark.parametrize("path", ("/talks/{}/preview", "/talks/{}/anonymized"))
+def test_talk_previews_answer_conditional_requests(
+    path: str, authenticated_client: Client, user: User
+) -> None:
+    talk = Talk(title="My Talk", length=25, description="", outline="", take_aways="")
+    talk.add_speaker(user, InvitationStatus.CONFIRMED)
+    db.session.add(talk)
+    db.session.commit()
+    url = path.format(talk.talk_id)
+
+    resp = authenticated_client.get(url)
+    assert_html_response_contains(resp, "My Talk")
+    etag = resp.headers["ETag"]
+    assert resp.headers["Last-Modified"]
+
+    # only the talk's timestamp is loaded
+    with QueryBudget(1):
+        resp = authenticated_client.get(url, headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert resp.headers["ETag"] == etag
+
+    db.session.add(talk)
+    talk.title = "My Better Talk"
+    db.session.commit()
+
+    resp = authenticated_client.get(url, headers={"If-None-Match": etag})
+    assert_html_response_contains(resp, "My Better Talk")
+    assert resp.headers["ETag"] != etag
+
+
+def test_talk_previews_are_private_to_each_user(
+    authenticated_client: Client, user: User
+) -> None:
+    talk = Talk(title="My Talk", length=25, description="", outline="", take_aways="")
+    talk.add_speaker(user, InvitationStatus.CONFIRMED)
+    db.session.add(talk)
+    db.session.commit()
+    url = f"/talks/{talk.talk_id}/preview"
+
+    resp = authenticated_client.get(url)
+    etag = resp.headers["ETag"]
+    assert "private" in resp.headers["Cache-Control"]
+    assert "Cookie" in resp.headers["Vary"]
+
+    # a co-speaker shares the talk, but not the page
+    other = User(fullname="Other User", email="other@example.com")
+    db.session.add(talk)
+    talk.add_speaker(other, InvitationStatus.CONFIRMED)
+    db.session.commit()
+    authenticated_client.get(f"/test-login/{other.user_id}")
+
+    resp = authenticated_client.get(url, headers={"If-None-Match": etag})
+    assert_html_response_contains(resp, "My Talk")
+
+
 def test_talk_form_uses_select_field_for_length(client: Client, user: User) -> None:
     client.get("/test-login/{}".format(user.user_id))
     resp = client.get("/talks/new")
@@ -372,12 +529,7 @@ def test_demographic_survey_saves_data(client: Client, user: User) -> None:
             "WHITE_CAUCASIAN",
             "free form text for 'other' ethnicity",
         ],
-        "past_speaking": [
-            "NEVER",
-            "PYCONCA",
-            "OTHER_PYTHON",
-            "OTHER_NONPYTHON",
-        ],
+        "past_speaking": ["NEVER", "PYCONCA", "OTHER_PYTHON", "OTHER_NONPYTHON"],
         "age_group": "UNDER_45",
         "programming_experience": "UNDER_10YR",
         "csrf_token": csrf_token,
@@ -7,8 +7,19 @@ from unittest.mock import Mock
 from werkzeug.test import Client
 import pytest
 
-from yakbak.models import Category, ConductReport, Conference, db, Talk, User, Vote
+from yakbak.models import (
+    Category,
+    ConductReport,
+    Conference,
+    db,
+    Talk,
+    TalkStatus,
+    User,
+    Vote,
+)
+from yakbak.tests.util import count_queries
 from yakbak.types import Application
+from yakbak.voting import vote_queues, VoteQueues
 
 
 @pytest.fixture(autouse=True)
@@ -184,3 +195,234 @@ def test_clear_skipped_votes(
 
     # Check for the desired skipped vote count.
     assert Vote.query.count() == ending_count
+
+
+def test_vote_counters_follow_votes(
+    *, authenticated_client: Client, user: User
+) -> None:
+    """Test that a talk's vote counters are updated as votes change."""
+    user.reviewer = True
+    talk = Talk(title="", length=1)
+    vote = Vote(talk=talk, user=user)
+    db.session.add_all((talk, vote))
+    db.session.commit()
+    talk_id, public_id = talk.talk_id, vote.public_id
+    assert (talk.vote_count, talk.vote_score) == (0, 0)
+
+    authenticated_client.post(
+        f"/vote/cast/{public_id}",
+        data={"action": "vote", "value": 1, "comment": "Comment"},
+    )
+    talk = Talk.query.get(talk_id)
+    assert (talk.vote_count, talk.vote_score) == (1, 1)
+
+    authenticated_client.post(
+        f"/vote/cast/{public_id}",
+        data={"action": "vote", "value": -1, "comment": "Comment"},
+    )
+    talk = Talk.query.get(talk_id)
+    assert (talk.vote_count, talk.vote_score) == (1, -1)
+
+    authenticated_client.post(f"/vote/cast/{public_id}", data={"action": "skip"})
+    talk = Talk.query.get(talk_id)
+    assert (talk.vote_count, talk.vote_score) == (0, -1)
+
+    db.session.delete(Vote.query.filter_by(public_id=public_id).one())
+    db.session.commit()
+    talk = Talk.query.get(talk_id)
+    assert (talk.vote_count, talk.vote_score) == (0, 0)
+
+
+def test_clear_skipped_votes_updates_vote_counters(
+    *, conference: Conference, user: User
+) -> None:
+    """Test that clearing a skipped vote removes its value from the score."""
+    talk = Talk(title="", length=1, is_anonymized=True)
+    db.session.add(talk)
+    db.session.commit()
+    db.session.add(Vote(talk=talk, user=user, value=1, skipped=True))
+    db.session.commit()
+    talk = Talk.query.get(talk.talk_id)
+    assert (talk.vote_count, talk.vote_score) == (0, 1)
+
+    Vote.clear_skipped(user=user, commit=True)
+
+    talk = Talk.query.get(talk.talk_id)
+    assert (talk.vote_count, talk.vote_score) == (0, 0)
+
+
+def test_reconcile_vote_counters(*, user: User) -> None:
+    """Test that drifted vote counters are recomputed from the votes."""
+    talk = Talk(title="", length=1)
+    db.session.add_all((talk, Vote(talk=talk, user=user, value=1, skipped=False)))
+    db.session.commit()
+    db.session.execute(Talk.__table__.update().values(vote_count=7, vote_score=-3))
+    db.session.commit()
+
+    assert Talk.reconcile_vote_counters() == 1
+    db.session.commit()
+
+    talk = Talk.query.get(talk.talk_id)
+    assert (talk.vote_count, talk.vote_score) == (1, 1)
+    assert Talk.reconcile_vote_counters() == 0
+
+
+def test_vote_home_query_count_is_constant(
+    *, authenticated_client: Client, conference: Conference, user: User
+) -> None:
+    """Test that the voting home page doesn't query per category or vote."""
+    user.reviewer = True
+
+    def add_category_with_votes(name: str) -> None:
+        category = Category(conference=conference, name=name)
+        for _ in range(2):
+            talk = Talk(title=name, length=1, is_anonymized=True)
+            category.talks.append(talk)
+            db.session.add(Vote(talk=talk, user=user, value=1, skipped=False))
+        db.session.add(category)
+        db.session.commit()
+
+    add_category_with_votes("First")
+    with count_queries() as statements:
+        resp = authenticated_client.get("/vote")
+    assert resp.status_code == 200
+    baseline = len(statements)
+
+    for name in ("Second", "Third", "Fourth"):
+        add_category_with_votes(name)
+    with count_queries() as statements:
+        resp = authenticated_client.get("/vote")
+    assert resp.status_code == 200
+
+    assert len(statements) == baseline, "\n\n".join(statements)
+    assert len(statements) <= 4, "\n\n".join(statements)
+
+
+def test_vote_queue_serves_least_voted_talks_first(
+    *, conference: Conference, user: User
+) -> None:
+    """Test that queued talks are ordered by vote count and re-checked."""
+    other_user = User(fullname="Other User", email="other@example.com")
+    category = Category(conference=conference, name="")
+    talks = [Talk(title="", length=1, is_anonymized=True) for _ in range(3)]
+    category.talks.extend(talks)
+    db.session.add_all((category, other_user, *talks))
+    db.session.add(Vote(talk=talks[0], user=other_user, value=1, skipped=False))
+    db.session.commit()
+
+    queues = VoteQueues(batch_size=10)
+    first = queues.next_talk(user, category)
+    assert first in talks[1:]
+
+    # voted on elsewhere since the queue was filled
+    second = talks[2] if first is talks[1] else talks[1]
+    db.session.add(Vote(talk=second, user=user, value=1, skipped=False))
+    db.session.commit()
+
+    assert queues.next_talk(user, category) is talks[0]
+
+
+def test_vote_queue_is_refilled_when_others_vote_a_lot(
+    *, conference: Conference, user: User
+) -> None:
+    """Test that a queue whose talks got many votes elsewhere is refilled."""
+    others = [User(fullname="", email=f"other{i}@example.com") for i in range(2)]
+    category = Category(conference=conference, name="")
+    talks = [Talk(title="", length=1, is_anonymized=True) for _ in range(3)]
+    category.talks.extend(talks)
+    db.session.add_all((category, *others, *talks))
+    db.session.commit()
+
+    queues = VoteQueues(batch_size=10, max_stale_votes=1)
+    first = queues.next_talk(user, category)
+    db.session.add(Vote(talk=first, user=user, value=1, skipped=False))
+    # others vote on the talk at the head of the queue, more than allowed
+    _, queue = queues._queues[(user.user_id, category.category_id)]
+    (voted,) = [talk for talk in talks if talk.talk_id == queue[0][0]]
+    (unvoted,) = [talk for talk in talks if talk not in (first, voted)]
+    for other in others:
+        db.session.add(Vote(talk=voted, user=other, value=1, skipped=False))
+    db.session.commit()
+
+    assert queues.next_talk(user, category) is unvoted
+
+
+def test_vote_queues_stay_fair_and_batched_for_concurrent_reviewers(
+    *, conference: Conference, user: User
+) -> None:
+    """Test two reviewers voting in turns through their own queues."""
+    other_user = User(fullname="Other User", email="other@example.com")
+    category = Category(conference=conference, name="")
+    talks = [Talk(title="", length=1, is_anonymized=True) for _ in range(12)]
+    category.talks.extend(talks)
+    db.session.add_all((category, other_user, *talks))
+    db.session.commit()
+
+    queues = VoteQueues(batch_size=4, max_stale_votes=1)
+    refills = Mock(wraps=queues._candidates)
+    queues._candidates = refills  # type: ignore
+    reviewers = [user, other_user]
+    served = 0
+    while True:
+        reviewer = reviewers[served % 2]
+        talk = queues.next_talk(reviewer, category)
+        if talk is None:
+            break
+        served += 1
+
+        # no unvoted talk has fewer votes than the one served, by more
+        # than the staleness allowed
+        unvoted = Talk.query.filter(
+            Talk.talk_id.notin_(
+                db.session.query(Vote.talk_id).filter(Vote.user == reviewer)
+            )
+        )
+        fewest = min(t.vote_count for t in unvoted)
+        assert talk.vote_count - fewest <= queues.max_stale_votes
+
+        db.session.add(Vote(talk=talk, user=reviewer, value=1, skipped=False))
+        db.session.commit()
+
+    assert served == 2 * len(talks)
+    # batching saves queries even though each reviewer's votes make the
+    # other's queue stale
+    assert refills.call_count <= served / 3
+
+
+def test_vote_queues_keep_the_most_recently_used(
+    *, conference: Conference, user: User
+) -> None:
+    """Test that the number of queues kept is bounded."""
+    categories = [Category(conference=conference, name=str(i)) for i in range(3)]
+    for category in categories:
+        category.talks.extend(
+            Talk(title="", length=1, is_anonymized=True) for _ in range(2)
+        )
+    db.session.add_all(categories)
+    db.session.commit()
+
+    queues = VoteQueues(maxsize=2)
+    for category in categories:
+        assert queues.next_talk(user, category) is not None
+
+    assert len(queues) == 2
+
+
+def test_vote_queue_drops_withdrawn_talks(
+    *, conference: Conference, user: User
+) -> None:
+    """Test that withdrawing a talk removes it from queued candidates."""
+    category = Category(conference=conference, name="")
+    talks = [Talk(title="", length=1, is_anonymized=True) for _ in range(2)]
+    category.talks.extend(talks)
+    db.session.add_all((category, *talks))
+    db.session.commit()
+
+    vote_queues.clear()
+    first = vote_queues.next_talk(user, category)
+    db.session.add(Vote(talk=first, user=user))
+    remaining = talks[1] if first is talks[0] else talks[0]
+    remaining.state = TalkStatus.WITHDRAWN
+    db.session.commit()
+
+    assert vote_queues.next_talk(user, category) is None
@@ -1,7 +1,12 @@
-from typing import Pattern, Union
+from contextlib import ContextDecorator, contextmanager, ExitStack
+from types import TracebackType
+from typing import Any, Iterator, List, Optional, Pattern, Tuple, Type, Union
 import re
 
-from flask import Response
+from flask import request, request_started, request_tearing_down, Response
+from sqlalchemy import event
+
+from yakbak.models import db
 
 
 def assert_html_response(resp: Response, status: int = 200) -> str:
@@ -71,3 +76,89 @@ def extract_csrf_from(resp: Response) -> str:
     match = re.search('value="([^"]*)"', tags[0])
     assert match, "CSRF hidden input had no value"
     return match.group(1)
+
+
+@contextmanager
+def count_queries() -> Iterator[List[str]]:
+    """
+    Collect the SQL statements executed within the ``with`` block.
+
+    """
+    statements: List[str] = []
+
+    def before_cursor_execute(
+        conn: Any, cursor: Any, statement: str, *args: Any
+    ) -> None:
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+
+class QueryBudget(ContextDecorator):
+    """
+    Fail if any request handled in the block runs over ``max_queries``.
+
+    Use as a context manager or as a decorator on a test function. Only
+    the SQL statements executed while handling a request count; those
+    of the test's own setup don't. The failure lists each request over
+    budget with the statements it ran, to make the N+1 easy to spot.
+
+    """
+
+    def __init__(self, max_queries: int) -> None:
+        self.max_queries = max_queries
+        self.requests: List[Tuple[str, List[str]]] = []
+        self._statements: List[str] = []
+        self._started: Optional[Tuple[str, int]] = None
+        self._stack = ExitStack()
+
+    def __enter__(self) -> "QueryBudget":
+        self.requests = []
+        self._statements = self._stack.enter_context(count_queries())
+        request_started.connect(self._start)
+        request_tearing_down.connect(self._finish)
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self._stack.close()
+        request_started.disconnect(self._start)
+        request_tearing_down.disconnect(self._finish)
+        if exc_type is None:
+            self.check()
+
+    def check(self) -> None:
+        over = [
+            (name, statements)
+            for name, statements in self.requests
+            if len(statements) > self.max_queries
+        ]
+        if over:
+            raise AssertionError(
+                "\n\n".join(
+                    self._describe(name, statements) for name, statements in over
+                )
+            )
+
+    def _describe(self, name: str, statements: List[str]) -> str:
+        lines = [f"{name} ran {len(statements)} queries (budget {self.max_queries}):"]
+        lines.extend(f"{i}: {s}" for i, s in enumerate(statements, 1))
+        return "\n".join(lines)
+
+    def _start(self, sender: Any, **extra: Any) -> None:
+        name = f"{request.method} {request.full_path.rstrip('?')}"
+        self._started = (name, len(self._statements))
+
+    def _finish(self, sender: Any, **extra: Any) -> None:
+        if self._started is not None:
+            name, start = self._started
+            self.requests.append((name, self._statements[start:]))
+            self._started = None
@@ -0,0 +1,187 @@
+"""
+Token bucket rate limits for requests that cost us something to serve.
+
+Each key (an email address, an IP address) has a bucket holding up to
+``capacity`` tokens, which refills at ``capacity`` tokens per ``period``
+seconds. Every request takes a token, and is refused if there are none
+left; so a key can make ``capacity`` requests in a burst, and then one
+every ``period / capacity`` seconds.
+
+Buckets are kept in memory, shared by the threads of a process, or with
+the ``auth.email_magic_link_throttle = "database"`` setting in the
+database, shared by all processes.
+
+"""
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Optional, Tuple, Union
+import enum
+import logging
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+
+from yakbak.models import db, ThrottleBucket
+from yakbak.types import Application
+
+logger = logging.getLogger("throttle")
+
+
+class MemoryBuckets:
+    """
+    Buckets for the keys seen most recently by this process.
+
+    When there are more than ``maxsize`` of them, the least recently used
+    buckets are forgotten; they are usually full by then anyway.
+
+    """
+
+    def __init__(self, maxsize: int = 10000) -> None:
+        self.maxsize = maxsize
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, key: str, capacity: int, period: float) -> bool:
+        """Take a token from ``key``'s bucket; return ``False`` if it's empty."""
+        now = monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * capacity / period)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return allowed
+
+    def give(self, key: str, capacity: int) -> None:
+        """Put back a token taken from ``key``'s bucket."""
+        with self._lock:
+            if key in self._buckets:
+                tokens, updated = self._buckets[key]
+                self._buckets[key] = (min(capacity, tokens + 1), updated)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+
+
+class DatabaseBuckets:
+    """
+    Buckets in the ``throttle_bucket`` table, shared by all processes.
+
+    Each token is taken with a single upsert, in a transaction of its
+    own, so concurrent requests for a key take turns on its row. Rows
+    are deleted by ``flask prune throttle-buckets``.
+
+    """
+
+    def take(self, key: str, capacity: int, period: float) -> bool:
+        """Take a token from ``key``'s bucket; return ``False`` if it's empty."""
+        table = ThrottleBucket.__table__
+        now = func.timezone("utc", func.now())
+        elapsed = func.extract("epoch", now - table.c.updated)
+        tokens = func.least(capacity, table.c.tokens + elapsed * capacity / period)
+        statement = (
+            insert(table)
+            .values(key=key, tokens=capacity - 1, updated=now)
+            .on_conflict_do_update(
+                index_elements=[table.c.key],
+                set_={"tokens": tokens - 1, "updated": now},
+                # leave an empty bucket as it was, to go on refilling
+                where=tokens >= 1,
+            )
+            .returning(table.c.key)
+        )
+        with db.engine.begin() as connection:
+            return connection.execute(statement).first() is not None
+
+    def give(self, key: str, capacity: int) -> None:
+        """Put back a token taken from ``key``'s bucket."""
+        table = ThrottleBucket.__table__
+        statement = (
+            table.update()
+            .where(table.c.key == key)
+            .values(tokens=func.least(capacity, table.c.tokens + 1))
+        )
+        with db.engine.begin() as connection:
+            connection.execute(statement)
+
+
+class MagicLinkRequest(enum.Enum):
+    SEND = "send"
+    # a link was sent to the address recently, and can still be used
+    ALREADY_SENT = "already sent"
+    # too many requests from the client's address
+    THROTTLED = "throttled"
+
+
+class MagicLinkThrottle:
+    """
+    Limit how often magic links are emailed.
+
+    Each email address is sent at most one link per ``resend_after``
+    seconds, and each client IP address can ask for ``per_hour`` links an
+    hour. A ``resend_after`` or ``per_hour`` of 0 turns that limit off.
+
+    """
+
+    def __init__(self) -> None:
+        self.buckets: Optional[Union[MemoryBuckets, DatabaseBuckets]] = None
+        self.resend_after = 0
+        self.per_hour = 0
+
+    def init_app(self, app: Application) -> None:
+        settings = app.settings.auth
+        self.resend_after = settings.email_magic_link_resend_after
+        self.per_hour = settings.email_magic_link_requests_per_hour
+        if self.per_hour and not app.settings.flask.proxies:
+            logger.warning(
+                "flask.proxies is 0; if Yak-Bak is behind a reverse proxy, every "
+                "client shares that proxy's limit of %d magic links an hour",
+                self.per_hour,
+            )
+        if settings.email_magic_link_throttle == "database":
+            self.buckets = DatabaseBuckets()
+        else:
+            self.buckets = MemoryBuckets()
+
+    def check(self, email: str, client_addr: str) -> MagicLinkRequest:
+        """
+        Return whether to send a link to ``email``.
+
+        A ``SEND`` counts against both limits; if sending then fails, call
+        :meth:`refund` so that the user can ask again right away. Asking
+        again for an address that was just sent a link doesn't count
+        against the client's limit.
+
+        """
+        assert self.buckets is not None, "call init_app() first"
+        if self.resend_after and not self.buckets.take(
+            self._email_key(email), 1, self.resend_after
+        ):
+            return MagicLinkRequest.ALREADY_SENT
+        if self.per_hour and not self.buckets.take(
+            f"magic-link-ip:{client_addr}", self.per_hour, 3600
+        ):
+            self.refund(email)
+            return MagicLinkRequest.THROTTLED
+        return MagicLinkRequest.SEND
+
+    def refund(self, email: str) -> None:
+        """Forget that a link was sent to ``email``."""
+        assert self.buckets is not None, "call init_app() first"
+        if self.resend_after:
+            self.buckets.give(self._email_key(email), 1)
+
+    @staticmethod
+    def _email_key(email: str) -> str:
+        return f"magic-link-email:{email.lower()}"
+
+
+magic_link_throttle = MagicLinkThrottle()
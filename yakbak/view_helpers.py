@@ -1,14 +1,26 @@
 from datetime import datetime
 from functools import wraps
+from time import time
 from typing import Any, Callable, Dict, Iterable, List, Tuple, Union
-
-from flask import Blueprint, current_app, g, Markup, render_template, request, url_for
+import hashlib
+
+from flask import (
+    Blueprint,
+    current_app,
+    g,
+    make_response,
+    Markup,
+    render_template,
+    request,
+    session,
+    url_for,
+)
 from flask_login import current_user
-from markdown import markdown
+from werkzeug.http import is_resource_modified
 from werkzeug.wrappers import Response
-import diff_match_patch
 
-from yakbak.diff import diff_wordsToChars
+from yakbak.cache import markdown_cache
+from yakbak.diff import diff_applies_to, word_diff
 from yakbak.models import Talk
 
 app = Blueprint("view_helpers", __name__)
@@ -111,6 +123,82 @@ def requires_review_allowed(func: Callable) -> Callable:
     return wrapper
 
 
+def _templates_version() -> str:
+    """Return a hash of the app's templates, so that deploys change ETags."""
+    version = current_app.extensions.get("templates_version")
+    if version is None or current_app.jinja_env.auto_reload:
+        env = current_app.jinja_env
+        digest = hashlib.sha256()
+        for name in env.list_templates():
+            source, _, _ = env.loader.get_source(env, name)
+            digest.update(source.encode("utf8"))
+        version = current_app.extensions["templates_version"] = digest.hexdigest()
+    return version
+
+
+class PageValidators:
+    """
+    The ``ETag`` and ``Last-Modified`` validators of a page.
+
+    A view builds these from a cheap query for ``versions`` of the rows
+    it shows -- their ``updated`` timestamps, and anything else that
+    changes what it shows, like the viewing user's vote -- and returns a
+    304 if the browser's copy is :meth:`fresh`, before loading the rows
+    or rendering any Markdown. The ETag also covers what every page
+    shows: the conference, the viewing user and the navigation bar.
+
+    The CSRF tokens in a page's forms expire, so pass ``has_forms`` to
+    re-render pages with forms before a cached copy's tokens would.
+
+    """
+
+    def __init__(self, *versions: Any, has_forms: bool = False) -> None:
+        conference = g.conference
+        user = g.user
+        timestamps = [conference.updated]
+        timestamps.extend(v for v in versions if isinstance(v, datetime))
+        self.last_modified = max(timestamps)
+
+        key = [
+            request.path,
+            _templates_version(),
+            conference.updated,
+            getattr(user, "user_id", None),
+            top_nav(),
+            *versions,
+        ]
+        if has_forms:
+            time_limit = current_app.config.get("WTF_CSRF_TIME_LIMIT", 3600)
+            field_name = current_app.config.get("WTF_CSRF_FIELD_NAME", "csrf_token")
+            key.append(session.get(field_name))
+            if time_limit:
+                key.append(int(time() // (time_limit / 2)))
+        self.etag = hashlib.sha256(repr(key).encode("utf8")).hexdigest()[:32]
+
+    def fresh(self) -> bool:
+        """Return whether the browser already has this version of the page."""
+        if request.method not in ("GET", "HEAD"):
+            return False
+        if session.get("_flashes"):
+            # the messages were never shown on the cached copy
+            return False
+        return not is_resource_modified(
+            request.environ, etag=self.etag, last_modified=self.last_modified
+        )
+
+    def make_response(self, body: str = "", status: int = 200) -> Response:
+        """Return ``body``, or a 304 if ``status`` is 304, with the validators."""
+        response = make_response(body, status)
+        # the rendered page differs byte for byte (eg CSRF tokens), but not
+        # in meaning
+        response.set_etag(self.etag, weak=True)
+        response.last_modified = self.last_modified
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add("Cookie")
+        return response
+
+
 @app.app_template_filter("timesince")
 def timesince(dt: datetime, default: str = "just now") -> str:
     # from http://flask.pocoo.org/snippets/33/
@@ -136,7 +224,7 @@ def timesince(dt: datetime, default: str = "just now") -> str:
 
 @app.app_template_filter("markdown")
 def markdown_filter(value: str) -> Markup:
-    return Markup(markdown(value, output_format="html5"))
+    return Markup(markdown_cache.render(value))
 
 
 @app.app_template_filter("remove")
@@ -151,15 +239,13 @@ def anonymization_diff(talk: Talk, attr: str) -> Markup:
     if not right:
         return Markup(left)
 
-    dmp = diff_match_patch.diff_match_patch()
-
-    # from https://github.com/google/diff-match-patch/wiki/Line-or-Word-Diffs#line-mode
-    left_words, right_words, word_array = diff_wordsToChars(left, right)
-    diff = dmp.diff_main(left_words, right_words)
-    dmp.diff_charsToLines(diff, word_array)
+    ops = (talk.anonymization_diff or {}).get(attr)
+    if ops is None or not diff_applies_to(ops, left, right):
+        # saved before diffs were stored, or changed behind the ORM's back
+        ops = word_diff(left, right)
 
     out = []
-    for op, text in diff:
+    for op, text in ops:
         if op == 1:  # addition
             out.append(f'<span class="diff_add">{text}</span>')
         elif op == -1:  # deletion
@@ -1,4 +1,5 @@
 from contextlib import suppress
+from datetime import datetime
 import logging
 import uuid
 
@@ -16,13 +17,20 @@ from flask import (
 )
 from flask_login import login_required, login_user, logout_user
 from flask_wtf import FlaskForm
-from sqlalchemy import func
+from sqlalchemy import and_, func
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 from sqlalchemy.orm.exc import NoResultFound
 from werkzeug.wrappers import Response
 
 from yakbak import mail
-from yakbak.auth import get_magic_link_token_and_expiry, parse_magic_link_token
+from yakbak.auth import (
+    claim_magic_link_token,
+    get_magic_link_token_and_expiry,
+    parse_magic_link_token,
+)
+from yakbak.cache import markdown_cache
 from yakbak.forms import (
     ConductReportForm,
     DemographicSurveyForm,
@@ -32,6 +40,7 @@ from yakbak.forms import (
     UserForm,
     VoteForm,
 )
+from yakbak.metrics import VOTES
 from yakbak.models import (
     Category,
     ConductReport,
@@ -42,28 +51,44 @@ from yakbak.models import (
     TalkCategory,
     TalkSpeaker,
     TalkStatus,
-    UsedMagicLink,
     User,
     Vote,
 )
+from yakbak.throttle import magic_link_throttle, MagicLinkRequest
 from yakbak.view_helpers import (
+    PageValidators,
     requires_new_proposal_window_open,
     requires_proposal_editing_window_open,
     requires_review_allowed,
     requires_voting_allowed,
 )
+from yakbak.voting import vote_queues
 
 app = Blueprint("views", __name__)
 logger = logging.getLogger("views")
 
 
 def load_talk(talk_id: int) -> Talk:
-    talk = Talk.query.get_or_404(talk_id)
-    if g.user not in [s.user for s in talk.speakers]:
-        # TODO: figure out how to do this in the query directly?
-        abort(404)
+    # 404 unless the user is one of the talk's speakers, whatever the
+    # state of their invitation, without loading the other speakers
+    return (
+        Talk.query.join(TalkSpeaker)
+        .filter(Talk.talk_id == talk_id, TalkSpeaker.user_id == g.user.user_id)
+        .first_or_404()
+    )
+
 
-    return talk
+def load_talk_updated(talk_id: int) -> datetime:
+    # like load_talk, but only the talk's timestamp, for PageValidators
+    updated = (
+        db.session.query(Talk.updated)
+        .join(TalkSpeaker)
+        .filter(Talk.talk_id == talk_id, TalkSpeaker.user_id == g.user.user_id)
+        .scalar()
+    )
+    if updated is None:
+        abort(404)
+    return updated
 
 
 @app.route("/")
@@ -87,16 +112,32 @@ def logout() -> Response:
 def email_magic_link() -> Response:
     form = EmailAddressForm()
     if form.validate_on_submit():
+        # behind proxies, flask.proxies makes this the client's address
+        check = magic_link_throttle.check(form.email.data, request.remote_addr)
+        if check == MagicLinkRequest.THROTTLED:
+            return current_app.response_class(
+                render_template("email_magic_link_throttled.html"), status=429
+            )
+        elif check == MagicLinkRequest.ALREADY_SENT:
+            # the link sent a moment ago still works; don't flood the inbox
+            return redirect(url_for("views.email_magic_link_done"))
+
         token, expiry = get_magic_link_token_and_expiry(form.email.data)
         url = url_for(
             "views.email_magic_link_login", magic_link_token=token, _external=True
         )
-        mail.send_mail(
-            to=[form.email.data],
-            template="email/magic-link",
-            magic_link=url,
-            magic_link_expiration=expiry,
-        )
+        try:
+            mail.send_mail(
+                to=[form.email.data],
+                template="email/magic-link",
+                magic_link=url,
+                magic_link_expiration=expiry,
+            )
+            db.session.commit()
+        except Exception:
+            # the user never got a link, so let them ask again
+            magic_link_throttle.refund(form.email.data)
+            raise
         return redirect(url_for("views.email_magic_link_done"))
     return render_template("email_magic_link.html", form=form)
 
@@ -108,23 +149,19 @@ def email_magic_link_done() -> Response:
 
 @app.route("/login/token/<magic_link_token>")
 def email_magic_link_login(magic_link_token: str) -> Response:
-    try:
-        used_magic_link = UsedMagicLink(token=magic_link_token)
-        db.session.add(used_magic_link)
-        db.session.commit()
-    except IntegrityError:
-        # race condition, UsedMagicLink row exists
+    verified_email = parse_magic_link_token(magic_link_token)
+    if verified_email is None:
+        abort(404)
+
+    if not claim_magic_link_token(magic_link_token):
         db.session.rollback()
         return current_app.response_class(
             render_template("email_magic_link_used.html"), status=401
         )
 
-    verified_email = parse_magic_link_token(magic_link_token)
-    if verified_email is None:
-        abort(404)
-
     user = User.query.filter_by(email=verified_email).first()
     if user:
+        db.session.commit()
         login_user(user)
         return redirect(url_for("views.talks_list"))
 
@@ -153,15 +190,33 @@ def user_profile() -> Response:
 @app.route("/talks")
 @login_required
 def talks_list() -> Response:
-    talks = [ts.talk for ts in g.user.talks if ts.state == InvitationStatus.CONFIRMED]
+    # The user's talks and invitations, with each talk's speakers, in two
+    # queries however many there are. The page shows only a few of each
+    # talk's columns, so the rest (text, votes) aren't loaded.
+    talk_speakers = (
+        TalkSpeaker.query.filter(
+            TalkSpeaker.user == g.user, TalkSpeaker.state != InvitationStatus.DELETED
+        )
+        .options(
+            joinedload(TalkSpeaker.talk).load_only(
+                "talk_id",
+                "title",
+                "length",
+                "state",
+                "updated",
+                "has_anonymization_changes",
+            ),
+            joinedload(TalkSpeaker.talk)
+            .selectinload(Talk.speakers)
+            .joinedload(TalkSpeaker.user),
+        )
+        .order_by(TalkSpeaker.created)
+        .all()
+    )
+    talks = [ts.talk for ts in talk_speakers if ts.state == InvitationStatus.CONFIRMED]
     proposed_talks = [t for t in talks if t.state == TalkStatus.PROPOSED]
     withdrawn_talks = [t for t in talks if t.state == TalkStatus.WITHDRAWN]
-
-    invitations = TalkSpeaker.query.filter(
-        TalkSpeaker.user == g.user,
-        TalkSpeaker.state != InvitationStatus.CONFIRMED,
-        TalkSpeaker.state != InvitationStatus.DELETED,
-    ).all()
+    invitations = [ts for ts in talk_speakers if ts.state != InvitationStatus.CONFIRMED]
     speaker_actions = {
         InvitationStatus.PENDING: [
             ("Reject", "danger", "views.reject_invite"),
@@ -205,6 +260,9 @@ def edit_talk(talk_id: int) -> Response:
         talk.reset_after_edits()
         db.session.add(talk)
         db.session.commit()
+        markdown_cache.prerender(
+            talk.description, talk.outline, talk.requirements, talk.take_aways
+        )
         return redirect(url_for("views.preview_talk", talk_id=talk.talk_id))
 
     return render_template("edit_talk.html", talk=talk, form=form)
@@ -213,11 +271,17 @@ def edit_talk(talk_id: int) -> Response:
 @app.route("/talks/<int:talk_id>/anonymized", methods=["GET", "POST"])
 @login_required
 def anonymized_talk(talk_id: int) -> Response:
+    validators = PageValidators(load_talk_updated(talk_id))
+    if validators.fresh():
+        return validators.make_response(status=304)
+
     talk = load_talk(talk_id)
     if not talk.is_anonymized:
         flash("This talk has not yet been anonymized for review")
 
-    return render_template("anonymized_talk_preview.html", talk=talk)
+    return validators.make_response(
+        render_template("anonymized_talk_preview.html", talk=talk)
+    )
 
 
 @app.route("/talks/<int:talk_id>/withdraw")
@@ -254,27 +318,28 @@ def vote_home() -> Response:
 
     # TODO: When this is multitenant, categories and votes should be filtered
     # by event.
-    categories = Category.query.filter_by(conference=g.conference).order_by(
-        Category.name.asc()
+    voted_talk_ids = db.session.query(Vote.talk_id).filter(
+        Vote.user == g.user, Vote.value != None  # noqa: E711
+    )
+    remaining_talks = and_(
+        Talk.talk_id == TalkCategory.talk_id,
+        Talk.state == TalkStatus.PROPOSED,
+        Talk.talk_id.notin_(voted_talk_ids),
+    )
+    categories_counts = dict(
+        db.session.query(Category, func.count(Talk.talk_id))
+        .filter(Category.conference == g.conference)
+        .outerjoin(TalkCategory, TalkCategory.category_id == Category.category_id)
+        .outerjoin(Talk, remaining_talks)
+        .group_by(Category.category_id)
+        .order_by(Category.name.asc())
     )
-    # TODO: This is an inefficient way to do this. Write it as one query
-    # instead.
-    categories_counts = {
-        category: Talk.query.join(TalkCategory)
-        .filter(
-            Talk.state == TalkStatus.PROPOSED,
-            Talk.talk_id.notin_(
-                db.session.query(Vote.talk_id).filter(
-                    Vote.user == g.user, Vote.value != None  # noqa: E711
-                )
-            ),
-            TalkCategory.category_id == category.category_id,
-        )
-        .count()
-        for category in categories
-    }
 
-    votes = Vote.query.filter_by(user=g.user).order_by(Vote.created.asc())
+    votes = (
+        Vote.query.filter_by(user=g.user)
+        .options(joinedload(Vote.talk))
+        .order_by(Vote.created.asc())
+    )
     return render_template(
         "vote/home.html",
         categories_counts=categories_counts,
@@ -301,6 +366,9 @@ def vote_choose_talk_from_category(category_id: int) -> Response:
     2. excludes talks that a user has previously voted on or skipped
     3. is sorted to attempt to evenly distribute votes across talks
 
+    The sorted list is computed a batch at a time and kept in a queue
+    per reviewer and category; see :mod:`yakbak.voting`.
+
     .. note::
         Because talks can belong to more than one category, ensuring
         that votes are evenly distributed is not quite possible.
@@ -332,19 +400,7 @@ def vote_choose_talk_from_category(category_id: int) -> Response:
     )
 
     if vote is None:
-        talk = (
-            db.session.query(Talk)
-            .join(TalkCategory)
-            .filter(
-                Talk.is_anonymized == True,  # noqa: E712
-                Talk.state == TalkStatus.PROPOSED,
-                Talk.talk_id.notin_(
-                    db.session.query(Vote.talk_id).filter(Vote.user == g.user)
-                ),
-                TalkCategory.category_id == category_id,
-            )
-            .order_by(Talk.vote_count.asc(), func.random())
-        ).first()
+        talk = vote_queues.next_talk(g.user, category)
         if talk is None:
             skipped_talks_exist = db.session.query(
                 db.session.query(Vote)
@@ -412,6 +468,7 @@ def vote(public_id: uuid.UUID) -> Response:
             vote.skipped = True
             flash("Skipped")
         db.session.commit()
+        VOTES.labels(form.action.data).inc()
 
         if "voting_category" in session:
             return redirect(
@@ -463,15 +520,29 @@ def review_talk(talk_id: int) -> Response:
     if not g.user.is_reviewer and not g.user.is_site_admin:
         abort(404)
 
-    talk = Talk.query.anonymized().filter_by(talk_id=talk_id).first_or_404()
-    vote = Vote.query.filter_by(talk_id=talk_id, user_id=g.user.user_id).first()
-    return render_template(
-        "vote/detail.html",
-        talk=talk,
-        vote=vote,
-        vote_names=VoteForm.VOTE_VALUE_CHOICES,
-        conduct_form=ConductReportForm(talk_id=talk.talk_id),
-        show_vote_form=False,
+    talk_updated, vote = (
+        Talk.query.anonymized()
+        .filter_by(talk_id=talk_id)
+        .outerjoin(
+            Vote, and_(Vote.talk_id == Talk.talk_id, Vote.user_id == g.user.user_id)
+        )
+        .with_entities(Talk.updated, Vote)
+        .first_or_404()
+    )
+    validators = PageValidators(talk_updated, vote and vote.updated, has_forms=True)
+    if validators.fresh():
+        return validators.make_response(status=304)
+
+    talk = Talk.query.get(talk_id)
+    return validators.make_response(
+        render_template(
+            "vote/detail.html",
+            talk=talk,
+            vote=vote,
+            vote_names=VoteForm.VOTE_VALUE_CHOICES,
+            conduct_form=ConductReportForm(talk_id=talk.talk_id),
+            show_vote_form=False,
+        )
     )
 
 
@@ -491,12 +562,43 @@ def review_full_talk(talk_id: int) -> Response:
     if not g.user.is_site_admin:
         abort(404)
 
-    talk = Talk.query.anonymized().filter_by(talk_id=talk_id).first_or_404()
+    # everything the page shows, summarized in one row of scalar subqueries
+    # (one table each, so no row multiplication); the counts catch deleted
+    # votes and speakers, whose timestamps go with them
     votes = Vote.query.filter_by(talk_id=talk_id)
-    return render_template(
-        "vote/full_detail.html",
-        talk=talk,
-        votes=votes,
+    speakers = TalkSpeaker.query.filter_by(talk_id=talk_id)
+    speaker_ids = speakers.with_entities(TalkSpeaker.user_id)
+    users = User.query.filter(User.user_id.in_(speaker_ids))
+    surveys = DemographicSurvey.query.filter(DemographicSurvey.user_id.in_(speaker_ids))
+    category_ids = TalkCategory.query.filter_by(talk_id=talk_id).with_entities(
+        TalkCategory.category_id
+    )
+    categories = Category.query.filter(Category.category_id.in_(category_ids))
+    versions = (
+        Talk.query.anonymized()
+        .filter_by(talk_id=talk_id)
+        .with_entities(
+            Talk.updated,
+            votes.with_entities(func.count()).as_scalar(),
+            votes.with_entities(func.max(Vote.updated)).as_scalar(),
+            speakers.with_entities(func.count()).as_scalar(),
+            speakers.with_entities(func.max(TalkSpeaker.updated)).as_scalar(),
+            users.with_entities(func.max(User.updated)).as_scalar(),
+            surveys.with_entities(func.max(DemographicSurvey.updated)).as_scalar(),
+            categories.with_entities(
+                func.array_agg(aggregate_order_by(Category.name, Category.name))
+            ).as_scalar(),
+        )
+        .first_or_404()
+    )
+    validators = PageValidators(*versions)
+    if validators.fresh():
+        return validators.make_response(status=304)
+
+    talk = Talk.query.get(talk_id)
+    votes = Vote.query.filter_by(talk_id=talk_id)
+    return validators.make_response(
+        render_template("vote/full_detail.html", talk=talk, votes=votes)
     )
 
 
@@ -544,6 +646,7 @@ def conduct_report() -> Response:
     db.session.add(report)
     db.session.commit()
     mail.send_mail(to=[g.conference.conduct_email], template="email/conduct-report")
+    db.session.commit()
     flash("Thank you for your report. Our team will review it shortly.")
     return redirect(request.referrer)
 
@@ -579,6 +682,7 @@ def edit_speakers(talk_id: int) -> Response:
             db.session.rollback()
 
         mail.send_mail(to=[email], template="email/co-presenter-invite", talk=talk)
+        db.session.commit()
 
         return redirect(url_for("views.edit_speakers", talk_id=talk.talk_id))
 
@@ -656,8 +760,12 @@ def reject_invite(talk_id: int) -> Response:
 @app.route("/talks/<int:talk_id>/preview")
 @login_required
 def preview_talk(talk_id: int) -> Response:
+    validators = PageValidators(load_talk_updated(talk_id))
+    if validators.fresh():
+        return validators.make_response(status=304)
+
     talk = load_talk(talk_id)
-    return render_template("preview_talk.html", talk=talk)
+    return validators.make_response(render_template("preview_talk.html", talk=talk))
 
 
 @app.route("/talks/new", methods=["GET", "POST"])
@@ -671,6 +779,9 @@ def create_talk() -> Response:
         form.populate_obj(talk)
         db.session.add(talk)
         db.session.commit()
+        markdown_cache.prerender(
+            talk.description, talk.outline, talk.requirements, talk.take_aways
+        )
         return redirect(url_for("views.preview_talk", talk_id=talk.talk_id))
 
     return render_template("edit_talk.html", talk=talk, form=form)
@@ -0,0 +1,203 @@
+"""
+Per-reviewer queues of talks to vote on.
+
+Choosing the next talk for a reviewer means finding the least-voted talks
+in a category that the reviewer hasn't seen yet. Rather than sorting the
+whole category on every click, each process keeps a short queue of
+candidate talk IDs per (user, category), refilled a batch at a time.
+
+Queues are per process, so each candidate is re-checked with a cheap
+primary key lookup when it is taken off the queue. Votes cast by other
+reviewers since the batch was fetched are tolerated, up to
+``MAX_STALE_VOTES`` per talk; past that, the rest of the batch is
+probably stale too, so the queue is refilled instead. Changes that make
+a talk ineligible (withdrawal, de-anonymization, re-categorization) also
+drop it from this process's queues right away.
+
+Only the ``MAX_QUEUES`` most recently used queues are kept.
+
+"""
+from collections import deque, OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Any, Deque, List, Optional, Tuple
+
+from sqlalchemy import event, func
+
+from yakbak.models import Category, db, Talk, TalkCategory, TalkStatus, User, Vote
+
+# how many candidates to fetch per refill; small batches keep the
+# distribution of votes fair when many reviewers are voting at once
+BATCH_SIZE = 10
+
+# refill queues at least this often (in seconds), so that the ordering
+# follows votes cast by other reviewers
+MAX_AGE = 300
+
+# how many votes a queued talk may get from other reviewers and still be
+# served; during a review sprint, nearly every queued talk gets a vote or
+# two before it is served, and refilling for each one would cost more
+# than sorting the category on every click
+MAX_STALE_VOTES = 2
+
+# one queue per reviewer and category they are voting in
+MAX_QUEUES = 1000
+
+# a queued talk ID, and its vote count when it was queued
+Candidate = Tuple[int, int]
+# when a queue was filled, and the candidates left in it
+Queue = Tuple[float, Deque[Candidate]]
+
+
+class VoteQueues:
+    def __init__(
+        self,
+        batch_size: int = BATCH_SIZE,
+        max_age: float = MAX_AGE,
+        max_stale_votes: int = MAX_STALE_VOTES,
+        maxsize: int = MAX_QUEUES,
+    ) -> None:
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self.max_stale_votes = max_stale_votes
+        self.maxsize = maxsize
+        self._queues: "OrderedDict[Tuple[int, int], Queue]" = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._queues)
+
+    def next_talk(self, user: User, category: Category) -> Optional[Talk]:
+        """
+        Return the next talk for ``user`` to vote on in ``category``.
+
+        Talks with the fewest votes come first, with ties broken at
+        random. Returns ``None`` if no talks are left to vote on.
+
+        """
+        key = (user.user_id, category.category_id)
+        while True:
+            candidate = self._pop(key)
+            refilled = candidate is None
+            if candidate is None:
+                candidates = self._candidates(user, category)
+                if not candidates:
+                    return None
+                candidate = candidates.pop(0)
+                self._push(key, candidates)
+
+            talk_id, vote_count = candidate
+            talk = self._eligible_talk(talk_id, user, category)
+            if talk is None:
+                continue
+            if refilled or talk.vote_count - vote_count <= self.max_stale_votes:
+                return talk
+            # others have voted a lot since the batch was fetched, so it
+            # probably no longer holds the least-voted talks
+            self._drop(key)
+
+    def discard_talk(self, talk_id: int) -> None:
+        """Remove ``talk_id`` from every queue."""
+        with self._lock:
+            for _, queue in self._queues.values():
+                for candidate in [c for c in queue if c[0] == talk_id]:
+                    queue.remove(candidate)
+
+    def discard_category(self, category_id: int) -> None:
+        """Drop every queue for ``category_id``, so they are refilled."""
+        with self._lock:
+            for key in [k for k in self._queues if k[1] == category_id]:
+                del self._queues[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._queues.clear()
+
+    def _pop(self, key: Tuple[int, int]) -> Optional[Candidate]:
+        with self._lock:
+            entry = self._queues.get(key)
+            if entry is None:
+                return None
+            filled, queue = entry
+            if not queue or monotonic() - filled > self.max_age:
+                del self._queues[key]
+                return None
+            self._queues.move_to_end(key)
+            return queue.popleft()
+
+    def _push(self, key: Tuple[int, int], candidates: List[Candidate]) -> None:
+        with self._lock:
+            self._queues[key] = (monotonic(), deque(candidates))
+            self._queues.move_to_end(key)
+            while len(self._queues) > self.maxsize:
+                self._queues.popitem(last=False)
+
+    def _drop(self, key: Tuple[int, int]) -> None:
+        with self._lock:
+            self._queues.pop(key, None)
+
+    def _candidates(self, user: User, category: Category) -> List[Candidate]:
+        rows = (
+            db.session.query(Talk.talk_id, Talk.vote_count)
+            .join(TalkCategory)
+            .filter(
+                Talk.is_anonymized == True,  # noqa: E712
+                Talk.state == TalkStatus.PROPOSED,
+                Talk.talk_id.notin_(
+                    db.session.query(Vote.talk_id).filter(Vote.user == user)
+                ),
+                TalkCategory.category_id == category.category_id,
+            )
+            .order_by(Talk.vote_count.asc(), func.random())
+            .limit(self.batch_size)
+        )
+        return [(talk_id, vote_count) for talk_id, vote_count in rows]
+
+    def _eligible_talk(
+        self, talk_id: int, user: User, category: Category
+    ) -> Optional[Talk]:
+        # another process may have changed the talk, or the user may have
+        # voted on it from another process, since the queue was filled
+        return (
+            db.session.query(Talk)
+            .join(TalkCategory)
+            .filter(
+                Talk.talk_id == talk_id,
+                Talk.is_anonymized == True,  # noqa: E712
+                Talk.state == TalkStatus.PROPOSED,
+                ~db.session.query(Vote)
+                .filter(Vote.talk_id == talk_id, Vote.user == user)
+                .exists(),
+                TalkCategory.category_id == category.category_id,
+            )
+            .first()
+        )
+
+
+vote_queues = VoteQueues()
+
+
+@event.listens_for(Talk.state, "set")
+@event.listens_for(Talk.is_anonymized, "set")
+def _discard_changed_talk(
+    talk: Talk, value: Any, oldvalue: Any, initiator: Any
+) -> None:
+    if talk.talk_id is not None and value != oldvalue:
+        vote_queues.discard_talk(talk.talk_id)
+
+
+@event.listens_for(Talk.categories, "append")
+@event.listens_for(Talk.categories, "remove")
+def _discard_recategorized_talk(talk: Talk, category: Category, initiator: Any) -> None:
+    if talk.talk_id is not None:
+        vote_queues.discard_talk(talk.talk_id)
+    if category.category_id is not None:
+        vote_queues.discard_category(category.category_id)
+
+
+@event.listens_for(Category.talks, "append")
+@event.listens_for(Category.talks, "remove")
+def _discard_recategorized_talk_from_category(
+    category: Category, talk: Talk, initiator: Any
+) -> None:
+    _discard_recategorized_talk(talk, category, initiator)